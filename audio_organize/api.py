@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import io
+import os
+import tempfile
+# custom lib
+from . import subprog
+# registers all subprograms
+from . import audio_organizer
+
+
+# results: list of subprog.FileResult in finishing order; failed: number of
+# failed files, also those without a FileResult; log: captured stderr
+RunResult = collections.namedtuple("RunResult",
+	["subprog", "results", "failed", "log"])
+
+# {subprog name: {dest: argparse action}}
+_actions = dict()
+
+
+def _get_actions(name) -> dict:
+	if name not in _actions:
+		sp = argparse.ArgumentParser().add_subparsers()
+		ap = subprog.SubprogReg.get_subprog_class(name)().create_argparser(sp)
+		_actions[name] = {a.dest: a for a in ap._actions\
+			if a.dest != argparse.SUPPRESS and a.dest != "help"}
+	return _actions[name]
+
+
+def _convert(action, value):
+	if isinstance(value, str) and (action.type not in (None, str)):
+		value = action.type(value)
+	if (action.choices is not None) and (value not in action.choices):
+		raise ValueError("invalid value for '%s': %s (choices: %s)"\
+			% (action.dest, repr(value), ", ".join(map(str, action.choices))))
+	return value
+
+
+def get_args(name, options: dict) -> argparse.Namespace:
+	"""
+	build refined args of a subprogram from keyword options
+	"""
+	actions = _get_actions(name)
+	unknown = set(options) - set(actions)
+	if unknown:
+		raise TypeError("unknown option(s) of '%s': %s"\
+			% (name, ", ".join(sorted(unknown))))
+	args = argparse.Namespace(subprog = name)
+	for dest, action in actions.items():
+		if dest in options:
+			value = options[dest]
+			if isinstance(value, (list, tuple)):
+				value = [_convert(action, v) for v in value]
+			elif value is not None:
+				value = _convert(action, value)
+		elif action.required:
+			raise TypeError("'%s' requires option '%s'" % (name, dest))
+		else:
+			value = action.default
+			if isinstance(value, str) and (action.type not in (None, str)):
+				value = action.type(value)
+		setattr(args, dest, value)
+	return subprog.SubprogReg.get_subprog_class(name)().refine_args(args)
+
+
+def run(name, files = None, **options) -> RunResult:
+	"""
+	run subprogram <name> in-process with the same code as the command line;
+	files (iterable of str) is used as its list, or the list option (file
+	name) if not given; e.g.
+
+		res = api.run("remap_metadata", files, rename_pattern = "%T - %a",
+			transcode = "flac", jobs = 4)
+		failed = [r.file for r in res.results if not r.ok]
+
+	options are dest names of the command line options (see
+	'audio-organize <subprog> --help'), string values are converted as on
+	the command line; logs go to os.devnull unless log_file is set, stderr
+	messages are returned as RunResult.log unless err_file is set; runs share
+	no state, and can be called from several threads at a time
+	"""
+	if files is not None:
+		options["list"] = io.StringIO(("").join(f + "\n" for f in files))
+	# subprocesses write logs by file descriptors
+	capture = options.get("err_file") is None
+	options.setdefault("log_file", os.devnull)
+	options.setdefault("progress", "off")
+	with tempfile.TemporaryFile("w+", encoding = "utf-8") as err:
+		if capture:
+			options["err_file"] = os.fdopen(os.dup(err.fileno()), "w",
+				encoding = "utf-8")
+		try:
+			args = get_args(name, options)
+			sp = subprog.SubprogReg.get_subprog_class(name)()
+			sp.results = list()
+			sp.subprog_main(args)
+		finally:
+			# already closed with the logs, unless failed before
+			if capture:
+				options["err_file"].close()
+		err.seek(0)
+		log = err.read() if capture else None
+	n_failed = max(sum(not r.ok for r in sp.results),
+		sp.progress.failed if sp.progress is not None else 0)
+	return RunResult(name, sp.results, n_failed, log)
+
+
+# entry points of batch subprograms
+def parse_metadata(files, pattern, **options) -> RunResult:
+	"""
+	parse metadata sidecars from file names; pattern = 'auto' to infer
+	"""
+	return run("parse_metadata", files, pattern = pattern, **options)
+
+
+def remap(files, **options) -> RunResult:
+	"""
+	remap metadata into audio files, e.g. rename_pattern = "%T - %a",
+	transcode = "flac"
+	"""
+	return run("remap_metadata", files, **options)
+
+
+def normalize_metadata(files, rules, **options) -> RunResult:
+	"""
+	normalize metadata by a json rule file
+	"""
+	return run("normalize_metadata", files, rules = rules, **options)
+
+
+def sort_by_metadata(files, pattern, **options) -> RunResult:
+	return run("sort_by_metadata", files, pattern = pattern, **options)
+
+
+def verify(files, **options) -> RunResult:
+	return run("verify", files, **options)
+
+
+def peaks(files, **options) -> RunResult:
+	return run("peaks", files, **options)
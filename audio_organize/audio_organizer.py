@@ -9,14 +9,25 @@ from .metadata import Metadata
 # subprogram registry automatically during importing
 from . import clean_temps
 from . import draw_spectrogram
+from . import extract_cover
+from . import find_duplicates
 from . import dump_metadata
+from . import normalize_metadata
 from . import parse_metadata
+from . import peaks
+from . import query
 from . import remap_metadata
+from . import replaygain
 from . import rename_conflict
 from . import sort_by_metadata
 from . import sort_disc_track
+from . import split_by_chapter
 from . import split_by_cue
+from . import stats
 from . import strip_cv
+from . import undo
+from . import verify
+from . import work_queue
 
 
 # main program class
@@ -42,7 +53,11 @@ class AudioOrganizer(object):
 	def parse_args(self):
 		self.args = self.argparser.parse_args()
 		# refine args with subprog refine function
-		self.subprogs.get_subprog(self.args.subprog).refine_args(self.args)
+		subprog = self.subprogs.get_subprog(self.args.subprog)
+		try:
+			subprog.refine_args(self.args)
+		except subprog.ArgsError as e:
+			subprog.argparser.error(str(e))
 		return self.args
 
 	def call_arg_subprog_main(self):
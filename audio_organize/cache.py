@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import json
+import os
+# custom lib
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class FileResultCache(dict):
+	"""
+	per-file results persisted in a json-lines file; a cached result is only
+	valid while the file keeps the same size and modification time
+	"""
+	def __init__(self, *ka, cache_file = None, **kw):
+		super().__init__(*ka, **kw)
+		self.cache_file = cache_file
+		self._dirty = False
+		return
+
+	@classmethod
+	def load(cls, cache_file):
+		new = cls(cache_file = cache_file)
+		if cache_file and os.path.exists(cache_file):
+			with open(cache_file, "r", encoding = "utf-8") as fp:
+				for line in fp:
+					if line.strip():
+						row = json.loads(line)
+						new[row["path"]] = (row["size"], row["mtime_ns"],
+							row["value"])
+		return new
+
+	def save(self):
+		if (not self.cache_file) or (not self._dirty):
+			return
+		fp, temp = self.util.atomic_open(self.cache_file, "w",
+			encoding = "utf-8")
+		for path, (size, mtime_ns, value) in self.items():
+			fp.write(json.dumps(dict(path = path, size = size,
+				mtime_ns = mtime_ns, value = value), ensure_ascii = False)\
+				+ "\n")
+		self.util.atomic_commit(fp, temp, self.cache_file)
+		self._dirty = False
+		return
+
+	@staticmethod
+	def _key_stat(fname):
+		st = os.stat(fname)
+		return os.path.abspath(fname), st.st_size, st.st_mtime_ns
+
+	def get_result(self, fname, default = None):
+		"""
+		cached result of a file, or <default> if not cached, outdated or the
+		file is missing
+		"""
+		try:
+			path, size, mtime_ns = self._key_stat(fname)
+		except OSError:
+			return default
+		cached = self.get(path)
+		if (cached is None) or (cached[0] != size) or (cached[1] != mtime_ns):
+			return default
+		return cached[2]
+
+	def set_result(self, fname, value):
+		path, size, mtime_ns = self._key_stat(fname)
+		self[path] = (size, mtime_ns, value)
+		self._dirty = True
+		return
+
+	def discard_result(self, fname):
+		if self.pop(os.path.abspath(fname), None) is not None:
+			self._dirty = True
+		return
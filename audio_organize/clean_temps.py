@@ -19,7 +19,7 @@ class SubprogCleanTemps(subprog.SubprogWithLogBase,
 
 	@subprog.SubprogWithLogBase.with_log()
 	def subprog_main(self, args):
-		for fname in self.read_list(args):
+		for fname in self.progress.iter(self.read_list(args)):
 			ffmetadata = Metadata.standard_ffmetadata(fname)
 			for f in [fname, ffmetadata]:
 				if os.path.exists(f):
@@ -23,7 +23,7 @@ class SubprogDrawSpectrogram(subprog.SubprogWithLogBase,
 
 	@subprog.SubprogWithLogBase.with_log()
 	def subprog_main(self, args):
-		for fname in self.read_list(args):
+		for fname in self.progress.iter(self.read_list(args)):
 			spec = self.util.append_filename_extension(fname, args.image_format)
 			cmd = [args.sox, self.util.fname_prevent_monkey_patch(fname), "-n",
 				"spectrogram", "-o", self.util.fname_prevent_monkey_patch(spec)]
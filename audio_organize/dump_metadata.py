@@ -10,25 +10,53 @@ from .metadata import Metadata
 	desc = "dump metadata from audio files on a list; 'ffmpeg' must be "
 		"available")
 class SubprogDumpMetadata(subprog.SubprogWithLogBase,
-		subprog.ListBasedSubprogBase):
+		subprog.MetadataListBasedSubprogBase):
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_device_jobs
 	@subprog.SubprogBase.append_opt_program("ffmpeg")
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		return ap
 
+	def _dump_to_text(self, args, fname) -> str:
+		cmd = [args.ffmpeg, "-nostdin", "-i",
+			self.util.fname_prevent_monkey_patch(fname),
+			"-c:a", "discard", "-f", "ffmetadata", "-"]
+		return self.logged_external_output(cmd, dry_run = args.dry_run,
+			verbose = args.verbose)
+
+	def _dump_to_file(self, args, fname):
+		ffmetadata = Metadata.standard_ffmetadata(fname)
+		cmd = [args.ffmpeg, "-nostdin"]
+		if args.force:
+			cmd.append("-y")
+		cmd.extend(["-i", self.util.fname_prevent_monkey_patch(fname),
+			"-c:a", "discard", "-f", "ffmetadata",
+			self.util.fname_prevent_monkey_patch(ffmetadata)])
+		return self.logged_external_call(cmd, dry_run = args.dry_run,
+			verbose = args.verbose)
+
+	def _dump_to_manifest(self, args):
+		fnames = self.read_list(args)
+		with self.open_metadata_output(args, force = args.force) as output:
+			for fname, text in zip(fnames, self.iter_parallel(
+					lambda f: self._dump_to_text(args, f), fnames,
+					jobs = args.jobs, path_of = lambda f: f,
+					device_jobs = args.device_jobs)):
+				if text is not None:
+					metadata = Metadata.parse_ffmetadata_str(text)
+					output.save(fname, metadata)
+		return
+
 	@subprog.SubprogWithLogBase.with_log()
 	def subprog_main(self, args):
-		for fname in self.read_list(args):
-			ffmetadata = Metadata.standard_ffmetadata(fname)
-			cmd = [args.ffmpeg]
-			if args.force:
-				cmd.append("-y")
-			cmd.extend(["-i", self.util.fname_prevent_monkey_patch(fname),
-				"-c:a", "discard", "-f", "ffmetadata",
-				self.util.fname_prevent_monkey_patch(ffmetadata)])
-			self.logged_external_call(cmd, dry_run = args.dry_run,
-				verbose = args.verbose)
+		if args.manifest:
+			return self._dump_to_manifest(args)
+		for _ in self.iter_parallel(lambda f: self._dump_to_file(args, f),
+				self.read_list(args), jobs = args.jobs, path_of = lambda f: f,
+				device_jobs = args.device_jobs):
+			pass
 		return
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import csv
+import hashlib
+import os
+# custom lib
+from . import subprog
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class CoverIndex(dict):
+	"""
+	album -> cover image file mapping, stored as tsv in the cover directory;
+	image file names are relative to the cover directory
+	"""
+	INDEX_FNAME = "index.tsv"
+	COLUMNS = ["album", "cover"]
+	# file signatures of common attached picture formats
+	IMAGE_MAGIC = [(b"\x89PNG", "png"), (b"\xff\xd8", "jpg"),
+		(b"GIF8", "gif"), (b"BM", "bmp")]
+
+	def __init__(self, *ka, cover_dir, **kw):
+		super().__init__(*ka, **kw)
+		self.cover_dir = cover_dir
+		return
+
+	@property
+	def index_fname(self):
+		return os.path.join(self.cover_dir, self.INDEX_FNAME)
+
+	@classmethod
+	def load(cls, cover_dir):
+		new = cls(cover_dir = cover_dir)
+		if os.path.exists(new.index_fname):
+			with open(new.index_fname, "r", encoding = "utf-8", newline = "")\
+					as fp:
+				for row in csv.DictReader(fp, dialect = "excel-tab"):
+					new[row["album"]] = row["cover"]
+		return new
+
+	def save(self):
+		os.makedirs(self.cover_dir, exist_ok = True)
+		fp, temp = self.util.atomic_open(self.index_fname, "w",
+			encoding = "utf-8", newline = "")
+		writer = csv.DictWriter(fp, self.COLUMNS, dialect = "excel-tab")
+		writer.writeheader()
+		for k in sorted(self.keys()):
+			writer.writerow({"album": k, "cover": self[k]})
+		self.util.atomic_commit(fp, temp, self.index_fname)
+		return
+
+	def get_cover_path(self, album_key):
+		cover = self.get(album_key)
+		return None if cover is None else os.path.join(self.cover_dir, cover)
+
+	@classmethod
+	def guess_image_extension(cls, fname):
+		with open(fname, "rb") as fp:
+			head = fp.read(8)
+		for magic, ext in cls.IMAGE_MAGIC:
+			if head.startswith(magic):
+				return ext
+		return None
+
+
+@subprog.SubprogReg.new_subprog("extract_cover",
+	help = "extract embedded cover art once per album on a list",
+	desc = "extract the attached picture of one file per album on a list into "
+		"a shared cover directory; identical images are stored once, and can "
+		"optionally be downscaled; remap_metadata --cover-dir embeds them "
+		"back; 'ffmpeg' must be available")
+class SubprogExtractCover(subprog.SubprogWithLogBase,
+		subprog.MetadataListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("ffmpeg")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("-o", "--cover-dir", type = str, default = "covers",
+			metavar = "dir",
+			help = "directory to store cover images and their index "
+				"(default: covers)")
+		ap.add_argument("--max-size", type = util.PosInt, default = None,
+			metavar = "px",
+			help = "downscale covers larger than <px> in either dimension, "
+				"re-encoded as jpg (default: keep original)")
+		return ap
+
+	def _extract(self, args, fname, output) -> bool:
+		cmd = [args.ffmpeg, "-nostdin", "-y",
+			"-i", self.util.fname_prevent_monkey_patch(fname), "-an",
+			"-map", "0:v:0"]
+		if args.max_size:
+			cmd.extend(["-vf", ("scale=w='min(%d,iw)':h='min(%d,ih)'"
+				":force_original_aspect_ratio=decrease")\
+				% (args.max_size, args.max_size), "-c:v", "mjpeg",
+				"-q:v", "2"])
+		else:
+			cmd.extend(["-c", "copy"])
+		cmd.extend(["-frames:v", "1", "-f", "image2",
+			self.util.fname_prevent_monkey_patch(output)])
+		ret = self.logged_external_call(cmd, dry_run = args.dry_run,
+			verbose = args.verbose)
+		return (not ret) and (args.dry_run or os.path.getsize(output) > 0)
+
+	def _extract_album(self, args, job):
+		"""
+		extract cover from the first file having one in an album; returns
+		the stored cover file name (relative to cover dir) or None
+		"""
+		album, fnames = job
+		temp = self.util.get_temp_fname(os.path.join(args.cover_dir, "cover"))
+		try:
+			for fname in fnames:
+				if self._extract(args, fname, temp):
+					break
+			else:
+				self.log_err("skipping album: %s (no cover found)\n" % album)
+				return None
+			if args.dry_run:
+				return None
+			with open(temp, "rb") as fp:
+				digest = hashlib.sha256(fp.read()).hexdigest()[:32]
+			ext = "jpg" if args.max_size\
+				else (CoverIndex.guess_image_extension(temp) or "bin")
+			cover = self.util.append_filename_extension(digest, ext)
+			# identical images are stored once
+			os.replace(temp, os.path.join(args.cover_dir, cover))
+			if args.verbose:
+				self.log_err("cover: %s -> %s\n" % (album, cover))
+			return cover
+		finally:
+			if os.path.exists(temp):
+				os.remove(temp)
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		index = CoverIndex.load(args.cover_dir)
+		albums = dict()
+		for fname, metadata in self.iter_list_metadata(args):
+			key = metadata.get_album_key(fname)
+			if (key in index) and (not args.force):
+				continue
+			albums.setdefault(key, list()).append(fname)
+		if not args.dry_run:
+			os.makedirs(args.cover_dir, exist_ok = True)
+		for album, cover in zip(albums.keys(), self.iter_parallel(
+				lambda job: self._extract_album(args, job), albums.items(),
+				jobs = args.jobs)):
+			if cover is not None:
+				index[album] = cover
+		if not args.dry_run:
+			index.save()
+		self.log_err("covers: %d albums, %d unique images\n"\
+			% (len(index), len(set(index.values()))))
+		return
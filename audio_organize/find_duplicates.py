@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import array
+import base64
+import collections
+import json
+import os
+import random
+import sys
+# custom lib
+from . import subprog
+from . import util
+from .cache import FileResultCache
+
+
+class Fingerprint(array.array):
+	"""
+	chromaprint raw fingerprint: one 32-bit sub-fingerprint per ~0.124s of
+	audio, each bit from the change of chroma features; re-encoded copies of
+	the same recording differ in a small fraction of bits
+	"""
+	# bits set in each 16-bit value
+	_POPCOUNT16 = bytes(bin(i).count("1") for i in range(1 << 16))
+
+	def __new__(cls, values = ()):
+		return super().__new__(cls, "I", values)
+
+	@classmethod
+	def from_fpcalc_output(cls, text: str):
+		"""
+		parse 'fpcalc -raw' output, None if it has no fingerprint
+		"""
+		for line in text.splitlines():
+			if line.startswith("FINGERPRINT="):
+				values = line.partition("=")[2]
+				return cls(int(v) & 0xffffffff for v in values.split(",")\
+					if v) if values else None
+		return None
+
+	# compact text form to store in a cache
+	def to_str(self) -> str:
+		data = array.array("I", self)
+		if sys.byteorder == "big":
+			data.byteswap()
+		return base64.b64encode(data.tobytes()).decode("ascii")
+
+	@classmethod
+	def from_str(cls, s: str):
+		new = cls()
+		new.frombytes(base64.b64decode(s))
+		if sys.byteorder == "big":
+			new.byteswap()
+		return new
+
+	def bit_error_rate(self, other, offset = 0) -> float:
+		"""
+		fraction of differing bits with self[i + offset] aligned to other[i],
+		over the overlapping part; 1.0 if not overlapping
+		"""
+		pairs = zip(self[max(offset, 0):], other[max(-offset, 0):])
+		pop, n, errors = self._POPCOUNT16, 0, 0
+		for a, b in pairs:
+			x = a ^ b
+			errors += pop[x & 0xffff] + pop[x >> 16]
+			n += 1
+		return errors / (32 * n) if n else 1.0
+
+
+class FingerprintIndex(object):
+	"""
+	locality-sensitive hashing index of fingerprints for near-duplicate
+	search; each fingerprint is reduced to the set of its sub-fingerprints
+	(masked to some of their bits, which survive re-encoding more often),
+	summarized by a minhash signature (one-permutation hashing into bins),
+	and the signature is split into bands; fingerprints sharing any band are
+	candidates, verified by the bit error rate at their best alignment; the
+	number of compared pairs grows with the bucket sizes instead of
+	quadratically, and each fingerprint takes one bucket entry per band
+	"""
+	_HASH_MUL = 0x9e3779b1
+	_EMPTY = 1 << 32
+
+	def __init__(self, *ka, bands = 64, rows = 2, mask_bits = 18,
+			max_bucket = 256, seed = 0, **kw):
+		super().__init__(*ka, **kw)
+		rng = random.Random(seed)
+		self.mask = sum(1 << b for b in rng.sample(range(32), mask_bits))
+		self.bands = bands
+		self.rows = rows
+		# larger buckets (e.g. of silence) are not searched or extended
+		self.max_bucket = max_bucket
+		self.fingerprints = list()
+		# {(band, minhashes of the band): [id, ...]}
+		self._buckets = collections.defaultdict(list)
+		return
+
+	def get_signature(self, fp) -> list:
+		n_bins = self.bands * self.rows
+		mins = [self._EMPTY] * n_bins
+		for v in set(v & self.mask for v in fp):
+			h = (v * self._HASH_MUL) & 0xffffffff
+			# by high bits, low bits of h only depend on low bits of v
+			i = (h * n_bins) >> 32
+			if h < mins[i]:
+				mins[i] = h
+		return mins
+
+	def _iter_keys(self, fp):
+		sig = self.get_signature(fp)
+		for b in range(self.bands):
+			band = tuple(sig[b * self.rows:(b + 1) * self.rows])
+			# empty bins are equal in unrelated fingerprints
+			if self._EMPTY not in band:
+				yield (b, band)
+		return
+
+	def get_offset(self, fp, i) -> int:
+		"""
+		best alignment of fp to fingerprint i, as the most common position
+		difference of equal masked sub-fingerprints; fp[pos] is aligned to
+		the fingerprint at [pos - offset]
+		"""
+		positions = dict()
+		for pos, v in enumerate(self.fingerprints[i]):
+			positions.setdefault(v & self.mask, pos)
+		offsets = collections.Counter(pos - positions[v & self.mask]\
+			for pos, v in enumerate(fp) if (v & self.mask) in positions)
+		return offsets.most_common(1)[0][0] if offsets else 0
+
+	def add(self, fp) -> set:
+		"""
+		add a fingerprint, returns ids of earlier fingerprints sharing a band
+		"""
+		new_id = len(self.fingerprints)
+		ret = set()
+		for key in self._iter_keys(fp):
+			bucket = self._buckets[key]
+			if len(bucket) <= self.max_bucket:
+				ret.update(bucket)
+				bucket.append(new_id)
+		self.fingerprints.append(fp)
+		return ret
+
+
+@subprog.SubprogReg.new_subprog("find_duplicates",
+	help = "find near-duplicate audio files on a list by acoustic fingerprints",
+	desc = "find audio files of the same recording on a list, also across "
+		"bitrates and encoders, by comparing chromaprint fingerprints from "
+		"'fpcalc'; fingerprints are cached, and candidates are found with a "
+		"locality-sensitive hashing index instead of comparing all pairs; "
+		"outputs groups as json lines and/or a list of duplicates to remove "
+		"(all but the largest file of each group)")
+class SubprogFindDuplicates(subprog.SubprogWithLogBase,
+		subprog.ListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("fpcalc")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("-o", "--output", type = str, default = "-",
+			metavar = "file",
+			help = "write duplicates to remove as a list, all files of each "
+				"group except the largest, '-' for stdout (default: -)")
+		ap.add_argument("-g", "--groups", type = str, default = None,
+			metavar = "file",
+			help = "write each group of duplicates as a json list of file "
+				"names per line, largest file first (default: no)")
+		ap.add_argument("--cache", type = str,
+			default = ".fingerprint_cache.jsonl", metavar = "file",
+			help = "fingerprint cache file, '' to disable "
+				"(default: .fingerprint_cache.jsonl)")
+		ap.add_argument("--length", type = util.PosInt, default = 120,
+			metavar = "seconds",
+			help = "fingerprint the first <length> seconds (default: 120)")
+		ap.add_argument("--max-error", type = float, default = 0.15,
+			metavar = "float",
+			help = "max bit error rate between fingerprints of duplicates; "
+				"unrelated audio is at about 0.5 (default: 0.15)")
+		return ap
+
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		if args.output == "-":
+			args.output = sys.stdout
+		return args
+
+	def _fingerprint(self, args, cache, fname):
+		"""
+		returns Fingerprint of a file, None on failure
+		"""
+		params = "%d:" % args.length
+		cached = cache.get_result(fname)
+		if cached and cached.startswith(params):
+			return Fingerprint.from_str(cached[len(params):])
+		cmd = [args.fpcalc, "-raw", "-length", str(args.length),
+			self.util.fname_prevent_monkey_patch(fname)]
+		out = self.logged_external_output(cmd, verbose = args.verbose)
+		fp = None if out is None else Fingerprint.from_fpcalc_output(out)
+		if fp:
+			cache.set_result(fname, params + fp.to_str())
+		return fp
+
+	@staticmethod
+	def _group(n, pairs) -> list:
+		"""
+		connected components of pairs of ids, as lists of ids
+		"""
+		parent = list(range(n))
+		def find(i):
+			while parent[i] != i:
+				parent[i] = parent[parent[i]]
+				i = parent[i]
+			return i
+		for i, j in pairs:
+			parent[find(i)] = find(j)
+		groups = collections.defaultdict(list)
+		for i in range(n):
+			groups[find(i)].append(i)
+		return [g for g in groups.values() if len(g) > 1]
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		cache = FileResultCache.load(args.cache)
+		fnames, index = list(), FingerprintIndex()
+		pairs = list()
+		files = self.read_list(args)
+		for fname, fp in zip(files, self.iter_parallel(
+				lambda f: self._fingerprint(args, cache, f), files,
+				jobs = args.jobs, path_of = lambda f: f)):
+			if not fp:
+				self.log_err("[NoFingerprint]: %s\n" % fname)
+				self.progress.fail()
+				continue
+			for i in sorted(index.add(fp)):
+				error = fp.bit_error_rate(index.fingerprints[i],
+					index.get_offset(fp, i))
+				if args.verbose:
+					self.log_err("compared: %s, %s (bit error rate %.3f)\n"\
+						% (fnames[i], fname, error))
+				if error <= args.max_error:
+					pairs.append((i, len(fnames)))
+			fnames.append(fname)
+		cache.save()
+		groups = [sorted((fnames[i] for i in g), reverse = True,
+			key = os.path.getsize) for g in self._group(len(fnames), pairs)]
+		fp = self.util.get_fp(args.output, "w", encoding = "utf-8")
+		for g in groups:
+			fp.writelines(f + "\n" for f in g[1:])
+		if fp is sys.stdout:
+			fp.flush()
+		else:
+			fp.close()
+		if args.groups:
+			with open(args.groups, "w", encoding = "utf-8") as fp:
+				for g in groups:
+					fp.write(json.dumps(g, ensure_ascii = False) + "\n")
+		self.log_err("found: %d groups, %d duplicates in %d files\n"\
+			% (len(groups), sum(len(g) - 1 for g in groups), len(fnames)))
+		return
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import time
+# custom lib
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class Journal(object):
+	"""
+	append-only journal of filesystem mutations, one json array per line:
+	["run", {subprog, time, pid, cwd}] starts the records of a run, followed
+	by [op, src, dst, inode] records; op is one of move, copy, create (dst
+	created from nothing, src is None), mkdir (dst only) and backup (an
+	existing src about to be overwritten, moved aside to dst); inode is of
+	dst after the operation, so that undo can tell if dst was changed since
+
+	each record is flushed as it is written, so that the journal of an
+	interrupted run is still complete up to the last mutation; mutations
+	keep <cache> (util.FsStateCache of the run, if any) up to date
+	"""
+	OPS = ["move", "copy", "create", "mkdir", "backup"]
+
+	class Run(object):
+		def __init__(self, header: dict, *ka, **kw):
+			super().__init__(*ka, **kw)
+			self.header = header
+			self.records = list()
+			return
+
+		def get_path(self, path):
+			return None if path is None\
+				else os.path.join(self.header["cwd"], path)
+
+	def __init__(self, fname, *ka, name = None, cache = None, **kw):
+		super().__init__(*ka, **kw)
+		self.fname = fname
+		self.cache = cache
+		self.fp = None
+		self._header = dict(subprog = name, time = time.time(),
+			pid = os.getpid(), cwd = os.getcwd())
+		# records are written from worker threads
+		self._lock = threading.Lock()
+		return
+
+	def _write(self, row):
+		# the run header is only written before the first record, so that
+		# runs without any mutation leave no trace
+		if self.fp is None:
+			self.fp = open(self.fname, "a", encoding = "utf-8")
+			self.fp.write(json.dumps(["run", self._header],
+				ensure_ascii = False) + "\n")
+		self.fp.write(json.dumps(row, ensure_ascii = False) + "\n")
+		self.fp.flush()
+		return
+
+	def record(self, op, src, dst):
+		if op not in self.OPS:
+			raise ValueError("invalid journal op '%s'" % op)
+		try:
+			inode = os.stat(dst).st_ino
+		except OSError:
+			inode = None
+		with self._lock:
+			self._write([op, src, dst, inode])
+		return
+
+	def close(self):
+		if self.fp is not None:
+			self.fp.close()
+			self.fp = None
+		return
+
+	@staticmethod
+	def get_backup_fname(fname):
+		return os.path.extsep.join([fname, os.urandom(4).hex(), "bak"])
+
+	def _backup(self, src, dst):
+		"""
+		move dst aside if it exists and is going to be overwritten (-f), so
+		that undo can restore it
+		"""
+		if self.util.lexists(dst, cache = self.cache)\
+				and (not self.util.samefile(src, dst, cache = self.cache)):
+			backup = self.get_backup_fname(dst)
+			self.util.move(dst, backup, cache = self.cache)
+			self.record("backup", dst, backup)
+		return
+
+	# journaled filesystem mutations
+	def move(self, src, dst):
+		dst = self.util.get_move_dst(src, dst, cache = self.cache)
+		self._backup(src, dst)
+		self.util.move(src, dst, cache = self.cache)
+		self.record("move", src, dst)
+		return
+
+	def copy(self, src, dst):
+		dst = self.util.get_move_dst(src, dst, cache = self.cache)
+		self._backup(src, dst)
+		self.util.copy(src, dst, cache = self.cache)
+		self.record("copy", src, dst)
+		return
+
+	def replace(self, temp, dst):
+		"""
+		move a finished temporary file into dst, recorded as created
+		"""
+		self._backup(temp, dst)
+		self.util.replace(temp, dst, cache = self.cache)
+		self.record("create", None, dst)
+		return
+
+	def makedirs(self, path):
+		"""
+		same as os.makedirs(path, exist_ok = True), recording each created
+		directory
+		"""
+		with self._lock:
+			for d in self.util.makedirs(path, cache = self.cache):
+				self._write(["mkdir", None, d, os.stat(d).st_ino])
+		return
+
+	@classmethod
+	def read_runs(cls, fname) -> list:
+		runs = list()
+		with open(fname, "r", encoding = "utf-8") as fp:
+			for line in fp:
+				if not line.strip():
+					continue
+				try:
+					row = json.loads(line)
+				except ValueError:
+					# last line of an interrupted write
+					continue
+				if row[0] == "run":
+					runs.append(cls.Run(row[1]))
+				elif runs:
+					runs[-1].records.append(row)
+		return runs
+
+	@classmethod
+	def write_runs(cls, fname, runs: list):
+		lines = list()
+		for run in runs:
+			lines.append(json.dumps(["run", run.header], ensure_ascii = False))
+			lines.extend(json.dumps(r, ensure_ascii = False)\
+				for r in run.records)
+		cls.util.atomic_write(fname, ("").join(l + "\n" for l in lines),
+			encoding = "utf-8")
+		return
+
+
+@util.StaticUtilityMethods.decorate
+class NullJournal(object):
+	"""
+	same interface as Journal, mutations are done without recording
+	"""
+	def __init__(self, *ka, cache = None, **kw):
+		super().__init__(*ka, **kw)
+		self.cache = cache
+		return
+
+	def record(self, op, src, dst):
+		return
+
+	def close(self):
+		return
+
+	def move(self, src, dst):
+		self.util.move(src, dst, cache = self.cache)
+		return
+
+	def copy(self, src, dst):
+		self.util.copy(src, dst, cache = self.cache)
+		return
+
+	def replace(self, temp, dst):
+		self.util.replace(temp, dst, cache = self.cache)
+		return
+
+	def makedirs(self, path):
+		self.util.makedirs(path, cache = self.cache)
+		return
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import os
+# custom lib
+from . import util
+from .metadata import Metadata
+
+
+@util.StaticUtilityMethods.decorate
+class MetadataManifest(object):
+	"""
+	single tabular file (csv/tsv/jsonl) storing metadata of many audio files,
+	keyed by audio file name; alternative to per-file ffmetadata sidecars
+
+	rows are read and written one at a time, memory use does not grow with the
+	number of rows
+	"""
+	class ManifestError(RuntimeError):
+		pass
+
+	FILE_COLUMN	= "file"
+	FORMATS		= ["csv", "tsv", "jsonl"]
+	_DIALECTS	= {"csv": "excel", "tsv": "excel-tab"}
+
+	def __init__(self, fname, *ka, format = None, encoding = "utf-8", **kw):
+		super().__init__(*ka, **kw)
+		self.fname = fname
+		self.format = format or self.guess_format(fname)
+		if self.format not in self.FORMATS:
+			raise self.ManifestError("invalid manifest format '%s'"\
+				% self.format)
+		self.encoding = encoding
+		return
+
+	@classmethod
+	def guess_format(cls, fname):
+		"""
+		guess manifest format by file extension, fallback to tsv
+		"""
+		ext = os.path.splitext(fname)[1][1:].lower()
+		return ext if ext in cls.FORMATS else "tsv"
+
+	@classmethod
+	def default_columns(cls):
+		return [cls.FILE_COLUMN] + [v.tag for v in Metadata.iter_valtypes()\
+			if not v.is_default()]
+
+	def exists(self):
+		return os.path.exists(self.fname)
+
+	def _open(self, fname, mode):
+		return open(fname, mode, encoding = self.encoding, newline = "")
+
+	def read_columns(self) -> list:
+		"""
+		column names in the header of an existing csv/tsv manifest; empty list
+		for jsonl manifests which have no fixed columns
+		"""
+		if self.format == "jsonl":
+			return list()
+		with self._open(self.fname, "r") as fp:
+			header = next(csv.reader(fp, dialect = self._DIALECTS[self.format]),
+				list())
+		return header
+
+	def _row_to_item(self, row: dict):
+		if self.FILE_COLUMN not in row:
+			raise self.ManifestError("column '%s' missing in manifest '%s'"\
+				% (self.FILE_COLUMN, self.fname))
+		fname = row.pop(self.FILE_COLUMN)
+		# csv reader puts cells beyond the header under key None
+		if any(row.pop(None, None) or ()):
+			raise self.ManifestError("row of '%s' has more cells than the "
+				"header in manifest '%s'" % (fname, self.fname))
+		metadata = Metadata()
+		for tag, value in row.items():
+			# empty cells are treated as missing tags
+			if (value is None) or (value == ""):
+				continue
+			tag = tag.lower()
+			valtype = Metadata.get_valtype_by_tag(tag, allow_default = True)
+			metadata[tag] = valtype.from_formatted(str(value))
+		return fname, metadata
+
+	def iter_items(self):
+		"""
+		yield (audio file name, metadata) pairs in manifest order
+		"""
+		with self._open(self.fname, "r") as fp:
+			if self.format == "jsonl":
+				for line in fp:
+					if line.strip():
+						yield self._row_to_item(json.loads(line))
+			else:
+				for row in csv.DictReader(fp,
+						dialect = self._DIALECTS[self.format]):
+					yield self._row_to_item(row)
+		return
+
+	def open_writer(self, *, columns = None, force = None, fsync = None):
+		"""
+		open a writer to (re-)write this manifest; by default, columns of the
+		existing manifest (if any) are kept in addition to all registered tags
+		"""
+		if columns is None:
+			columns = self.default_columns()
+			if self.exists():
+				columns += [c for c in self.read_columns() if c not in columns]
+		return type(self).Writer(self, columns = columns, force = force,
+			fsync = fsync)
+
+	class Writer(object):
+		"""
+		streaming manifest writer, rows go to a temporary file which replaces
+		the manifest on successful close; in csv/tsv manifests, tags not in the
+		columns are not stored, use jsonl to keep all tags
+		"""
+		def __init__(self, manifest, *ka, columns, force = None, fsync = None,
+				**kw):
+			super().__init__(*ka, **kw)
+			if manifest.exists() and (not force):
+				raise IOError("file '%s' already exists" % manifest.fname)
+			self.manifest = manifest
+			self.columns = columns
+			self.fsync = fsync
+			self._fp, self._temp = self.manifest.util.atomic_open(
+				manifest.fname, "w", encoding = manifest.encoding,
+				newline = "")
+			if manifest.format == "jsonl":
+				self._writer = None
+			else:
+				self._writer = csv.DictWriter(self._fp, columns,
+					dialect = manifest._DIALECTS[manifest.format],
+					extrasaction = "ignore")
+				self._writer.writeheader()
+			return
+
+		def save(self, fname, metadata):
+			row = {self.manifest.FILE_COLUMN: fname}
+			row.update((k, v.to_formatted()) for k, v in metadata.items())
+			if self._writer is None:
+				self._fp.write(json.dumps(row, ensure_ascii = False) + "\n")
+			else:
+				self._writer.writerow(row)
+			return
+
+		# in a manifest, unchanged rows must still be carried over
+		keep = save
+
+		def close(self, commit = True):
+			if commit:
+				self.manifest.util.atomic_commit(self._fp, self._temp,
+					self.manifest.fname, fsync = self.fsync)
+				if self.fsync is not None:
+					self.fsync.close()
+			else:
+				self.manifest.util.atomic_abort(self._fp, self._temp)
+			return
+
+		def __enter__(self):
+			return self
+
+		def __exit__(self, exc_type, exc_value, traceback):
+			self.close(commit = exc_type is None)
+			return
+
+
+@util.StaticUtilityMethods.decorate
+class SidecarMetadataOutput(object):
+	"""
+	metadata output writing per-file ffmetadata sidecars, counterpart of
+	MetadataManifest.Writer
+	"""
+	def __init__(self, *ka, force = None, fsync = None, **kw):
+		super().__init__(*ka, **kw)
+		self.force = force
+		self.fsync = fsync
+		return
+
+	def save(self, fname, metadata):
+		metadata.save_ffmetadata(Metadata.standard_ffmetadata(fname),
+			force = self.force, fsync = self.fsync)
+		return
+
+	def keep(self, fname, metadata):
+		# unchanged sidecars are left as is
+		return
+
+	def close(self, commit = True):
+		if self.fsync is not None:
+			self.fsync.close()
+		return
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close(commit = exc_type is None)
+		return
+
+
+class NullMetadataOutput(SidecarMetadataOutput):
+	"""
+	metadata output discarding everything, used in dry-run mode
+	"""
+	def save(self, fname, metadata):
+		return
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 
+import array
+import collections
+import concurrent.futures
+import hashlib
 import io
+import itertools
 import os
 import re
 # custom lib
@@ -16,6 +21,11 @@ class Metadata(dict):
 	HEAD_LINE	= ";FFMETADATA1"
 	TAG_SEP		= "="
 
+	# key=value with backslash escapes, split at the first unescaped '='
+	_FFMETADATA_TAG_REGEX = re.compile(r"((?:[^\\=]|\\.)+)=(.*)", re.DOTALL)
+	_FFMETADATA_ESCAPE_REGEX = re.compile(r"([=;#\\\n])")
+	_FFMETADATA_UNESCAPE_REGEX = re.compile(r"\\(.)", re.DOTALL)
+
 	_FORMATTER_BY_FMT = dict()
 	_FORMATTER_BY_TAG = dict()
 
@@ -64,6 +74,92 @@ class Metadata(dict):
 		def __repr__(self):
 			return repr(str(self))
 
+	class ChapterList(object):
+		"""
+		array-backed list of chapters; start, end and timebase (numerator and
+		denominator) of all chapters are stored in integer arrays, titles and
+		other chapter tags in plain lists
+		"""
+		Chapter = collections.namedtuple("Chapter",
+			["start", "end", "timebase", "title", "tags"])
+		# ffmpeg default when TIMEBASE is missing
+		DEFAULT_TIMEBASE = (1, 1000000000)
+
+		def __init__(self, *ka, **kw):
+			super().__init__(*ka, **kw)
+			self.starts = array.array("q")
+			self.ends = array.array("q")
+			self.tb_nums = array.array("q")
+			self.tb_dens = array.array("q")
+			self.titles = list()
+			# other tags per chapter, None for chapters without any
+			self.tags = list()
+			return
+
+		def __len__(self):
+			return len(self.starts)
+
+		def __getitem__(self, i):
+			return self.Chapter(self.starts[i], self.ends[i],
+				(self.tb_nums[i], self.tb_dens[i]), self.titles[i],
+				self.tags[i] or list())
+
+		def __iter__(self):
+			for i in range(len(self)):
+				yield self[i]
+			return
+
+		def append(self, start: int, end: int, *, timebase = None,
+				title = None, tags = None):
+			num, den = timebase or self.DEFAULT_TIMEBASE
+			self.starts.append(start)
+			self.ends.append(end)
+			self.tb_nums.append(num)
+			self.tb_dens.append(den)
+			self.titles.append(title)
+			self.tags.append(tags or None)
+			return
+
+		def get_seconds(self, i) -> (float, float):
+			scale = self.tb_nums[i] / self.tb_dens[i]
+			return self.starts[i] * scale, self.ends[i] * scale
+
+		def append_ffmetadata_items(self, items: list):
+			"""
+			append a chapter parsed from a ffmetadata [CHAPTER] section
+			"""
+			timing, title, tags = dict(), None, list()
+			for k, v in items:
+				lk = k.lower()
+				if lk in ("timebase", "start", "end"):
+					timing[lk] = v
+				elif lk == "title":
+					title = v
+				else:
+					tags.append((k, v))
+			try:
+				timebase = tuple(map(int, timing["timebase"].split("/")))\
+					if "timebase" in timing else None
+				self.append(int(timing["start"]), int(timing["end"]),
+					timebase = timebase, title = title, tags = tags)
+			except (KeyError, ValueError) as e:
+				raise Metadata.MetadataError("bad chapter timing %s"\
+					% str(timing)) from e
+			return
+
+		def iter_ffmetadata_items(self):
+			"""
+			yield each chapter as list of (key, value) in a [CHAPTER] section
+			"""
+			for c in self:
+				items = [("TIMEBASE", "%d/%d" % c.timebase),
+					("START", str(c.start)), ("END", str(c.end))]
+				if c.title is not None:
+					items.append(("title", c.title))
+				items.extend(c.tags)
+				yield items
+			return
+
 	# below two class methods are used to add new value type (subclass of Value)
 	# to registered Metadata value type list
 	@classmethod
@@ -125,39 +221,216 @@ class Metadata(dict):
 		# self.ffmetadata stores the ffmetadata file from which is is parsed
 		# for metadata instances that are not parsed from an ffmetadata file,
 		self.ffmetadata = ffmetadata
+		# digest of the ffmetadata file content when parsed, used to skip
+		# writing unchanged content back
+		self.ffmetadata_digest = None
+		# [STREAM] and other non-chapter sections, as list of
+		# (name, [(key, value), ...])
+		self.sections = list()
+		self.chapters = type(self).ChapterList()
 		return
 
 	@classmethod
 	def standard_ffmetadata(cls, fname, *, extension = "metadata"):
 		return cls.util.append_filename_extension(fname, extension)
 
+	@classmethod
+	def ffmetadata_unescape(cls, s):
+		"""
+		remove ffmetadata escaping backslashes from a key or value string
+		"""
+		if "\\" not in s:
+			return s
+		return cls._FFMETADATA_UNESCAPE_REGEX.sub(r"\1", s)
+
+	@classmethod
+	def ffmetadata_escape(cls, s):
+		"""
+		escape special characters (=;#\\ and newline) in a key or value string
+		"""
+		return cls._FFMETADATA_ESCAPE_REGEX.sub(r"\\\1", s)
+
 	@classmethod
 	def read_ffmetadata(cls, fname):
-		with cls.util.get_fp(fname, "r") as fp:
-			lines = fp.read().splitlines()
-		if (not lines) or (lines[0] != cls.HEAD_LINE):
-			raise RuntimeError("metadata header line missing in %s" % fname)
-		# parse metadata content
-		new = cls(ffmetadata = fname)
+		with cls.util.get_fp(fname, "r", encoding = "utf-8") as fp:
+			text = fp.read()
+		new = cls.parse_ffmetadata_str(text, ffmetadata = fname)
+		new.ffmetadata_digest = cls.get_text_digest(text)
+		return new
+
+	@staticmethod
+	def _read_file_bytes(fname, bufsize = 65536) -> bytes:
+		# sidecars are small, this is mostly open, a single read and close
+		fd = os.open(fname, os.O_RDONLY)
+		try:
+			chunks = [os.read(fd, bufsize)]
+			while len(chunks[-1]) == bufsize:
+				chunks.append(os.read(fd, bufsize))
+		finally:
+			os.close(fd)
+		return b"".join(chunks)
+
+	@classmethod
+	def parse_ffmetadata_bytes(cls, data: bytes, *, ffmetadata = None):
+		"""
+		same as read_ffmetadata, but from the raw (utf-8) file content
+		"""
+		text = data.decode("utf-8")
+		if "\r" in text:
+			# same as universal newlines of files opened in text mode
+			text = text.replace("\r\n", "\n").replace("\r", "\n")
+			data = text.encode("utf-8")
+		new = cls.parse_ffmetadata_str(text, ffmetadata = ffmetadata)
+		new.ffmetadata_digest = hashlib.blake2b(data, digest_size = 16)\
+			.digest()
+		return new
+
+	@classmethod
+	def iter_read_ffmetadata(cls, fnames, *, jobs = 8, batch_size = 64,
+			missing_ok = False):
+		"""
+		read many ffmetadata files, yield parsed metadata in input order;
+		files are read in batches by <jobs> threads ahead of parsing, to
+		overlap storage latency with parsing; missing files are yielded as
+		None if missing_ok, otherwise raise FileNotFoundError
+		"""
+		def read_batch(batch):
+			ret = list()
+			for fname in batch:
+				try:
+					ret.append(cls._read_file_bytes(fname))
+				except FileNotFoundError:
+					if not missing_ok:
+						raise
+					ret.append(None)
+			return batch, ret
+		def parse_batch(future):
+			for fname, data in zip(*future.result()):
+				yield None if data is None\
+					else cls.parse_ffmetadata_bytes(data, ffmetadata = fname)
+			return
+		fnames = iter(fnames)
+		batches = iter(lambda: list(itertools.islice(fnames, batch_size)),
+			list())
+		with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+			pending = collections.deque()
+			for batch in batches:
+				pending.append(executor.submit(read_batch, batch))
+				if len(pending) >= 2 * jobs:
+					yield from parse_batch(pending.popleft())
+			while pending:
+				yield from parse_batch(pending.popleft())
+		return
+
+	@staticmethod
+	def _join_ffmetadata_lines(lines: list) -> list:
+		# merge lines ending with an escaped newline (odd number of trailing
+		# backslashes) with their next line
+		ret = list()
+		cont = False
+		for line in lines:
+			if cont:
+				ret[-1] += "\n" + line
+			else:
+				ret.append(line)
+			cont = (len(line) - len(line.rstrip("\\"))) % 2 == 1
+		return ret
+
+	@classmethod
+	def parse_ffmetadata_str(cls, text: str, *, ffmetadata = None):
+		"""
+		parse ffmetadata content in a single pass; global tags are parsed into
+		registered valtypes, [CHAPTER] sections into <chapters>, tags in other
+		sections (e.g. [STREAM]) are kept as strings in <sections>
+		"""
+		if not text.startswith(cls.HEAD_LINE):
+			raise cls.MetadataError("metadata header line missing in %s"\
+				% str(ffmetadata))
+		new = cls(ffmetadata = ffmetadata)
+		lines = text.split("\n")
+		# escapes are rare, lines are only re-joined when seen any
+		escaped = "\\" in text
+		if escaped:
+			lines = cls._join_ffmetadata_lines(lines)
+		# local names save attribute lookups in the loop below
+		unescape = cls.ffmetadata_unescape
+		tag_match = cls._FFMETADATA_TAG_REGEX.match
+		valtypes = cls._FORMATTER_BY_TAG
+		default = valtypes[cls.Value.get_default_tag()]
+		section = None
 		for line in lines:
-			if (not line) or line.startswith(cls.COMMENTS):
+			if (not line) or (line[0] in ";#"):
 				continue
-			tag, value = line.split(cls.TAG_SEP, maxsplit = 1)
-			# get value valtype and parse values
-			tag = tag.lower()
-			valtype = cls.get_valtype_by_tag(tag, allow_default = True)
-			new[tag] = valtype.from_ffmetadata(value)
+			if escaped and ("\\" in line):
+				m = tag_match(line)
+				if m is None:
+					raise cls.MetadataError("bad line '%s' in %s"\
+						% (line, str(ffmetadata)))
+				key, value = unescape(m.group(1)), unescape(m.group(2))
+			else:
+				key, sep, value = line.partition("=")
+				if not sep:
+					if (line[0] == "[") and line.rstrip().endswith("]"):
+						section = (line.strip()[1:-1], list())
+						new.sections.append(section)
+						continue
+					raise cls.MetadataError("bad line '%s' in %s"\
+						% (line, str(ffmetadata)))
+			if section is None:
+				key = key.lower()
+				new[key] = valtypes.get(key, default).from_ffmetadata(value)
+			else:
+				section[1].append((key, value))
+		if new.sections:
+			sections, new.sections = new.sections, list()
+			for section in sections:
+				if section[0] == "CHAPTER":
+					new.chapters.append_ffmetadata_items(section[1])
+				else:
+					new.sections.append(section)
 		return new
 
-	def save_ffmetadata(self, fname, *, force = None):
-		if os.path.exists(fname) and (not force):
+	@staticmethod
+	def get_text_digest(text: str) -> bytes:
+		return hashlib.blake2b(text.encode("utf-8"), digest_size = 16).digest()
+
+	def to_ffmetadata_str(self) -> str:
+		escape = self.ffmetadata_escape
+		lines = [self.HEAD_LINE]
+		lines.extend(escape(k) + self.TAG_SEP + escape(self[k].to_ffmetadata())\
+			for k in sorted(self.keys()))
+		sections = itertools.chain(self.sections, (("CHAPTER", i)\
+			for i in self.chapters.iter_ffmetadata_items()))
+		for name, items in sections:
+			lines.append("[%s]" % name)
+			lines.extend(escape(k) + self.TAG_SEP + escape(v) for k, v in items)
+		lines.append("")
+		return ("\n").join(lines)
+
+	def save_ffmetadata(self, fname, *, force = None, fsync = None) -> bool:
+		"""
+		save as ffmetadata file, atomically replacing the existing file;
+		writing is skipped if unchanged since parsed from <fname> (by digest),
+		or if another existing file has identical content
+
+		returns True if the file is written, False if skipped
+		"""
+		exists = os.path.exists(fname)
+		if exists and (not force):
 			raise IOError("file '%s' already exists" % fname)
-		with self.util.get_fp(fname, "w") as fp:
-			fp.write(self.HEAD_LINE + "\n")
-			for k in sorted(self.keys()):
-				v = self[k]
-				fp.write(self.TAG_SEP.join([k, self[k].to_ffmetadata()]) + "\n")
-		return
+		text = self.to_ffmetadata_str()
+		if exists:
+			if fname == self.ffmetadata:
+				# the digest taken when parsed stands for the file content
+				if self.get_text_digest(text) == self.ffmetadata_digest:
+					return False
+			else:
+				with open(fname, "r", encoding = "utf-8") as fp:
+					if fp.read() == text:
+						return False
+		self.util.atomic_write(fname, text, "w", encoding = "utf-8",
+			fsync = fsync)
+		return True
 
 	def format(self, fmtstr):
 		pos, ret = 0, ""
@@ -207,11 +480,27 @@ class Metadata(dict):
 		m = re.match(regex, s)
 		if not m:
 			raise cls.MetadataError("'%s' unmatch pattern '%s'" % (s, fmtstr))
+		return cls.from_formatted_match(valtypes, m)
+
+	@classmethod
+	def from_formatted_match(cls, valtypes, m):
+		"""
+		new instance from a match of regex by fmtstr_to_regex()
+		"""
 		new = cls()
 		for f, v in zip(valtypes, m.groups()):
 			new[f.tag] = f.from_formatted(v)
 		return new
 
+	def get_album_key(self, fname) -> str:
+		"""
+		key grouping files of the same album; files without tag 'album' are
+		grouped by directory
+		"""
+		if "album" in self:
+			return self["album"].to_formatted()
+		return os.path.join(os.path.dirname(fname), "")
+
 	def append_merge(self, other):
 		for k, v in other.items():
 			if k not in self:
@@ -245,9 +534,9 @@ class TitleValue(Metadata.Value):
 class ArtistValue(Metadata.Value):
 	@classmethod
 	def from_ffmetadata(cls, value):
-		return cls(value = value.split("\\; "))
+		return cls(value = value.split("; "))
 	def to_ffmetadata(self):
-		return ("\\; ").join(self.value)
+		return ("; ").join(self.value)
 	@classmethod
 	def from_formatted(cls, value):
 		return cls(value = value.split(","))
@@ -279,3 +568,38 @@ class YearValue(Metadata.Value):
 	argparse_params = dict(type = str, metavar = "str"))
 class GenreValue(Metadata.Value):
 	pass
+
+# replaygain 2.0 values, gain in dB relative to -18 LUFS, peak as linear ratio
+class ReplayGainGainValue(Metadata.Value):
+	@classmethod
+	def from_ffmetadata(cls, value):
+		return cls(value = float(value.split()[0]))
+	def to_ffmetadata(self):
+		return "%.2f dB" % self.value
+
+class ReplayGainPeakValue(Metadata.Value):
+	@classmethod
+	def from_ffmetadata(cls, value):
+		return cls(value = float(value))
+	def to_ffmetadata(self):
+		return "%.6f" % self.value
+
+@Metadata.add_valtype(tag = "replaygain_track_gain", fmtstr = "%r",
+	regex = "[-+]?[\\d.]+(?: dB)?")
+class ReplayGainTrackGainValue(ReplayGainGainValue):
+	pass
+
+@Metadata.add_valtype(tag = "replaygain_track_peak", fmtstr = "%p",
+	regex = "[\\d.]+")
+class ReplayGainTrackPeakValue(ReplayGainPeakValue):
+	pass
+
+@Metadata.add_valtype(tag = "replaygain_album_gain", fmtstr = "%R",
+	regex = "[-+]?[\\d.]+(?: dB)?")
+class ReplayGainAlbumGainValue(ReplayGainGainValue):
+	pass
+
+@Metadata.add_valtype(tag = "replaygain_album_peak", fmtstr = "%P",
+	regex = "[\\d.]+")
+class ReplayGainAlbumPeakValue(ReplayGainPeakValue):
+	pass
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import json
+import re
+import unicodedata
+# custom lib
+from . import subprog
+from .metadata import Metadata
+
+
+class NormalizeRules(object):
+	"""
+	metadata normalization rules compiled from a json rule file, a list of
+	rules applied in order; each rule has one action on the tags in "tags" (a
+	list, or "*" for all tags, the default):
+
+	{"sub": [regex, replacement]}: regex substitution, as re.sub()
+	{"transform": name or [name, ...]}: see TRANSFORMS
+	{"map": {value: new value}}: lookup table of whole values
+	{"split": regex}: split items of multi-valued tags (artist)
+
+	"sub" and "map" rules also take "ignore_case": true; string values and
+	items of multi-valued tags are normalized, numeric values are not; rules
+	are compiled once into a chain of functions per tag, so that all rules
+	are applied in a single pass over each metadata
+	"""
+	# full-width ascii and ideographic space to their ascii counterparts
+	_FULLWIDTH_TABLE = {i: i - 0xfee0 for i in range(0xff01, 0xff5f)}
+	_FULLWIDTH_TABLE[0x3000] = 0x20
+	_SPACES_REGEX = re.compile(r"\s+")
+	_WORD_START_REGEX = re.compile(r"(^|[\s\-/(])(\w)")
+
+	TRANSFORMS = {
+		"strip": str.strip,
+		"collapse": lambda s: NormalizeRules._SPACES_REGEX.sub(" ", s),
+		"fullwidth": lambda s: s.translate(NormalizeRules._FULLWIDTH_TABLE),
+		"nfkc": lambda s: unicodedata.normalize("NFKC", s),
+		"lower": str.lower,
+		"upper": str.upper,
+		# only the first letter of each word, e.g. "j-pop" to "J-Pop"
+		"title": lambda s: NormalizeRules._WORD_START_REGEX.sub(
+			lambda m: m.group(1) + m.group(2).upper(), s),
+	}
+	ACTIONS = ["sub", "transform", "map", "split"]
+
+	def __init__(self, rules: list, *ka, **kw):
+		super().__init__(*ka, **kw)
+		# [(set of tags or None for all, func, splits)]
+		self._rules = [self._compile(i, r) for i, r in enumerate(rules)]
+		# {tag: [(func, splits), ...]}
+		self._chains = dict()
+		return
+
+	@classmethod
+	def from_file(cls, fname):
+		with open(fname, "r", encoding = "utf-8") as fp:
+			rules = json.load(fp)
+		if not isinstance(rules, list):
+			raise ValueError("rule file '%s' is not a list of rules" % fname)
+		return cls(rules)
+
+	@classmethod
+	def _compile(cls, i, rule):
+		actions = [a for a in cls.ACTIONS if a in rule]\
+			if isinstance(rule, dict) else list()
+		if len(actions) != 1:
+			raise ValueError("rule #%d must have exactly one of: %s"\
+				% (i + 1, (", ").join(cls.ACTIONS)))
+		tags = rule.get("tags", "*")
+		tags = None if tags == "*" else set([tags] if isinstance(tags, str)\
+			else tags)
+		action, arg = actions[0], rule[actions[0]]
+		flags = re.IGNORECASE if rule.get("ignore_case") else 0
+		if action == "sub":
+			regex, repl = re.compile(arg[0], flags), arg[1]
+			func = lambda s: regex.sub(repl, s)
+		elif action == "transform":
+			names = [arg] if isinstance(arg, str) else arg
+			unknown = [n for n in names if n not in cls.TRANSFORMS]
+			if unknown:
+				raise ValueError("rule #%d: unknown transform(s): %s"\
+					% (i + 1, (", ").join(unknown)))
+			funcs = [cls.TRANSFORMS[n] for n in names]
+			def func(s):
+				for f in funcs:
+					s = f(s)
+				return s
+		elif action == "map":
+			table = {(k.casefold() if flags else k): v\
+				for k, v in arg.items()}
+			func = (lambda s: table.get(s.casefold(), s)) if flags\
+				else (lambda s: table.get(s, s))
+		else:
+			func = re.compile(arg).split
+		return tags, func, action == "split"
+
+	def get_chain(self, tag) -> list:
+		if tag not in self._chains:
+			self._chains[tag] = [(func, splits)\
+				for tags, func, splits in self._rules\
+				if (tags is None) or (tag in tags)]
+		return self._chains[tag]
+
+	def normalize(self, metadata) -> list:
+		"""
+		normalize metadata in place, returns [(tag, old value, new value)] of
+		changed tags; tags normalized to empty values are removed (new value
+		None), as are empty and repeated items of multi-valued tags
+		"""
+		ret = list()
+		for tag in sorted(metadata.keys()):
+			chain = self.get_chain(tag)
+			old = metadata[tag]
+			if (not chain) or not isinstance(old.value, (str, list)):
+				continue
+			multi = isinstance(old.value, list)
+			items = old.value if multi else [old.value]
+			for func, splits in chain:
+				if not splits:
+					items = [func(s) for s in items]
+				elif multi:
+					items = [p for s in items for p in func(s)]
+			items = list(dict.fromkeys(s for s in items if s))
+			value = items if multi else ("").join(items)
+			if value == old.value:
+				continue
+			if value:
+				metadata[tag] = type(old)(value = value)
+				ret.append((tag, old, metadata[tag]))
+			else:
+				del metadata[tag]
+				ret.append((tag, old, None))
+		return ret
+
+
+@subprog.SubprogReg.new_subprog("normalize_metadata",
+	help = "normalize metadata of files on a list by a rule file",
+	desc = "normalize metadata of files on a list by regex substitutions, "
+		"transforms (e.g. full-width characters, title case), lookup tables "
+		"and splitting of multi-valued tags from a json rule file, all rules "
+		"in one pass; only changed metadata is written")
+class SubprogNormalizeMetadata(subprog.SubprogWithLogBase,
+		subprog.MetadataListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_jobs
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("-r", "--rules", type = str, required = True,
+			metavar = "file",
+			help = "json rule file, a list of rules applied in order; each "
+				"rule is an object with \"tags\" (list of tags, or \"*\" for "
+				"all) and one of \"sub\": [regex, replacement], \"transform\": "
+				"name(s), \"map\": {value: new value} or \"split\": regex "
+				"(for artists); transforms: "\
+				+ (", ").join(NormalizeRules.TRANSFORMS))
+		return ap
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		rules = NormalizeRules.from_file(args.rules)
+		n_files, n_changed = 0, 0
+		with self.open_metadata_output(args, force = True) as output:
+			for (fname, metadata), changes in self.iter_parallel(
+					lambda item: (item, rules.normalize(item[1])),
+					self.iter_list_metadata(args), jobs = args.jobs):
+				n_files += 1
+				if not changes:
+					output.keep(fname, metadata)
+					self.add_result(fname, True)
+					continue
+				n_changed += 1
+				if args.verbose:
+					for tag, old, new in changes:
+						self.log_err("%s: %s: %s -> %s\n" % (fname, tag,
+							old.to_formatted(), "(removed)" if new is None\
+							else new.to_formatted()))
+				output.save(fname, metadata)
+				self.add_result(fname, True, output = args.manifest\
+					or Metadata.standard_ffmetadata(fname))
+		self.log_err("normalized: %d of %d files changed\n"\
+			% (n_changed, n_files))
+		return
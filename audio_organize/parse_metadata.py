@@ -5,13 +5,16 @@ import os
 from . import subprog
 from . import util
 from .metadata import Metadata
+from .pattern_infer import PatternInference
 
 
 @subprog.SubprogReg.new_subprog("parse_metadata",
 	help = "parse metadata from file names on a list",
 	desc = "parse metadata from file names on a list")
 class SubprogParseMetadata(subprog.SubprogWithLogBase,
-		subprog.ListBasedSubprogBase):
+		subprog.MetadataListBasedSubprogBase):
+	AUTO_PATTERN = "auto"
+
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
@@ -19,7 +22,8 @@ class SubprogParseMetadata(subprog.SubprogWithLogBase,
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("pattern", type = str,
 			help = ("file name pattern, must full-match including extension; "
-				"available fields: %s"\
+				"available fields: %s; 'auto' to infer a pattern for each "
+				"group of similarly structured file base names in the list"\
 				% Metadata.get_fields_help_str()).replace("%", "%%"))
 		xp = ap.add_mutually_exclusive_group()
 		xp.add_argument("--append-merge", action = "store_true",
@@ -53,35 +57,65 @@ class SubprogParseMetadata(subprog.SubprogWithLogBase,
 
 	def override_by_manual(self, args, metadata):
 		for valtype in Metadata.iter_valtypes():
-			if not valtype.is_default():
+			if (not valtype.is_default()) and valtype.argparse_params:
 				val = getattr(args, valtype.tag)
 				if val:
 					metadata[valtype.tag] = valtype.from_formatted(val)
 		return
 
+	def infer_patterns(self, fnames) -> dict:
+		"""
+		infer patterns of file base names, returns {file name: cluster}
+		"""
+		inference = PatternInference({os.path.basename(f) for f in fnames})
+		for cluster in inference.clusters:
+			self.log_err("pattern: '%s' (%d files)\n"\
+				% (cluster.fmtstr, len(cluster.names)))
+		for cluster in inference.unresolved:
+			self.log_err("[NoPattern]: %d files like '%s'\n"\
+				% (len(cluster.names), cluster.names[0]))
+		by_name = inference.get_cluster_by_name()
+		return {f: by_name[os.path.basename(f)] for f in fnames\
+			if os.path.basename(f) in by_name}
+
 	@subprog.SubprogWithLogBase.with_log()
 	def subprog_main(self, args):
-		for fname in self.read_list(args):
-			if args.verbose:
-				self.log_err("parsing: '%s'\n" % fname)
-			ffmetadata = Metadata.standard_ffmetadata(fname)
-			parsed_metadata = Metadata.from_formatted(args.pattern, fname)
-			exist_metadata = Metadata.read_ffmetadata(ffmetadata)\
-				if os.path.exists(ffmetadata) else Metadata()
-			# update metadata values
-			# resolve conflicts between parsed and already-exist
-			# then apply manual override (highest priority)
-			if args.append_merge:
-				metadata = exist_metadata.append_merge(parsed_metadata)
-			elif args.overwrite_merge:
-				metadata = exist_metadata.overwrite_merge(parsed_metadata)
-			else:
-				metadata = parsed_metadata
-			self.override_by_manual(args, metadata)
-			# save metadata file
-			ffmetadata = Metadata.standard_ffmetadata(fname)
-			if args.verbose:
-				self.log_err("writing: '%s'\n" % ffmetadata)
-			if not args.dry_run:
-				metadata.save_ffmetadata(ffmetadata, force = args.force)
+		items = self.iter_list_metadata(args, required = False)
+		if args.pattern == self.AUTO_PATTERN:
+			items = list(items)
+			clusters = self.infer_patterns([fname for fname, _ in items])
+		with self.open_metadata_output(args, force = args.force) as output:
+			for fname, exist_metadata in self.progress.iter(items):
+				if args.verbose:
+					self.log_err("parsing: '%s'\n" % fname)
+				if args.pattern != self.AUTO_PATTERN:
+					parsed_metadata = Metadata.from_formatted(args.pattern,
+						fname)
+				elif fname in clusters:
+					parsed_metadata = clusters[fname].parse(
+						os.path.basename(fname))
+				else:
+					parsed_metadata = None
+				if parsed_metadata is None:
+					self.log_err("[NoPattern]: skipping '%s'\n" % fname)
+					self.progress.fail()
+					self.add_result(fname, False, error = "no pattern")
+					continue
+				# update metadata values
+				# resolve conflicts between parsed and already-exist
+				# then apply manual override (highest priority)
+				if args.append_merge:
+					metadata = exist_metadata.append_merge(parsed_metadata)
+				elif args.overwrite_merge:
+					metadata = exist_metadata.overwrite_merge(parsed_metadata)
+				else:
+					metadata = parsed_metadata
+				self.override_by_manual(args, metadata)
+				# save metadata file
+				if args.verbose:
+					self.log_err("writing: '%s'\n" % (args.manifest\
+						or Metadata.standard_ffmetadata(fname)))
+				output.save(fname, metadata)
+				self.add_result(fname, True, output = args.manifest\
+					or Metadata.standard_ffmetadata(fname))
 		return
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import collections
+import re
+# custom lib
+from .metadata import Metadata
+
+
+class PatternCluster(object):
+	"""
+	file names of the same structure and the format string inferred for them
+	"""
+	def __init__(self, fmtstr, names, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.fmtstr = fmtstr
+		self.names = names
+		if fmtstr is None:
+			self.regex, self.valtypes = None, list()
+		else:
+			regex, self.valtypes = Metadata.fmtstr_to_regex(fmtstr)
+			self.regex = re.compile(regex)
+		return
+
+	@property
+	def tags(self) -> set:
+		return {v.tag for v in self.valtypes}
+
+	def parse(self, name):
+		"""
+		parse metadata from a (base) file name, None if not matching or values
+		are invalid (e.g. track 0)
+		"""
+		m = None if self.regex is None else self.regex.fullmatch(name)
+		if not m:
+			return None
+		try:
+			return Metadata.from_formatted_match(self.valtypes, m)
+		except ValueError:
+			return None
+
+
+class PatternInference(object):
+	"""
+	infer format strings from file names; each name is split into fields
+	(digit and text runs) and separators (punctuation runs) between them,
+	names are clustered by the separators and field kinds, and fields of each
+	cluster are assigned to tags by their values; all steps are linear in the
+	number of names, and each cluster is parsed by one compiled regex
+	"""
+	# punctuation common in titles and artist lists is not a separator
+	SEP_REGEX = re.compile(r"(\s*(?:[^\w\s',&!?]|_)+\s*)")
+	# leading number followed by a space, e.g. "01 title"
+	LEADING_NUM_REGEX = re.compile(r"(\d+)(\s+)(\D.*)")
+	EXT_REGEX = re.compile(r"\.[A-Za-z0-9]{1,5}$")
+	# text fields by decreasing number of distinct values; titles are mostly
+	# distinct, artists and albums are repeated
+	TEXT_TAGS = ["title", "artist", "album"]
+	YEAR_RANGE = (1800, 2099)
+
+	def __init__(self, names, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.num_regex = re.compile(Metadata.get_valtype_by_tag("track").regex)
+		# clusters with inferred format strings, largest first
+		self.clusters = list()
+		# clusters whose fields can not be assigned to tags
+		self.unresolved = list()
+		self._infer(names)
+		return
+
+	def tokenize(self, name) -> tuple:
+		"""
+		returns (signature, field values); signature is a tuple of separators
+		and field kinds ('d' for digits, 's' for text and '' for empty),
+		followed by the extension
+		"""
+		m = self.EXT_REGEX.search(name)
+		stem, ext = (name[:m.start()], m.group()) if m else (name, "")
+		parts = self.SEP_REGEX.split(stem)
+		signature, values = [], []
+		for i, part in enumerate(parts):
+			if i % 2:
+				signature.append(part)
+				continue
+			m = self.LEADING_NUM_REGEX.fullmatch(part)
+			if m:
+				signature.extend(["d", m.group(2)])
+				values.append(m.group(1))
+				part = m.group(3)
+			signature.append(self._get_kind(part))
+			values.append(part)
+		signature.append(ext)
+		return tuple(signature), values
+
+	def _get_kind(self, value) -> str:
+		if not value:
+			return ""
+		return "d" if self.num_regex.fullmatch(value) else "s"
+
+	def _is_year(self, column) -> bool:
+		lo, hi = self.YEAR_RANGE
+		return all((len(v) == 4) and (lo <= int(v) <= hi) for v in column)
+
+	def _assign(self, kinds, columns):
+		"""
+		returns fmtstr of each field, or None if any field is unassignable
+		"""
+		ret = [""] * len(kinds)
+		digits = [i for i, k in enumerate(kinds) if k == "d"]
+		texts = [i for i, k in enumerate(kinds) if k == "s"]
+		# digits: year by value, then track and disc from the end
+		for i in digits:
+			if self._is_year(columns[i]):
+				ret[i] = Metadata.get_valtype_by_tag("year").fmtstr
+				digits.remove(i)
+				break
+		for i, tag in zip(reversed(digits), ["track", "disc"]):
+			ret[i] = Metadata.get_valtype_by_tag(tag).fmtstr
+		extra = digits[:-2]
+		# texts: by number of distinct values, ties by position
+		texts.sort(key = lambda i: (-len(set(columns[i])), i))
+		for i, tag in zip(texts, self.TEXT_TAGS):
+			ret[i] = Metadata.get_valtype_by_tag(tag).fmtstr
+		extra += texts[len(self.TEXT_TAGS):]
+		# more fields than tags, keep them as literal if constant
+		for i in extra:
+			if len(set(columns[i])) > 1:
+				return None
+			ret[i] = columns[i][0].replace("%", "%%")
+		return ret
+
+	def _get_fmtstr(self, signature, values):
+		kinds = signature[:-1:2]
+		columns = [[v[i] for v in values] for i in range(len(kinds))]
+		fields = self._assign(kinds, columns)
+		if fields is None:
+			return None
+		# separators are between fields, the extension is after the last
+		literals = [s.replace("%", "%%") for s in signature[1::2]]
+		return ("").join(f + l for f, l in zip(fields, literals))
+
+	def _infer(self, names):
+		groups = collections.defaultdict(lambda: ([], []))
+		for name in names:
+			signature, values = self.tokenize(name)
+			group = groups[signature]
+			group[0].append(name)
+			group[1].append(values)
+		accepted = list()
+		for signature, (members, values) in sorted(groups.items(),
+				key = lambda i: -len(i[1][0])):
+			fmtstr = self._get_fmtstr(signature, values)
+			cluster = PatternCluster(fmtstr, members)
+			target = self._find_merge(accepted, cluster)
+			if target is not None:
+				target.names.extend(members)
+			elif fmtstr is None:
+				self.unresolved.append(cluster)
+			else:
+				accepted.append(cluster)
+		self.clusters = sorted(accepted, key = lambda c: -len(c.names))
+		return
+
+	@staticmethod
+	def _find_merge(accepted, cluster):
+		"""
+		find a larger cluster whose pattern matches all names in cluster; e.g.
+		titles with a separator in it have one more text field than others;
+		at most one text tag can be lost by merging
+		"""
+		tags = cluster.tags
+		for c in accepted:
+			lost = tags - c.tags
+			if (cluster.fmtstr is not None) and ((len(lost) > 1)\
+					or (not lost.issubset(PatternInference.TEXT_TAGS))\
+					or (not c.tags.issubset(tags))):
+				continue
+			if all(c.regex.fullmatch(n) for n in cluster.names):
+				return c
+		return None
+
+	def get_cluster_by_name(self) -> dict:
+		return {n: c for c in self.clusters for n in c.names}
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import array
+import json
+import struct
+import subprocess
+import sys
+# custom lib
+from . import subprog
+from . import util
+from .cache import FileResultCache
+
+
+class WaveformPeaks(object):
+	"""
+	min/max peaks of mono 16-bit pcm per block of <samples_per_pixel>
+	samples, fed in chunks so that only one chunk of pcm is held at a time;
+	output formats are the binary (.dat, version 2) and json formats of
+	audiowaveform, read by waveform players such as peaks.js
+	"""
+	VERSION = 2
+	CHUNK_BLOCKS = 256
+
+	def __init__(self, *ka, sample_rate = 44100, samples_per_pixel = 256,
+			bits = 8, **kw):
+		super().__init__(*ka, **kw)
+		if bits not in (8, 16):
+			raise ValueError("bits must be 8 or 16, not %d" % bits)
+		self.sample_rate = sample_rate
+		self.samples_per_pixel = samples_per_pixel
+		self.bits = bits
+		# interleaved min and max of each block
+		self.data = array.array("b" if bits == 8 else "h")
+		self._pending = b""
+		return
+
+	@property
+	def chunk_size(self) -> int:
+		"""
+		suggested bytes to read per feed()
+		"""
+		return self.samples_per_pixel * 2 * self.CHUNK_BLOCKS
+
+	def _add_blocks(self, pcm: bytes):
+		samples = array.array("h", pcm)
+		if sys.byteorder == "big":
+			samples.byteswap()
+		shift = 8 if self.bits == 8 else 0
+		n = self.samples_per_pixel
+		view = memoryview(samples)
+		for i in range(0, len(samples), n):
+			block = view[i:i + n]
+			self.data.append(min(block) >> shift)
+			self.data.append(max(block) >> shift)
+		return
+
+	def feed(self, pcm: bytes):
+		"""
+		add s16le pcm bytes; a trailing partial block is kept until the next
+		feed() or finish()
+		"""
+		pcm = self._pending + pcm if self._pending else pcm
+		n = len(pcm) - len(pcm) % (self.samples_per_pixel * 2)
+		self._pending = pcm[n:]
+		if n:
+			self._add_blocks(pcm[:n])
+		return
+
+	def finish(self):
+		# an odd trailing byte is not a sample
+		pending = self._pending[:len(self._pending) // 2 * 2]
+		self._pending = b""
+		if pending:
+			self._add_blocks(pending)
+		return self
+
+	def __len__(self):
+		return len(self.data) // 2
+
+	def to_dat(self) -> bytes:
+		header = struct.pack("<iIiiIi", self.VERSION, int(self.bits == 8),
+			self.sample_rate, self.samples_per_pixel, len(self), 1)
+		data = array.array(self.data.typecode, self.data)
+		if sys.byteorder == "big":
+			data.byteswap()
+		return header + data.tobytes()
+
+	def to_json(self) -> str:
+		return json.dumps(dict(version = self.VERSION, channels = 1,
+			sample_rate = self.sample_rate,
+			samples_per_pixel = self.samples_per_pixel, bits = self.bits,
+			length = len(self), data = self.data.tolist()),
+			separators = (",", ":")) + "\n"
+
+
+@subprog.SubprogReg.new_subprog("peaks",
+	help = "compute waveform peaks of audio files on a list",
+	desc = "compute waveform min/max peaks of audio files on a list for "
+		"waveform display, as audiowaveform-compatible .dat or .json files "
+		"next to the audio files; audio is decoded to mono pcm by 'ffmpeg' "
+		"and streamed, files with up-to-date peaks are skipped")
+class SubprogPeaks(subprog.SubprogWithLogBase,
+		subprog.ListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("ffmpeg")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("-g", "--format", type = str, default = "dat",
+			choices = ["dat", "json"],
+			help = "output peaks format/extension (default: dat)")
+		ap.add_argument("-b", "--bits", type = int, default = 8,
+			choices = [8, 16],
+			help = "bits per peak value (default: 8)")
+		ap.add_argument("-z", "--samples-per-pixel", type = util.PosInt,
+			default = 256, metavar = "int",
+			help = "samples per peak (default: 256)")
+		ap.add_argument("-r", "--sample-rate", type = util.PosInt,
+			default = 44100, metavar = "int",
+			help = "decode audio at this sample rate (default: 44100)")
+		ap.add_argument("--cache", type = str, default = ".peaks_cache.jsonl",
+			metavar = "file",
+			help = "cache file of audio files with peaks, '' to disable; "
+				"peaks are computed again if the audio file or the options "
+				"are changed (default: .peaks_cache.jsonl)")
+		return ap
+
+	@staticmethod
+	def get_params_key(args) -> str:
+		return "%s:%d:%d:%d" % (args.format, args.bits,
+			args.samples_per_pixel, args.sample_rate)
+
+	def _decode_peaks(self, args, fname):
+		"""
+		returns WaveformPeaks of a file, None if ffmpeg failed
+		"""
+		cmd = [args.ffmpeg, "-nostdin", "-hide_banner", "-v", "error",
+			"-i", self.util.fname_prevent_monkey_patch(fname),
+			"-map", "0:a:0", "-ac", "1", "-ar", str(args.sample_rate),
+			"-f", "s16le", "-acodec", "pcm_s16le", "-"]
+		if args.verbose:
+			self.log_err("calling: %s\n" % self.util.get_cmd_str(cmd))
+		if args.dry_run:
+			return None
+		peaks = WaveformPeaks(sample_rate = args.sample_rate,
+			samples_per_pixel = args.samples_per_pixel, bits = args.bits)
+		with subprocess.Popen(cmd, stdout = subprocess.PIPE,
+				stderr = self.log.err_file) as proc:
+			while True:
+				pcm = proc.stdout.read(peaks.chunk_size)
+				if not pcm:
+					break
+				peaks.feed(pcm)
+		if proc.returncode:
+			self.log_err("[NonZeroReturn]: %s\n" % self.util.get_cmd_str(cmd))
+			self.progress.fail()
+			return None
+		return peaks.finish()
+
+	def _peaks(self, args, cache, fname) -> bool:
+		"""
+		compute and save peaks of a file, returns True if saved
+		"""
+		out = self.util.append_filename_extension(fname, args.format)
+		if (not args.force) and self.util.lexists(out)\
+				and (cache.get_result(fname) == self.get_params_key(args)):
+			if args.verbose:
+				self.log_err("up to date: %s\n" % out)
+			self.add_result(fname, True, output = out)
+			return False
+		peaks = self._decode_peaks(args, fname)
+		if peaks is None:
+			if not args.dry_run:
+				self.add_result(fname, False, error = "decoding failed")
+			return False
+		if args.format == "dat":
+			self.util.atomic_write(out, peaks.to_dat(), "wb")
+		else:
+			self.util.atomic_write(out, peaks.to_json(), encoding = "utf-8")
+		self.add_result(fname, True, output = out)
+		return True
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		cache = FileResultCache.load(args.cache)
+		fnames = self.read_list(args)
+		for fname, saved in zip(fnames, self.iter_parallel(
+				lambda f: self._peaks(args, cache, f), fnames,
+				jobs = args.jobs, path_of = lambda f: f)):
+			if saved:
+				cache.set_result(fname, self.get_params_key(args))
+		if not args.dry_run:
+			cache.save()
+		return
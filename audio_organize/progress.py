@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import time
+# custom lib
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class Progress(object):
+	"""
+	done/failed items and processed bytes of a run, shown as a status line
+	on stderr and/or dumped into a json status file; rendering is throttled,
+	so update() is a few counter increments and a clock read per item
+	"""
+	MODES = ["auto", "on", "off"]
+
+	def __init__(self, *ka, name = None, err_file = None, mode = "auto",
+			status_file = None, interval = None, status_interval = 5.0, **kw):
+		super().__init__(*ka, **kw)
+		self.name = name
+		self.err_file = err_file
+		# on a tty, the status line is redrawn in place; otherwise, a new line
+		# is written every <interval> seconds, only if mode is on
+		self.tty = (err_file is not None) and err_file.isatty()
+		self.display = (err_file is not None)\
+			and ((mode == "on") or ((mode == "auto") and self.tty))
+		self.interval = interval if interval is not None\
+			else (0.5 if self.tty else 30.0)
+		self.status_file = status_file
+		self.status_interval = status_interval
+		self.total = None
+		self.done = 0
+		self.failed = 0
+		self.nbytes = 0
+		self.start_time = time.monotonic()
+		# next times to render the line and write the status file
+		never = float("inf")
+		self._next_render = (self.start_time + self.interval)\
+			if self.display else never
+		self._next_status = self.start_time if status_file else never
+		self._line_shown = False
+		# {name: function returning the value} of extra status fields
+		self.metrics = dict()
+		# fail() is called from worker threads
+		self._lock = threading.Lock()
+		return
+
+	@property
+	def enabled(self) -> bool:
+		return self.display or bool(self.status_file)
+
+	def set_total(self, total: int, *, overwrite = False):
+		"""
+		set the expected number of items; by default only if not yet known
+		"""
+		if overwrite or (self.total is None):
+			self.total = total
+		return
+
+	def update(self, n = 1, *, nbytes = 0):
+		self.done += n
+		self.nbytes += nbytes
+		now = time.monotonic()
+		if (now >= self._next_render) or (now >= self._next_status):
+			self.refresh(now)
+		return
+
+	def add_metric(self, name, func):
+		"""
+		add a field to the status, its value is func() at each status write
+		"""
+		self.metrics[name] = func
+		return
+
+	def fail(self, n = 1):
+		with self._lock:
+			self.failed += n
+		return
+
+	def iter(self, iterable, *, total = None):
+		"""
+		yield from iterable, counting each item as done; total is taken from
+		len(iterable) if not given
+		"""
+		if total is None and hasattr(iterable, "__len__"):
+			total = len(iterable)
+		if total is not None:
+			self.set_total(total)
+		for item in iterable:
+			yield item
+			self.update()
+		return
+
+	@staticmethod
+	def get_file_size(path) -> int:
+		try:
+			return os.path.getsize(path)
+		except (OSError, TypeError, ValueError):
+			return 0
+
+	@staticmethod
+	def _format_bytes(n) -> str:
+		for unit in ["B", "KiB", "MiB", "GiB"]:
+			if n < 1024:
+				break
+			n /= 1024
+		else:
+			unit = "TiB"
+		return "%.1f %s" % (n, unit)
+
+	@staticmethod
+	def _format_seconds(s) -> str:
+		s = int(s)
+		return "%d:%02d:%02d" % (s // 3600, s // 60 % 60, s % 60)
+
+	def get_status(self, now = None) -> dict:
+		now = time.monotonic() if now is None else now
+		elapsed = max(now - self.start_time, 1e-9)
+		rate = self.done / elapsed
+		eta = (self.total - self.done) / rate\
+			if (self.total is not None) and rate else None
+		return dict(subprog = self.name, pid = os.getpid(),
+			time = time.time(), elapsed = elapsed, total = self.total,
+			done = self.done, failed = self.failed, bytes = self.nbytes,
+			files_per_sec = rate, bytes_per_sec = self.nbytes / elapsed,
+			eta = (None if eta is None else max(eta, 0.0)),
+			**{k: f() for k, f in self.metrics.items()})
+
+	def get_line(self, status) -> str:
+		done = "%d/%d" % (status["done"], status["total"])\
+			if status["total"] is not None else str(status["done"])
+		fields = ["%s files" % done]
+		if status["failed"]:
+			fields[0] += " (%d failed)" % status["failed"]
+		if status["bytes"]:
+			fields.append(self._format_bytes(status["bytes"]))
+		fields.append("%.1f files/s" % status["files_per_sec"])
+		if status["bytes"]:
+			fields.append("%s/s" % self._format_bytes(status["bytes_per_sec"]))
+		if status["eta"] is not None:
+			fields.append("ETA %s" % self._format_seconds(status["eta"]))
+		return "[progress]: " + (", ").join(fields)
+
+	def _write_status(self, status, state):
+		status = dict(status, state = state)
+		try:
+			self.util.atomic_write(self.status_file,
+				json.dumps(status) + "\n")
+		except OSError:
+			# monitoring must not break the run
+			pass
+		return
+
+	def refresh(self, now = None, *, state = "running"):
+		now = time.monotonic() if now is None else now
+		status = self.get_status(now)
+		if self.display and (now >= self._next_render):
+			line = self.get_line(status)
+			if self.tty:
+				self.err_file.write("\r%s\033[K" % line)
+				self._line_shown = True
+			else:
+				self.err_file.write(line + "\n")
+			self.err_file.flush()
+			self._next_render = now + self.interval
+		if self.status_file and (now >= self._next_status):
+			self._write_status(status, state)
+			self._next_status = now + self.status_interval
+		return
+
+	def clear_line(self):
+		"""
+		erase the status line on tty, call before writing other messages
+		"""
+		if self._line_shown:
+			self.err_file.write("\r\033[K")
+			self._line_shown = False
+		return
+
+	def close(self):
+		if not self.enabled:
+			return
+		now = time.monotonic()
+		# no summary line for runs without counted items
+		if self.display and (self.done or self.failed):
+			self._next_render = now
+		else:
+			self._next_render = float("inf")
+		if self.status_file:
+			self._next_status = now
+		self.refresh(now, state = "done")
+		if self._line_shown:
+			self.err_file.write("\n")
+			self._line_shown = False
+		return
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import bisect
+import re
+import sys
+# custom lib
+from . import subprog
+from .cache import FileResultCache
+from .metadata import Metadata
+
+
+class MetadataIndex(object):
+	"""
+	in-memory columnar index of list entries' metadata; per-tag inverted
+	indexes from (case-folded) value to rows, and sorted columns for range
+	queries, are built on first use; multi-valued tags (e.g. artist) are
+	indexed by each of their values; the audio file name is indexed as tag
+	'file'
+	"""
+	FILE_TAG = "file"
+
+	def __init__(self, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.fnames = list()
+		# tag -> ([row, ...], [value, ...])
+		self._columns = dict()
+		# indexes built from columns
+		self._inverted = dict()
+		self._present = dict()
+		self._sorted = dict()
+		return
+
+	def __len__(self):
+		return len(self.fnames)
+
+	def all_rows(self) -> set:
+		return set(range(len(self.fnames)))
+
+	def add(self, fname, metadata: Metadata) -> int:
+		row = len(self.fnames)
+		self.fnames.append(fname)
+		columns = self._columns
+		for tag, value in [(self.FILE_TAG, fname)]\
+				+ [(k, v.value) for k, v in metadata.items()]:
+			if tag not in columns:
+				columns[tag] = (list(), list())
+			rows, values = columns[tag]
+			if isinstance(value, list):
+				rows.extend([row] * len(value))
+				values.extend(value)
+			else:
+				rows.append(row)
+				values.append(value)
+		if self._inverted or self._present or self._sorted:
+			self._inverted.clear()
+			self._present.clear()
+			self._sorted.clear()
+		return row
+
+	def _get_column(self, tag) -> (list, list):
+		return self._columns.get(tag, (list(), list()))
+
+	def _get_inverted(self, tag) -> dict:
+		"""
+		{case-folded value: set of rows} of a tag
+		"""
+		if tag not in self._inverted:
+			inverted = dict()
+			for row, value in zip(*self._get_column(tag)):
+				key = str(value).casefold()
+				if key in inverted:
+					inverted[key].add(row)
+				else:
+					inverted[key] = {row}
+			self._inverted[tag] = inverted
+		return self._inverted[tag]
+
+	@staticmethod
+	def _to_number(value):
+		if isinstance(value, (int, float)):
+			return value
+		try:
+			return float(value)
+		except ValueError:
+			return None
+
+	def _get_sorted(self, tag, numeric: bool) -> (list, list):
+		"""
+		(sorted keys, rows) of a tag, keys are numbers if numeric else
+		case-folded strings; values not convertible to numbers are skipped
+		"""
+		key = (tag, numeric)
+		if key not in self._sorted:
+			pairs = list()
+			for row, value in zip(*self._get_column(tag)):
+				k = self._to_number(value) if numeric else str(value).casefold()
+				if k is not None:
+					pairs.append((k, row))
+			pairs.sort()
+			self._sorted[key] = ([k for k, _ in pairs], [r for _, r in pairs])
+		return self._sorted[key]
+
+	def rows_present(self, tag) -> set:
+		if tag not in self._present:
+			self._present[tag] = set(self._get_column(tag)[0])
+		return set(self._present[tag])
+
+	def rows_equal(self, tag, value: str) -> set:
+		ret = set(self._get_inverted(tag).get(value.casefold(), set()))
+		# numeric match so that e.g. track=3 matches '03'
+		number = self._to_number(value)
+		if number is not None:
+			ret.update(self.rows_range(tag, number, number))
+		return ret
+
+	def rows_range(self, tag, low = None, high = None, *,
+			low_inclusive = True, high_inclusive = True) -> set:
+		"""
+		rows with value of tag in the range; the range is numeric if bounds
+		are numbers, otherwise case-folded string ordering
+		"""
+		bound = low if low is not None else high
+		numeric = isinstance(bound, (int, float))
+		keys, rows = self._get_sorted(tag, numeric)
+		if not numeric:
+			low = None if low is None else low.casefold()
+			high = None if high is None else high.casefold()
+		start = 0 if low is None else (bisect.bisect_left(keys, low)\
+			if low_inclusive else bisect.bisect_right(keys, low))
+		stop = len(keys) if high is None else (bisect.bisect_right(keys, high)\
+			if high_inclusive else bisect.bisect_left(keys, high))
+		return set(rows[start:stop])
+
+	def rows_match(self, tag, regex) -> set:
+		"""
+		rows with any value of tag matching regex (searched in case-folded
+		distinct values, not every row)
+		"""
+		ret = set()
+		for value, rows in self._get_inverted(tag).items():
+			if regex.search(value):
+				ret.update(rows)
+		return ret
+
+
+class MetadataQuery(object):
+	"""
+	query expression over metadata tags, e.g.:
+	genre=Soundtrack and year<2000
+	album="Some Album" and not disc
+
+	a bare tag tests if the tag is present; comparisons are =, !=, <, <=, >,
+	>= and ~, !~ (regex search); comparisons are case-insensitive, numeric
+	if the value is a number; combine with and, or, not and parentheses;
+	files missing a tag never match comparisons on that tag
+	"""
+	class QuerySyntaxError(ValueError):
+		pass
+
+	_TOKEN_REGEX = re.compile(r"\s*(?:(?P<op>!=|<=|>=|!~|[=<>~()])"
+		r"|\"(?P<dq>(?:[^\"\\]|\\.)*)\"|'(?P<sq>(?:[^'\\]|\\.)*)'"
+		r"|(?P<word>[^\s=<>~()!\"']+))")
+	_UNQUOTE_REGEX = re.compile(r"\\(.)")
+	KEYWORDS = {"and", "or", "not"}
+
+	def __init__(self, expr: str, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.expr = expr
+		self._tokens = self._tokenize(expr)
+		self._pos = 0
+		self._root = self._parse_or()
+		if self._pos < len(self._tokens):
+			self._error("unexpected '%s'" % self._tokens[self._pos][1])
+		return
+
+	def _error(self, msg):
+		raise self.QuerySyntaxError("%s in query '%s'" % (msg, self.expr))
+
+	def _tokenize(self, expr) -> list:
+		"""
+		list of (kind, text), kind is op, str (quoted), word or keyword
+		"""
+		tokens, pos = list(), 0
+		expr = expr.rstrip()
+		while pos < len(expr):
+			m = self._TOKEN_REGEX.match(expr, pos)
+			if not m:
+				self._error("invalid character at %d" % pos)
+			pos = m.end()
+			if m.group("op"):
+				tokens.append(("op", m.group("op")))
+			elif m.group("word"):
+				word = m.group("word")
+				if word.lower() in self.KEYWORDS:
+					tokens.append(("keyword", word.lower()))
+				else:
+					tokens.append(("word", word))
+			else:
+				s = m.group("sq") if m.group("dq") is None else m.group("dq")
+				tokens.append(("str", self._UNQUOTE_REGEX.sub(r"\1", s)))
+		return tokens
+
+	def _peek(self):
+		return self._tokens[self._pos] if self._pos < len(self._tokens)\
+			else (None, None)
+
+	def _next(self):
+		token = self._peek()
+		if token[0] is None:
+			self._error("unexpected end")
+		self._pos += 1
+		return token
+
+	# recursive descent parser; each node is compiled into a function
+	# index -> set of rows
+	def _parse_or(self):
+		nodes = [self._parse_and()]
+		while self._peek() == ("keyword", "or"):
+			self._next()
+			nodes.append(self._parse_and())
+		if len(nodes) == 1:
+			return nodes[0]
+		return lambda index: set().union(*(n(index) for n in nodes))
+
+	def _parse_and(self):
+		nodes = [self._parse_not()]
+		while self._peek() == ("keyword", "and"):
+			self._next()
+			nodes.append(self._parse_not())
+		if len(nodes) == 1:
+			return nodes[0]
+		def node(index):
+			ret = nodes[0](index)
+			for n in nodes[1:]:
+				if not ret:
+					break
+				ret &= n(index)
+			return ret
+		return node
+
+	def _parse_not(self):
+		if self._peek() == ("keyword", "not"):
+			self._next()
+			child = self._parse_not()
+			return lambda index: index.all_rows() - child(index)
+		return self._parse_atom()
+
+	def _parse_atom(self):
+		kind, text = self._next()
+		if (kind, text) == ("op", "("):
+			node = self._parse_or()
+			if self._next() != ("op", ")"):
+				self._error("missing ')'")
+			return node
+		if kind not in ("word", "str"):
+			self._error("expected tag name, got '%s'" % text)
+		tag = text
+		op_kind, op = self._peek()
+		if (op_kind != "op") or (op in "()"):
+			return lambda index: index.rows_present(tag)
+		self._next()
+		kind, value = self._next()
+		if kind not in ("word", "str"):
+			self._error("expected value after '%s', got '%s'" % (op, value))
+		return self._compile_cmp(tag, op, value)
+
+	def _compile_cmp(self, tag, op, value):
+		if op in ("~", "!~"):
+			try:
+				regex = re.compile(value, re.IGNORECASE)
+			except re.error as e:
+				self._error("invalid regex '%s' (%s)" % (value, e))
+			if op == "~":
+				return lambda index: index.rows_match(tag, regex)
+			return lambda index: index.rows_present(tag)\
+				- index.rows_match(tag, regex)
+		if op == "=":
+			return lambda index: index.rows_equal(tag, value)
+		if op == "!=":
+			return lambda index: index.rows_present(tag)\
+				- index.rows_equal(tag, value)
+		bound = MetadataIndex._to_number(value)
+		bound = value if bound is None else bound
+		kw = dict(low = bound, low_inclusive = (op == ">="))\
+			if op in (">", ">=")\
+			else dict(high = bound, high_inclusive = (op == "<="))
+		return lambda index: index.rows_range(tag, **kw)
+
+	def select(self, index: MetadataIndex) -> list:
+		"""
+		matched rows in index order
+		"""
+		return sorted(self._root(index))
+
+
+@subprog.SubprogReg.new_subprog("query",
+	help = "select files on a list by a query over their metadata",
+	desc = "select files on a list by a query over their metadata, and write "
+		"matched files as a new list for other subprograms")
+class SubprogQuery(subprog.SubprogWithLogBase,
+		subprog.MetadataListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("query", type = str,
+			help = "query expression, e.g. \"genre=Soundtrack and year<2000\" "
+				"or \"album~'^some' and not disc\"; tags are compared "
+				"case-insensitively, numerically if the value is a number; "
+				"operators: =, !=, <, <=, >, >=, ~, !~ (regex), and, or, not, "
+				"(); a bare tag tests its presence; tag 'file' is the audio "
+				"file name; available tags: %s"\
+				% (", ").join(t for t in Metadata.iter_valtype_tags()\
+					if t != Metadata.Value.get_default_tag()))
+		ap.add_argument("-o", "--output", type = str, default = "-",
+			metavar = "file",
+			help = "write matched files as a list into this file "
+				"(default: -)")
+		ap.add_argument("--index", type = str, default = None,
+			metavar = "file",
+			help = "persistent index of sidecar tags, only sidecars changed "
+				"since last query are read again; not used with "
+				"-M/--manifest (default: no)")
+		return ap
+
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		if args.output == "-":
+			args.output = sys.stdout
+		# check syntax before reading any metadata
+		args.query = MetadataQuery(args.query)
+		return args
+
+	def _iter_indexed_metadata(self, args):
+		"""
+		same as iter_list_metadata, but with sidecar tags cached in the
+		persistent index file
+		"""
+		cache = FileResultCache.load(args.index)
+		yield from self.iter_cached_list_metadata(args, cache)
+		cache.save()
+		return
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		index = MetadataIndex()
+		items = self._iter_indexed_metadata(args)\
+			if (args.index and not args.manifest)\
+			else self.iter_list_metadata(args, required = False)
+		for fname, metadata in items:
+			index.add(fname, metadata)
+		rows = args.query.select(index)
+		fp = self.util.get_fp(args.output, "w", encoding = "utf-8")
+		fp.writelines(index.fnames[row] + "\n" for row in rows)
+		if fp is sys.stdout:
+			fp.flush()
+		else:
+			fp.close()
+		if args.verbose:
+			self.log_err("matched: %d of %d files\n" % (len(rows), len(index)))
+		return
@@ -1,30 +1,37 @@
 #!/usr/bin/env python3
 
 import os
-import shutil
 # custom lib
 from . import subprog
+from . import util
+from .extract_cover import CoverIndex
 from .metadata import Metadata
+from .scheduler import DeviceJobs
+from .transcode import TranscodePreset, ThroughputMeter
 
 
 @subprog.SubprogReg.new_subprog("remap_metadata",
 	help = "re-map metadata to audio files on a list",
 	desc = "re-map metadata to audio files on a list; mapping metadata must "
 		"contain at least artist and title fields; 'ffmpeg' must be available "
-		"unless -m/--move-only is used; if -R/--re-encode is used, required "
+		"unless -m/--move-only is used; if -R/--transcode is used, required "
 		"external codecs/tools must also be available")
 class SubprogRemapMetadata(subprog.SubprogWithLogBase,
-		subprog.ListBasedSubprogBase):
+		subprog.MetadataListBasedSubprogBase):
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_device_jobs
+	@subprog.SubprogBase.append_opt_journal
 	@subprog.SubprogBase.append_opt_program("ffmpeg")
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("-p", "--rename-pattern", type = str, default = None,
 			metavar = "pattern",
 			help = ("output file renaming pattern, not including extension; "
-				"available fields: %s (default: no renaming)"\
+				"available fields: %s (default: no renaming; with "
+				"-R/--transcode, the input file name with the output "
+				"extension)"\
 				% Metadata.get_fields_help_str()).replace("%", "%%"))
 		ap.add_argument("-C", "--conflict-prefix", type = str,
 			default = self.util.get_default_conflict_prefix(), metavar = "str",
@@ -36,68 +43,182 @@ class SubprogRemapMetadata(subprog.SubprogWithLogBase,
 				"metadata re-mapping; this is useful when no metadata content "
 				"need to be changed, therefore can accelerate the process by "
 				"bypassing making changes in file content; exclusive with "
-				"-R/--re-encode (default: no)")
+				"-R/--transcode (default: no)")
 		gp.add_argument("-R", "--transcode", type = str, default = None,
-			metavar = "format",
-			help = "transcode audio stream to given format/extension; if not "
-				"set, the extension of input audio file will be used; exclusive"
-				" with -m/--move-only (default: no)")
+			metavar = "format|preset",
+			help = "transcode audio stream to given format/extension, or with "
+				"a named encoder preset (%s); if not set, the extension of "
+				"input audio file will be used; exclusive with -m/--move-only "
+				"(default: no)"\
+				% (", ").join(TranscodePreset.iter_preset_names()))
+		ap.add_argument("-j", "--jobs", type = util.PosInt, default = None,
+			metavar = "int",
+			help = "number of parallel jobs (default: with -R/--transcode, "
+				"number of cores; otherwise 1)")
+		ap.add_argument("--cover-dir", type = str, default = None,
+			metavar = "dir",
+			help = "embed the shared album cover from this directory (see "
+				"extract_cover) instead of the pictures in input files; files "
+				"of albums without a cover keep their own; ignored by "
+				"-m/--move-only (default: no)")
 		return ap
 
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		args.preset = TranscodePreset.get_preset(args.transcode)\
+			if args.transcode else None
+		if args.cover_dir and args.preset and (args.preset.extension.lower()\
+				in TranscodePreset.NO_ATTACHED_PIC_EXTENSIONS):
+			raise self.ArgsError("--cover-dir can not embed covers into "
+				".%s files of -R/--transcode %s" % (args.preset.extension,
+				args.preset.name))
+		if args.jobs is None:
+			args.jobs = args.preset.get_default_jobs() if args.preset else 1
+		# transcoding is cpu-bound, -j/--jobs is not capped by hdd defaults
+		if (args.device_jobs is None) and args.preset:
+			args.device_jobs = DeviceJobs()
+		return args
+
 	def _remap_by_move(self, fname, new_fname, args, metadata):
 		if args.verbose:
 			self.log_err("copying: %s -> %s\n" % (fname, new_fname))
 		if not args.dry_run:
-			shutil.copy(fname, new_fname)
+			self.journal.copy(fname, new_fname)
 		return
 
-	def _remap_call_ffmpeg(self, fname, new_fname, args, metadata):
-		# finalize file names
-		# these file name modifications must be done just before cmd calling
-		fname = self.util.fname_prevent_monkey_patch(fname)
-		new_fname = self.util.fname_prevent_monkey_patch(new_fname)
-		ffmetadata = self.util.fname_prevent_monkey_patch(metadata.ffmetadata)
+	def _metadata_to_ffmpeg_opts(self, metadata) -> list:
+		ret = list()
+		for k in sorted(metadata.keys()):
+			ret.extend(["-metadata",
+				k + Metadata.TAG_SEP + metadata[k].to_ffmetadata()])
+		return ret
+
+	def _get_cover(self, fname, new_fname, args, metadata):
+		"""
+		shared cover to embed into new_fname, None if none or the output
+		container can not hold it
+		"""
+		if self.cover_index is None:
+			return None
+		cover = self.cover_index.get_cover_path(metadata.get_album_key(fname))
+		ext = os.path.splitext(new_fname)[1][1:].lower()
+		if cover and (ext in TranscodePreset.NO_ATTACHED_PIC_EXTENSIONS):
+			if args.verbose:
+				self.log_err("skipping cover: %s (not supported in .%s)\n"\
+					% (new_fname, ext))
+			return None
+		return cover
+
+	def _remap_call_ffmpeg(self, fname, new_fname, args, metadata) -> float:
+		"""
+		remap with ffmpeg into a temporary file, which is renamed to the output
+		on success; returns output audio duration in seconds, or None on failure
+		"""
+		if self.util.lexists(new_fname, cache = self.fs_cache)\
+				and (not args.force):
+			self.log_err("existing: %s\n" % new_fname)
+			return None
+		temp = self.util.get_temp_fname(new_fname)
 		# make cmd
-		cmd = [args.ffmpeg]
-		if args.force:
-			cmd.append("-y")
-		cmd.extend(["-i", fname, "-i", ffmetadata, "-map_metadata", "1"])
+		# file name modifications must be done just before cmd calling
+		# all inputs go first, ffmpeg applies options to the next file
+		cmd = [args.ffmpeg, "-nostdin", "-progress", "pipe:1", "-nostats",
+			"-i", self.util.fname_prevent_monkey_patch(fname)]
+		n_inputs, out_opts = 1, list()
+		if metadata.ffmetadata is None:
+			# metadata not from a sidecar (e.g. from manifest), set tags one by
+			# one; like -map_metadata of a sidecar, source tags are dropped
+			out_opts.extend(["-map_metadata", "-1"])
+			out_opts.extend(self._metadata_to_ffmpeg_opts(metadata))
+		else:
+			cmd.extend(["-i",
+				self.util.fname_prevent_monkey_patch(metadata.ffmetadata)])
+			out_opts.extend(["-map_metadata", "1"])
+			n_inputs += 1
+		cover = self._get_cover(fname, new_fname, args, metadata)
+		if cover:
+			cmd.extend(["-i", self.util.fname_prevent_monkey_patch(cover)])
+			out_opts.extend(["-map", "0:a", "-map", "%d:v" % n_inputs])
+		cmd.extend(out_opts)
 		# differentiate if need re-encode
 		# if re-encode is set, it should not be None
-		if args.transcode:
-			cmd.append(new_fname)
+		if args.preset:
+			cmd.extend(args.preset.get_ffmpeg_opts())
 		else:
-			cmd.extend(["-codec", "copy", new_fname])
+			cmd.extend(["-codec", "copy"])
+		if cover:
+			cmd.extend(["-c:v", "copy", "-disposition:v", "attached_pic"])
+		cmd.append(self.util.fname_prevent_monkey_patch(temp))
 		# call
-		self.logged_external_call(cmd, dry_run = args.dry_run,
+		progress = self.logged_external_output(cmd, dry_run = args.dry_run,
 			verbose = args.verbose)
+		if args.dry_run:
+			return 0.0
+		if progress is None:
+			# temp is created by ffmpeg, unknown to the filesystem state cache
+			if os.path.exists(temp):
+				os.remove(temp)
+			return None
+		self.journal.replace(temp, new_fname)
+		return ThroughputMeter.parse_ffmpeg_progress(progress)
+
+	def _get_new_fname(self, fname, args, metadata):
+		extension = args.preset.extension if args.preset\
+			else os.path.splitext(fname)[1][1:]
+		if args.rename_pattern:
+			new_fname = self.util.append_filename_extension(
+				metadata.format(args.rename_pattern), extension
+			)
+		else:
+			# if not renaming, the file name is kept
+			# this will always trigger adding conflict prefix however
+			new_fname = self.util.change_filename_extension(fname, extension)
+		# finally, protect windows users
+		new_fname = self.util.fname_replace_win_special_chars(new_fname)
+		# make sure no conflicts
+		if self.util.samefile(fname, new_fname, cache = self.fs_cache):
+			new_fname = args.conflict_prefix + new_fname
+		return new_fname
+
+	def _remap(self, args, item):
+		fname, new_fname, metadata = item
+		if args.move_only:
+			self._remap_by_move(fname, new_fname, args, metadata)
+			self.add_result(fname, True, output = new_fname)
+			return True, 0.0
+		seconds = self._remap_call_ffmpeg(fname, new_fname, args, metadata)
+		ok = seconds is not None
+		self.add_result(fname, ok, output = new_fname if ok else None)
+		return ok, (seconds or 0.0)
+
+	def _iter_remap_items(self, args):
+		# outputs are reserved before any job starts, parallel jobs can not
+		# check each other's outputs for existence
+		reserved = set()
+		for fname, metadata in self.iter_list_metadata(args):
+			new_fname = self._get_new_fname(fname, args, metadata)
+			key = os.path.normcase(os.path.abspath(new_fname))
+			if key in reserved:
+				self.log_err("[DuplicateOutput]: skipping %s (%s is the output "
+					"of an earlier entry)\n" % (fname, new_fname))
+				self.progress.update()
+				self.progress.fail()
+				self.add_result(fname, False, error = "duplicate output")
+				continue
+			reserved.add(key)
+			yield fname, new_fname, metadata
 		return
 
-	@subprog.SubprogWithLogBase.with_log()
+	@subprog.SubprogWithLogBase.with_log(fs_cache = True)
 	def subprog_main(self, args):
-		for fname in self.read_list(args):
-			# parse metadata
-			ffmetadata = Metadata.standard_ffmetadata(fname)
-			metadata = Metadata.read_ffmetadata(ffmetadata)
-			# figure out new file name
-			# first 1 selects the extension, second 1: discard extsep
-			extension = args.transcode or os.path.splitext(fname)[1][1:]
-			if args.rename_pattern:
-				new_fname = self.util.append_filename_extension(
-					metadata.format(args.rename_pattern), extension
-				)
-			else:
-				# if not renaming, the file name is kept
-				# this will always trigger adding conflict prefix however
-				new_fname = fname
-			# finally, protect windows users
-			new_fname = self.util.fname_replace_win_special_chars(new_fname)
-			# make sure no conflicts
-			if self.util.samefile(fname, new_fname):
-				new_fname = args.conflict_prefix + new_fname
-			# remap metadata
-			if args.move_only:
-				self._remap_by_move(fname, new_fname, args, metadata)
-			else:
-				self._remap_call_ffmpeg(fname, new_fname, args, metadata)
+		self.cover_index = CoverIndex.load(args.cover_dir)\
+			if args.cover_dir else None
+		meter = ThroughputMeter()
+		for ok, seconds in self.iter_parallel(
+				lambda item: self._remap(args, item),
+				self._iter_remap_items(args), jobs = args.jobs,
+				path_of = lambda item: item[0], device_jobs = args.device_jobs):
+			meter.add(ok, seconds)
+		if not args.move_only:
+			self.log_err("remapped: %s\n" % meter.summary())
 		return
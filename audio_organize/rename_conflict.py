@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 
 import glob
-import os
-import shutil
 # custom lib
 from . import subprog
 
@@ -15,6 +13,8 @@ class SubprogRenameConflict(subprog.SubprogWithLogBase):
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_journal
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("-C", "--conflict-prefix", type = str,
@@ -23,25 +23,16 @@ class SubprogRenameConflict(subprog.SubprogWithLogBase):
 				% self.util.get_default_conflict_prefix())
 		return ap
 
-	def _rename_conflict(self, fname, prefix, *, force = None, dry_run = None,
-			verbose = None):
+	def _get_new_fname(self, fname, prefix):
 		if not fname.startswith(prefix):
 			raise ValueError("fname must be string starting with '%s', "
 				"got '%s'" % (prefix, fname))
-		new_fname = fname[len(prefix):]
-		if verbose:
-			self.log_err("renaming: %s -> %s\n" % (fname, new_fname))
-		if not dry_run:
-			if (not os.path.exists(new_fname)) or force:
-				shutil.move(fname, new_fname)
-			else:
-				self.log_err("existing: %s\n" % (new_fname))
-		return
+		return fname[len(prefix):]
 
-	@subprog.SubprogWithLogBase.with_log()
+	@subprog.SubprogWithLogBase.with_log(fs_cache = True)
 	def subprog_main(self, args):
-		for fname in glob.glob(args.conflict_prefix + "*"):
-			self._rename_conflict(fname, args.conflict_prefix,
-				force = args.force, dry_run = args.dry_run,
-				verbose = args.verbose)
+		pairs = [(f, self._get_new_fname(f, args.conflict_prefix))\
+			for f in glob.glob(glob.escape(args.conflict_prefix) + "*")]
+		self.logged_batch_rename(pairs, force = args.force,
+			dry_run = args.dry_run, verbose = args.verbose, jobs = args.jobs)
 		return
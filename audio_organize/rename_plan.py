@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import collections
+import os
+# custom lib
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class RenamePlan(object):
+	"""
+	plan renames of a batch of files before doing any of them; targets are
+	checked for collisions within the batch and against one listing per
+	target directory (instead of an exists() call per file); renames are
+	ordered into stages of independent renames that can be done in parallel:
+	chains (a->b, b->c) are done from the tail, and cycles (a->b, b->a) are
+	broken by moving one file to a temporary name first; target directories
+	are listed through <cache> (util.FsStateCache of the run), if given
+	"""
+	def __init__(self, pairs, *, force = None, cache = None, **kw):
+		super().__init__(**kw)
+		self.force = force
+		self.cache = cache
+		# (src, dst, reason) of renames not to do
+		self.skipped = list()
+		# list of stages, each a list of (src, dst)
+		self.stages = list()
+		renames = self._check(pairs)
+		self._order(renames)
+		return
+
+	def __len__(self):
+		return sum(len(s) for s in self.stages)
+
+	def _list_dirs(self, dirs) -> dict:
+		ret = dict()
+		for d in dirs:
+			try:
+				ret[d] = self.util.listdir(d or os.path.curdir,
+					cache = self.cache)
+			except FileNotFoundError:
+				ret[d] = set()
+		return ret
+
+	def _check(self, pairs) -> dict:
+		"""
+		returns {normalized src: (src, dst, normalized dst)} of renames to do
+		"""
+		renames = collections.OrderedDict()
+		targets = dict()
+		for src, dst in pairs:
+			key_src, key_dst = os.path.normpath(src), os.path.normpath(dst)
+			if (key_src == key_dst) or (key_src in renames):
+				continue
+			if key_dst in targets:
+				self.skipped.append((src, dst,
+					"same target as %s" % targets[key_dst]))
+				continue
+			targets[key_dst] = src
+			renames[key_src] = (src, dst, key_dst)
+		if self.force:
+			return renames
+		# a rename is blocked if its target exists and is not renamed away
+		# in this batch; skipping it may block the rename into its source
+		listings = self._list_dirs({os.path.dirname(k) for k in targets})
+		into = {v[2]: k for k, v in renames.items()}
+		blocked = [k for k, v in renames.items()\
+			if (v[2] not in renames)\
+			and (os.path.basename(v[2]) in listings[os.path.dirname(v[2])])]
+		while blocked:
+			key_src = blocked.pop()
+			src, dst, _ = renames.pop(key_src)
+			self.skipped.append((src, dst, "existing"))
+			if key_src in into:
+				blocked.append(into[key_src])
+		return renames
+
+	def _order(self, renames):
+		next_of = {k: v[2] for k, v in renames.items()}
+		prev_of = {v: k for k, v in next_of.items() if v in next_of}
+		stages = collections.defaultdict(list)
+		pre_stage, post_stage = list(), list()
+		def add_chain(tail, stop = None):
+			# tail's target is free, walk back to the chain head
+			node, d = tail, 0
+			while (node is not None) and (node != stop):
+				src, dst, _ = renames[node]
+				stages[d].append((src, dst))
+				done.add(node)
+				node, d = prev_of.get(node), d + 1
+			return
+		done = set()
+		for node, dst in next_of.items():
+			if dst not in next_of:
+				add_chain(node)
+		# all left are in cycles
+		for node in next_of:
+			if node in done:
+				continue
+			src, dst, _ = renames[node]
+			temp = self.util.get_temp_fname(src)
+			pre_stage.append((src, temp))
+			post_stage.append((temp, dst))
+			done.add(node)
+			add_chain(prev_of[node], stop = node)
+		self.stages = ([pre_stage] if pre_stage else list())\
+			+ [stages[d] for d in sorted(stages)]\
+			+ ([post_stage] if post_stage else list())
+		return
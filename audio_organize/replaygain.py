@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import array
+import math
+import re
+# custom lib
+from . import subprog
+from .metadata import Metadata
+
+
+class LoudnessBlocks(object):
+	"""
+	loudness of 400ms gating blocks (75% overlap) of one or more tracks, as
+	measured by ffmpeg 'ebur128' filter; integrated loudness is computed with
+	the ITU-R BS.1770 absolute and relative gates, so that album loudness is
+	computed by concatenating the blocks of its tracks without re-decoding
+	"""
+	ABS_GATE = -70.0
+	REL_GATE = -10.0
+
+	def __init__(self, *ka, **kw):
+		super().__init__(*ka, **kw)
+		# mean square energy of each block
+		self.energies = array.array("d")
+		# true peak in linear scale
+		self.peak = 0.0
+		return
+
+	@staticmethod
+	def loudness_to_energy(lufs):
+		return 10 ** ((lufs + 0.691) / 10)
+
+	@staticmethod
+	def energy_to_loudness(energy):
+		return -0.691 + 10 * math.log10(energy)
+
+	def extend(self, other):
+		self.energies.extend(other.energies)
+		self.peak = max(self.peak, other.peak)
+		return self
+
+	def integrated_loudness(self) -> float:
+		"""
+		gated integrated loudness in LUFS, None if all blocks are gated
+		"""
+		abs_gate = self.loudness_to_energy(self.ABS_GATE)
+		gated = [e for e in self.energies if e > abs_gate]
+		if not gated:
+			return None
+		rel_gate = sum(gated) / len(gated) * 10 ** (self.REL_GATE / 10)
+		gated = [e for e in gated if e > rel_gate]
+		return self.energy_to_loudness(sum(gated) / len(gated))
+
+	# ffmpeg ebur128 filter per-frame log line, and the true peak summary
+	_FRAME_REGEX = re.compile(r"\bt:\s*[\d.]+\s.*?\bM:\s*(-?[\d.]+|-?inf)")
+	_PEAK_REGEX = re.compile(r"^\s*Peak:\s*(-?[\d.]+|-?inf)\s*dBFS",
+		re.MULTILINE)
+
+	@classmethod
+	def from_ffmpeg_ebur128_log(cls, text: str):
+		new = cls()
+		for m in cls._FRAME_REGEX.finditer(text):
+			# momentary loudness is the loudness of the 400ms block ending at
+			# this 100ms step
+			new.energies.append(cls.loudness_to_energy(float(m.group(1))))
+		peaks = cls._PEAK_REGEX.findall(text)
+		if peaks:
+			new.peak = 10 ** (float(peaks[-1]) / 20)
+		return new
+
+
+@subprog.SubprogReg.new_subprog("replaygain",
+	help = "analyze loudness of audio files on a list and save replaygain tags",
+	desc = "analyze EBU R128 loudness and true peak of audio files on a list, "
+		"save replaygain 2.0 track and album gain/peak tags into the metadata "
+		"(remap_metadata embeds them); albums are aggregated from per-track "
+		"measurements without decoding twice; 'ffmpeg' must be available")
+class SubprogReplayGain(subprog.SubprogWithLogBase,
+		subprog.MetadataListBasedSubprogBase):
+	REFERENCE_LUFS = -18.0
+
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("ffmpeg")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("--no-album", action = "store_true",
+			help = "only save track gain/peak tags (default: no)")
+		return ap
+
+	def _analyze(self, args, fname) -> LoudnessBlocks:
+		cmd = [args.ffmpeg, "-nostdin", "-nostats", "-hide_banner",
+			"-i", self.util.fname_prevent_monkey_patch(fname),
+			"-map", "0:a:0", "-af", "ebur128=peak=true:framelog=info",
+			"-f", "null", "-"]
+		log = self.logged_external_output(cmd, dry_run = args.dry_run,
+			verbose = args.verbose, capture_stderr = True)
+		return None if log is None\
+			else LoudnessBlocks.from_ffmpeg_ebur128_log(log)
+
+	def _set_gain(self, metadata, kind, blocks) -> bool:
+		loudness = blocks.integrated_loudness()
+		if loudness is None:
+			return False
+		gain_tag, peak_tag = "replaygain_%s_gain" % kind,\
+			"replaygain_%s_peak" % kind
+		metadata[gain_tag] = Metadata.get_valtype_by_tag(gain_tag)(
+			value = self.REFERENCE_LUFS - loudness)
+		metadata[peak_tag] = Metadata.get_valtype_by_tag(peak_tag)(
+			value = blocks.peak)
+		return True
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		# all entries are kept until albums are complete
+		entries = list(self.iter_list_metadata(args))
+		albums, analyzed = dict(), set()
+		for i, blocks in enumerate(self.iter_parallel(
+				lambda e: self._analyze(args, e[0]), entries,
+				jobs = args.jobs)):
+			fname, metadata = entries[i]
+			if blocks is None:
+				continue
+			if self._set_gain(metadata, "track", blocks):
+				if args.verbose:
+					self.log_err("track: %s: %s, peak %s\n" % (fname,
+						metadata["replaygain_track_gain"],
+						metadata["replaygain_track_peak"]))
+			else:
+				self.log_err("skipping: %s (silent)\n" % fname)
+				continue
+			album = metadata.get_album_key(fname)
+			albums.setdefault(album, LoudnessBlocks()).extend(blocks)
+			analyzed.add(i)
+		# save
+		with self.open_metadata_output(args, force = True) as output:
+			for i, (fname, metadata) in enumerate(entries):
+				if i in analyzed:
+					if not args.no_album:
+						self._set_gain(metadata, "album",
+							albums[metadata.get_album_key(fname)])
+					output.save(fname, metadata)
+				else:
+					output.keep(fname, metadata)
+		return
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import collections
+import concurrent.futures
+import os
+# custom lib
+from . import util
+
+
+class DeviceJobs(dict):
+	"""
+	per-device-kind concurrency limits, parsed from a comma-separated
+	<kind>=<int> list; kinds are hdd, ssd, network and other; DEFAULT is for
+	io-bound work, cpu-bound work (e.g. transcoding) is not limited per device
+	unless asked
+	"""
+	KINDS = ["hdd", "ssd", "network", "other"]
+	DEFAULT = "hdd=1,network=4"
+
+	def __init__(self, s = "", *ka, **kw):
+		super().__init__(*ka, **kw)
+		for i in filter(None, s.split(",")):
+			kind, sep, value = i.partition("=")
+			if (not sep) or (kind not in self.KINDS):
+				raise ValueError("invalid device jobs '%s', expected "
+					"<kind>=<int> with kind in %s" % (i, str(self.KINDS)))
+			self[kind] = util.PosInt(value)
+		return
+
+
+@util.StaticUtilityMethods.decorate
+class DeviceScheduler(object):
+	"""
+	run jobs in a thread pool, limiting concurrent jobs per physical device
+	that the jobs' files are on; within each device, jobs are started in
+	input order, so spinning disks see mostly sequential access while
+	ssd-backed paths run wide
+	"""
+	NETWORK_FSTYPES = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "ceph",
+		"glusterfs", "fuse.sshfs", "fuse.rclone", "afs"}
+
+	def __init__(self, jobs: int, device_jobs: DeviceJobs = None, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.jobs = jobs
+		self.device_jobs = DeviceJobs(DeviceJobs.DEFAULT)\
+			if device_jobs is None else device_jobs
+		self._kinds = dict()
+		self._fstypes = None
+		return
+
+	def _get_fstypes(self) -> dict:
+		# "major:minor" -> fs type of mounted filesystems (linux only)
+		if self._fstypes is None:
+			self._fstypes = dict()
+			try:
+				with open("/proc/self/mountinfo", "r") as fp:
+					for line in fp:
+						fields = line.split()
+						sep = fields.index("-")
+						self._fstypes[fields[2]] = fields[sep + 1]
+			except (OSError, ValueError, IndexError):
+				pass
+		return self._fstypes
+
+	def _probe_kind(self, dev) -> str:
+		dev_str = "%d:%d" % (os.major(dev), os.minor(dev))
+		if self._get_fstypes().get(dev_str) in self.NETWORK_FSTYPES:
+			return "network"
+		# partitions have no queue/, which is on the parent (whole) disk
+		sys_dev = os.path.join("/sys/dev/block", dev_str)
+		for queue in [os.path.join(sys_dev, "queue"),
+				os.path.join(sys_dev, os.path.pardir, "queue")]:
+			try:
+				with open(os.path.join(queue, "rotational"), "r") as fp:
+					return "hdd" if fp.read().strip() == "1" else "ssd"
+			except OSError:
+				continue
+		return "other"
+
+	def get_device(self, path):
+		"""
+		returns (device id, device kind) of a path; for paths not existing
+		(e.g. outputs), the nearest existing parent directory is used
+		"""
+		path = os.path.abspath(path)
+		while True:
+			try:
+				dev = os.stat(path).st_dev
+				break
+			except OSError:
+				parent = os.path.dirname(path)
+				if parent == path:
+					return None, "other"
+				path = parent
+		if dev not in self._kinds:
+			self._kinds[dev] = self._probe_kind(dev)
+		return dev, self._kinds[dev]
+
+	def get_limit(self, kind) -> int:
+		return min(self.jobs, self.device_jobs.get(kind, self.jobs))
+
+	def iter_run(self, func, iterable, *, path_of = lambda x: x):
+		"""
+		call func(item) for each item and yield results in input order;
+		path_of(item) gives the file deciding the device of that item; at most
+		4 * <jobs> items are read ahead
+		"""
+		window = 4 * self.jobs
+		queues = collections.OrderedDict()
+		active = collections.Counter()
+		running, results = dict(), dict()
+		items = enumerate(iterable)
+		exhausted, n_queued, next_yield = False, 0, 0
+		with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+			while True:
+				# read ahead
+				while (not exhausted)\
+						and (n_queued + len(running) + len(results) < window):
+					try:
+						i, item = next(items)
+					except StopIteration:
+						exhausted = True
+						break
+					dev, kind = self.get_device(path_of(item))
+					queues.setdefault((dev, kind), collections.deque())\
+						.append((i, item))
+					n_queued += 1
+				# dispatch within per-device and total limits
+				for (dev, kind), queue in queues.items():
+					while queue and (len(running) < self.jobs)\
+							and (active[dev] < self.get_limit(kind)):
+						i, item = queue.popleft()
+						n_queued -= 1
+						running[executor.submit(func, item)] = (i, dev)
+						active[dev] += 1
+				# yield finished results in order
+				while next_yield in results:
+					yield results.pop(next_yield)
+					next_yield += 1
+				if not running:
+					if exhausted and (not n_queued):
+						break
+					continue
+				done, _ = concurrent.futures.wait(running,
+					return_when = concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					i, dev = running.pop(future)
+					active[dev] -= 1
+					results[i] = future.result()
+		while next_yield in results:
+			yield results.pop(next_yield)
+			next_yield += 1
+		return
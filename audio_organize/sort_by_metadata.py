@@ -1,21 +1,118 @@
 #!/usr/bin/env python3
 
+import hashlib
+import itertools
 import os
-import shutil
+import threading
 # custom lib
 from . import subprog
 from . import util
 from .metadata import Metadata
 
 
+@util.StaticUtilityMethods.decorate
+class SortDirs(object):
+	"""
+	output directories of a sort run; each directory is listed and created
+	at most once per run and entries added by the run are tracked in memory,
+	so that placing a file needs no stat() calls
+
+	sub-directories can be sharded into first-letter or hash-prefix levels,
+	e.g. 'Artist' as 'A/Artist' or '3f/Artist'; with a cap on entries, a full
+	directory overflows into 'Artist (2)', 'Artist (3)', etc.
+	"""
+	SHARDS = ["none", "letter", "hash"]
+
+	def __init__(self, *ka, shard = "none", shard_levels = 1,
+			max_entries = 0, journal = None, dry_run = False, cache = None,
+			**kw):
+		super().__init__(*ka, **kw)
+		self.shard = shard
+		self.shard_levels = shard_levels
+		self.max_entries = max_entries
+		self.journal = journal
+		self.dry_run = dry_run
+		# util.FsStateCache of the run, if any
+		self.cache = cache
+		# {directory: set of entry names}
+		self._listings = dict()
+		self._created = set()
+		# paths placed by this run, never overwritten by a later entry
+		self._reserved = set()
+		# files are placed from worker threads
+		self._lock = threading.Lock()
+		return
+
+	def get_shard_dirs(self, subdir) -> list:
+		if self.shard == "letter":
+			# non-alphanumeric first characters share one shard
+			key = [(c.upper() if c.isalnum() else "_") for c in subdir]
+			return [("").join(key[:i + 1]) for i in range(self.shard_levels)]
+		if self.shard == "hash":
+			h = hashlib.md5(subdir.encode("utf-8")).hexdigest()
+			return [h[2 * i:2 * i + 2] for i in range(self.shard_levels)]
+		return list()
+
+	def _get_listing(self, path) -> set:
+		if path not in self._listings:
+			try:
+				self._listings[path] = set(self.util.listdir(path,
+					cache = self.cache))
+			except FileNotFoundError:
+				self._listings[path] = set()
+		return self._listings[path]
+
+	def _makedirs(self, path):
+		if (path in self._created) or self.dry_run:
+			return
+		self.journal.makedirs(path)
+		# all parents are created with it
+		while path and (path not in self._created):
+			self._created.add(path)
+			path = os.path.dirname(path)
+		return
+
+	def _get_key(self, path, name):
+		return os.path.normcase(os.path.abspath(os.path.join(path, name)))
+
+	def place(self, subdir, names) -> (str, list, list):
+		"""
+		reserve entries <names> in sub-directory <subdir> (or its overflow)
+		and create it if not yet; returns the directory, the names already
+		existing in it, and the names already reserved by an earlier entry
+		of this run; the latter must not be written even if forced
+		"""
+		parent = os.path.join(*self.get_shard_dirs(subdir), "")
+		with self._lock:
+			for i in itertools.count(1):
+				path = parent + (subdir if i == 1 else "%s (%d)" % (subdir, i))
+				listing = self._get_listing(path)
+				existing = [n for n in names if n in listing]
+				# files already there stay with it; an empty directory takes
+				# any files
+				if existing or (not listing) or (self.max_entries <= 0)\
+						or (len(listing) + len(names) <= self.max_entries):
+					break
+			reserved = [n for n in names\
+				if self._get_key(path, n) in self._reserved]
+			existing = [n for n in existing if n not in reserved]
+			self._reserved.update(self._get_key(path, n) for n in names)
+			listing.update(names)
+			self._makedirs(path)
+		return path, existing, reserved
+
+
 @subprog.SubprogReg.new_subprog("sort_by_metadata",
 	help = "create and sort files into metadata-based sub-directories",
 	desc = "create and sort files into metadata-based sub-directories")
 class SubprogSortByMetadata(subprog.SubprogWithLogBase,
-		subprog.ListBasedSubprogBase):
+		subprog.MetadataListBasedSubprogBase):
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_device_jobs
+	@subprog.SubprogBase.append_opt_journal
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("pattern", type = str,
@@ -24,28 +121,76 @@ class SubprogSortByMetadata(subprog.SubprogWithLogBase,
 		ap.add_argument("-c", "--copy", "--keep-source", action = "store_true",
 			help = "copy and sort into sub-directory, keep source file(s) "
 				"(default: no)")
+		ap.add_argument("--shard", type = str, default = "none",
+			choices = SortDirs.SHARDS,
+			help = "put sub-directories into shard directories by their first "
+				"letters (e.g. A/Artist) or hash prefixes (e.g. 3f/Artist), to "
+				"limit entries in the output directory (default: none)")
+		ap.add_argument("--shard-levels", type = util.PosInt, default = 1,
+			metavar = "int",
+			help = "levels of shard directories, e.g. 2 for A/AR/Artist "
+				"(default: 1)")
+		ap.add_argument("--max-entries", type = int, default = 0,
+			metavar = "int",
+			help = "max entries in a sub-directory, files to a full "
+				"sub-directory go to '<sub-directory> (2)', etc.; 0 for no "
+				"limit (default: 0)")
 		return ap
 
-	@subprog.SubprogWithLogBase.with_log()
+	def _sort(self, args, item) -> (str, Metadata):
+		"""
+		sort one list entry, returns its audio file name after sorting and its
+		metadata
+		"""
+		fname, metadata = item
+		subdir = self.util.fname_replace_win_special_chars(
+			metadata.format(args.pattern))
+		srcs = [fname] if args.manifest\
+			else [fname, Metadata.standard_ffmetadata(fname)]
+		# make sub-directory
+		subdir, existing, reserved = self.sort_dirs.place(subdir,
+			[os.path.basename(src) for src in srcs])
+		if os.path.basename(fname) in reserved:
+			self.log_err("[DuplicateOutput]: skipping %s (%s is the output of "
+				"an earlier entry)\n" % (fname, os.path.join(subdir,
+				os.path.basename(fname))))
+			self.progress.fail()
+			self.add_result(fname, False, error = "duplicate output")
+			return fname, metadata
+		# sort into the sub-directory
+		new_fname, sorted_to = fname, None
+		for src in srcs:
+			dst = os.path.join(subdir, os.path.basename(src))
+			method = self.journal.copy if args.copy else self.journal.move
+			if (os.path.basename(src) in existing) and (not args.force):
+				self.log_err("skipping: %s (already exists)\n" % dst)
+			else:
+				if src == fname:
+					sorted_to = dst
+				if args.verbose:
+					self.log_err("%s: %s -> %s\n" % (("copying"\
+						if args.copy else "moving"), src, dst))
+				if not args.dry_run:
+					method(src, dst)
+				if (src == fname) and (not args.copy):
+					new_fname = dst
+		self.add_result(fname, sorted_to is not None, output = sorted_to,
+			error = None if sorted_to else "existing")
+		return new_fname, metadata
+
+	@subprog.SubprogWithLogBase.with_log(fs_cache = True)
 	def subprog_main(self, args):
-		for fname in self.read_list(args):
-			ffmetadata = Metadata.standard_ffmetadata(fname)
-			metadata = Metadata.read_ffmetadata(ffmetadata)
-			subdir = self.util.fname_replace_win_special_chars(
-				metadata.format(args.pattern))
-			# make sub-directory
-			if not args.dry_run:
-				os.makedirs(subdir, exist_ok = True)
-			# sort into the sub-directory
-			for src in [fname, ffmetadata]:
-				dst = os.path.join(subdir, os.path.basename(src))
-				method = shutil.copy if args.copy else shutil.move
-				if os.path.exists(dst) and (not args.force):
-					self.log_err("skipping: %s (already exists)\n" % dst)
-				else:
-					if args.verbose:
-						self.log_err("%s: %s -> %s\n" % (
-							("copying" if args.copy else "moving"), src, dst))
-					if not args.dry_run:
-						method(src, dst)
+		self.sort_dirs = SortDirs(shard = args.shard,
+			shard_levels = args.shard_levels, max_entries = args.max_entries,
+			journal = self.journal, dry_run = args.dry_run,
+			cache = self.fs_cache)
+		# with a manifest, only audio files are sorted and the manifest is
+		# updated with their new locations
+		with self.open_metadata_output(args, force = True) as output:
+			for new_fname, metadata in self.iter_parallel(
+					lambda item: self._sort(args, item),
+					self.iter_list_metadata(args), jobs = args.jobs,
+					path_of = lambda item: item[0],
+					device_jobs = args.device_jobs):
+				output.keep(new_fname, metadata)
 		return
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import bisect
+import itertools
 import os
 # custom lib
 from . import subprog
@@ -13,57 +15,142 @@ from .metadata import Metadata
 	desc = "split continuous metadata track# into disc&tract tags, "
 		"make changes to metadata file(s) inplace")
 class SubprogSortDiscTrack(subprog.SubprogWithLogBase,
-		subprog.ListBasedSubprogBase):
+		subprog.MetadataListBasedSubprogBase):
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("-T", "--num-track-list", metavar = "int[,int[,...]]",
-			type = util.CommaSepNonNegInts, required = True,
+			type = util.CommaSepNonNegInts, default = None,
 			help = "a commpa-separated list of total num tracks per disc in "
-				"disc order (required)")
+				"disc order (required unless --by-album is set)")
 		ap.add_argument("--track-offset", type = int, default = 0,
 			metavar = "int",
 			help = "treat input (continuous) track number as <value> + "
 				"<offset> (default: 0)")
+		ap.add_argument("--by-album", action = "store_true",
+			help = "group list entries by tag 'album' and split each album "
+				"as a whole; -T/--num-track-list is inferred per album if "
+				"its files are in separate per-disc directories, otherwise "
+				"-T/--num-track-list is used (default: no)")
 		return ap
 
-	def _split_by_list(self, metadata, num_track_list: list, track_offset = 0)\
-			-> (int, int):
-		track = util.PosInt(metadata["track"]) + track_offset
-		for i, v in enumerate(num_track_list):
-			if track > v:
-				track -= v
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		if (args.num_track_list is None) and (not args.by_album):
+			raise self.ArgsError("-T/--num-track-list is required unless "
+				"--by-album is set")
+		return args
+
+	@staticmethod
+	def _get_disc_bounds(num_track_list: list) -> list:
+		# the continuous track number of the last track of each disc
+		return list(itertools.accumulate(num_track_list))
+
+	@staticmethod
+	def _split_by_bounds(track: int, bounds: list) -> (int, int):
+		i = bisect.bisect_left(bounds, track)
+		return i + 1, track - (bounds[i - 1] if i else 0)
+
+	def _infer_num_track_list(self, entries, track_offset = 0) -> list:
+		"""
+		infer per-disc track numbers from files in per-disc directories;
+		returns None if cannot be inferred
+		"""
+		by_dir = dict()
+		for fname, metadata in entries:
+			by_dir.setdefault(os.path.dirname(fname), list())\
+				.append(metadata["track"].value + track_offset)
+		if len(by_dir) < 2:
+			return None
+		discs = sorted((sorted(v) for v in by_dir.values()),
+			key = lambda v: v[0])
+		# continuous track numbers must be exactly 1..N in disc order
+		tracks = list(itertools.chain.from_iterable(discs))
+		if tracks != list(range(1, len(tracks) + 1)):
+			return None
+		return [len(v) for v in discs]
+
+	def _check_entry(self, fname, metadata, bounds, track_offset = 0)\
+			-> bool:
+		if "disc" in metadata:
+			self.log_err("skipping: %s (tag 'disc' already exists)\n" % fname)
+			return False
+		if "track" not in metadata:
+			self.log_err("skipping: %s (tag 'track' not exists)\n" % fname)
+			return False
+		track = metadata["track"].value + track_offset
+		if (bounds is not None) and not (1 <= track <= bounds[-1]):
+			self.log_err("skipping: %s (continuous track number with "
+				"--track-offset not in 1..sum of -T/--num-track-list)\n"\
+				% fname)
+			return False
+		return True
+
+	def _sort_entry(self, args, fname, metadata, bounds, output):
+		track = metadata["track"].value
+		new_disc, new_track = self._split_by_bounds(track + args.track_offset,
+			bounds)
+		if args.verbose:
+			self.log_err("parsing: T%d -> D%d,T%d (%s)\n"\
+				% (track, new_disc, new_track, fname))
+		metadata["disc"] = Metadata.get_valtype_by_tag("disc")\
+			.from_formatted(str(new_disc))
+		metadata["track"] = Metadata.get_valtype_by_tag("track")\
+			.from_formatted(str(new_track))
+		if args.verbose:
+			self.log_err("saving: %s\n" % (args.manifest\
+				or Metadata.standard_ffmetadata(fname)))
+		output.save(fname, metadata)
+		return
+
+	def _sort_by_list(self, args, output):
+		bounds = self._get_disc_bounds(args.num_track_list)
+		for fname, metadata in self.iter_list_metadata(args):
+			if self._check_entry(fname, metadata, bounds, args.track_offset):
+				self._sort_entry(args, fname, metadata, bounds, output)
 			else:
-				disc = i + 1
-				break
-		return disc, track
+				output.keep(fname, metadata)
+		return
 
-	@subprog.SubprogWithLogBase.with_log()
-	def subprog_main(self, args):
-		for fname in self.read_list(args):
-			ffmetadata = Metadata.standard_ffmetadata(fname)
-			metadata = Metadata.read_ffmetadata(ffmetadata)
-			if "disc" in metadata:
-				self.log_err("skipping: %s (tag 'disc' already exists)\n"\
-					% fname)
+	def _sort_by_album(self, args, output):
+		# entries of an album must be seen all together, so all are loaded;
+		# output is still in list order
+		entries = list(self.iter_list_metadata(args))
+		albums = dict()
+		for i, (fname, metadata) in enumerate(entries):
+			if self._check_entry(fname, metadata, None):
+				album = metadata["album"].value if "album" in metadata else None
+				albums.setdefault(album, list()).append(i)
+		todo = dict()
+		for album, indices in albums.items():
+			num_track_list = self._infer_num_track_list(
+				[entries[i] for i in indices], args.track_offset)\
+				or args.num_track_list
+			if num_track_list is None:
+				self.log_err("skipping album: %s (cannot infer "
+					"-T/--num-track-list)\n" % album)
 				continue
-			if "track" not in metadata:
-				self.log_err("skipping: %s (tag 'track' not exists)\n" % fname)
-				continue
-			if util.PosInt(metadata["track"]) > sum(args.num_track_list):
-				self.log_err("skipping: %s (continuous track number greater "
-					"than sum of -T/--num-track-list)\n")
-				continue
-			disc, track = self._split_by_list(metadata, args.num_track_list,
-				track_offset = args.track_offset)
-			if args.verbose:
-				self.log_err("parsing: T%d -> D%d,T%d (%s)\n"\
-					% (util.PosInt(metadata["track"]), disc, track, fname))
-			metadata["disc"], metadata["track"] = str(disc), str(track)
-			# save modified metadata file, force = True is a must
 			if args.verbose:
-				self.log_err("saving: %s\n" % ffmetadata)
-			if not args.dry_run:
-				metadata.save_ffmetadata(ffmetadata, force = True)
+				self.log_err("album: %s -> -T %s\n" % (album,
+					(",").join(map(str, num_track_list))))
+			bounds = self._get_disc_bounds(num_track_list)
+			for i in indices:
+				if self._check_entry(*entries[i], bounds, args.track_offset):
+					todo[i] = bounds
+		for i, (fname, metadata) in enumerate(entries):
+			if i in todo:
+				self._sort_entry(args, fname, metadata, todo[i], output)
+			else:
+				output.keep(fname, metadata)
+		return
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		# save modified metadata, force = True is a must
+		with self.open_metadata_output(args, force = True) as output:
+			if args.by_album:
+				self._sort_by_album(args, output)
+			else:
+				self._sort_by_list(args, output)
 		return
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import os
+# custom lib
+from . import subprog
+from .metadata import Metadata
+from .split_by_cue import SubprogSplitByCue
+
+
+@subprog.SubprogReg.new_subprog("split_by_chapter",
+	help = "split chaptered audio files (e.g. audiobooks) on a list into "
+		"per-chapter files",
+	desc = "split chaptered audio files (e.g. audiobooks) on a list into "
+		"per-chapter files by stream copy, chapters are read from the "
+		".metadata files (see dump_metadata); output files are named as in "
+		"split_by_cue, each with a .metadata file; 'ffmpeg' must be available")
+class SubprogSplitByChapter(subprog.SubprogWithLogBase,
+		subprog.ListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("ffmpeg")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		return ap
+
+	def _chapter_metadata(self, metadata, i) -> Metadata:
+		"""
+		metadata of a split chapter: global tags of the source, with the source
+		title as album, the chapter title as title and chapter # as track
+		"""
+		chapter = metadata.chapters[i]
+		new = Metadata(metadata)
+		if ("album" not in new) and ("title" in metadata):
+			new["album"] = Metadata.get_valtype_by_tag("album")\
+				.from_ffmetadata(metadata["title"].to_ffmetadata())
+		new["title"] = Metadata.get_valtype_by_tag("title")\
+			.from_ffmetadata(chapter.title or ("Chapter %d" % (i + 1)))
+		new["track"] = Metadata.get_valtype_by_tag("track")\
+			.from_ffmetadata(str(i + 1))
+		for k, v in chapter.tags:
+			k = k.lower()
+			new[k] = Metadata.get_valtype_by_tag(k, allow_default = True)\
+				.from_ffmetadata(v)
+		return new
+
+	def _iter_chapter_jobs(self, args):
+		for fname in self.read_list(args):
+			metadata = Metadata.read_ffmetadata(
+				Metadata.standard_ffmetadata(fname))
+			if not metadata.chapters:
+				self.log_err("skipping: %s (no chapters)\n" % fname)
+				continue
+			dirname = os.path.dirname(fname)
+			extension = os.path.splitext(fname)[1][1:]
+			performer = metadata["artist"].to_formatted()\
+				if "artist" in metadata else ""
+			for i in range(len(metadata.chapters)):
+				chapter_metadata = self._chapter_metadata(metadata, i)
+				output = os.path.join(dirname,
+					SubprogSplitByCue.format_split_fname(i + 1,
+						chapter_metadata["title"].to_formatted(), performer,
+						extension))
+				yield fname, metadata.chapters.get_seconds(i), output,\
+					chapter_metadata
+		return
+
+	def _split_chapter(self, args, job):
+		fname, (start, end), output, metadata = job
+		ffmetadata = Metadata.standard_ffmetadata(output)
+		if os.path.exists(ffmetadata) and (not args.force):
+			self.log_err("existing: %s\n" % ffmetadata)
+			self.progress.fail()
+			return 1
+		if args.verbose:
+			self.log_err("saving: %s\n" % ffmetadata)
+		# the sidecar is moved into place only along with a split output
+		temp = ffmetadata if args.dry_run\
+			else self.util.get_temp_fname(ffmetadata)
+		if not args.dry_run:
+			metadata.save_ffmetadata(temp)
+		cmd = [args.ffmpeg]
+		if args.force:
+			cmd.append("-y")
+		cmd.extend(["-ss", "%.6f" % start, "-to", "%.6f" % end,
+			"-i", self.util.fname_prevent_monkey_patch(fname),
+			"-i", self.util.fname_prevent_monkey_patch(temp),
+			"-map", "0:a", "-map_metadata", "1", "-map_chapters", "-1",
+			"-codec", "copy", self.util.fname_prevent_monkey_patch(output)])
+		ret = 1
+		try:
+			ret = self.logged_external_call(cmd, dry_run = args.dry_run,
+				verbose = args.verbose)
+		finally:
+			if not args.dry_run:
+				if ret:
+					os.remove(temp)
+				else:
+					os.replace(temp, ffmetadata)
+		return ret
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		for _ in self.iter_parallel(lambda job: self._split_chapter(args, job),
+				self._iter_chapter_jobs(args), jobs = args.jobs):
+			pass
+		return
@@ -1,34 +1,154 @@
 #!/usr/bin/env python3
 
+import collections
+import json
 import os
+import re
+import struct
+import subprocess
 # custom lib
 from . import subprog
 from .metadata import Metadata
+from .scheduler import DeviceJobs
+
+
+class CueSheet(object):
+	"""
+	tracks of a single-file cue sheet; track starts are the INDEX 01 times
+	in cd frames (1/75 s), the same split points as shnsplit
+	"""
+	FRAMES_PER_SEC = 75
+	Track = collections.namedtuple("Track",
+		["num", "title", "performer", "start"])
+
+	_LINE_REGEX = re.compile(r"^\s*(\w+)\s+(.*?)\s*$")
+	_TIME_REGEX = re.compile(r"^(\d+):(\d+):(\d+)$")
+
+	def __init__(self, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.title = None
+		self.performer = None
+		self.tracks = list()
+		return
+
+	@staticmethod
+	def _unquote(s):
+		return s[1:-1] if (len(s) >= 2) and s.startswith("\"")\
+			and s.endswith("\"") else s
+
+	@classmethod
+	def from_file(cls, fname, encoding = "utf-8"):
+		new = cls()
+		track, n_files = None, 0
+		with open(fname, "r", encoding = encoding) as fp:
+			for line in fp:
+				m = cls._LINE_REGEX.match(line.lstrip("\ufeff"))
+				if not m:
+					continue
+				key, value = m.group(1).upper(), m.group(2)
+				if key == "FILE":
+					n_files += 1
+					# later tracks' times would be relative to another file
+					if n_files > 1:
+						raise ValueError("cue sheet '%s' refers to multiple "
+							"files, not supported" % fname)
+				elif key == "TRACK":
+					track = dict(num = int(value.split()[0]), title = None,
+						performer = new.performer, start = None)
+					new.tracks.append(track)
+				elif key in ("TITLE", "PERFORMER"):
+					(track if track is not None else new.__dict__)\
+						[key.lower()] = cls._unquote(value)
+				elif (key == "INDEX") and (track is not None):
+					num, _, time = value.partition(" ")
+					t = cls._TIME_REGEX.match(time.strip())
+					if (int(num) == 1) and t:
+						mm, ss, ff = map(int, t.groups())
+						track["start"] = (mm * 60 + ss) * cls.FRAMES_PER_SEC\
+							+ ff
+		tracks = [cls.Track(**t) for t in new.tracks]
+		if any(t.start is None for t in tracks):
+			raise ValueError("cue sheet '%s' has tracks without INDEX 01"\
+				% fname)
+		new.tracks = tracks
+		return new
+
+	def get_byte_offsets(self, rate, frame_bytes) -> list:
+		"""
+		byte offsets of track starts in pcm of <rate> frames per second, each
+		of <frame_bytes> (channels * bytes per sample)
+		"""
+		return [t.start * rate // self.FRAMES_PER_SEC * frame_bytes\
+			for t in self.tracks]
 
 
 @subprog.SubprogReg.new_subprog("split_by_cue",
 	help = "split single-piece audio files by cue, 'shnsplit' must be present",
 	desc = "split single-piece audio files by cue, 'shnsplit' must be present")
 class SubprogSplitByCue(subprog.SubprogWithLogBase):
+	# shnsplit output file name format
+	SPLIT_FNAME_FORMAT = "%n. %t - %p"
+
+	@classmethod
+	def format_split_fname(cls, num: int, title: str, performer: str,
+			extension: str) -> str:
+		"""
+		make a split output file name the way shnsplit does with
+		SPLIT_FNAME_FORMAT, used by other splitting subprograms
+		"""
+		fields = {"%n": "%02d" % num, "%t": title, "%p": performer}
+		fname = re.sub("%[ntp]", lambda m: fields[m.group()],
+			cls.SPLIT_FNAME_FORMAT)
+		return cls.util.append_filename_extension(
+			cls.util.fname_replace_win_special_chars(fname), extension)
+
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_device_jobs
 	@subprog.SubprogBase.append_opt_program("ffmpeg",
 		help_extra = ", required for transcoding")
+	@subprog.SubprogBase.append_opt_program("ffprobe",
+		help_extra = ", required with --stream")
 	@subprog.SubprogBase.append_opt_program("shnsplit")
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("-i", "--input", type = str, required = True,
-			metavar = "file",
-			help = "input audio file in single-piece (required)")
+			action = "append", metavar = "file",
+			help = "input audio file in single-piece; can be given multiple "
+				"times together with -c/--cue, in which case tracks are split "
+				"into the directory of each input (required)")
 		ap.add_argument("-c", "--cue", type = str, required = True,
-			metavar = "file",
-			help = "input cue file (required)")
+			action = "append", metavar = "file",
+			help = "input cue file, one for each -i/--input in the same order "
+				"(required)")
 		ap.add_argument("-R", "--transcode", type = str, metavar = "format",
 			help = "output audio file format; note using some format may cause "
 				"problems (default: do not transcode)")
+		ap.add_argument("--stream", action = "store_true",
+			help = "decode each input once with ffmpeg and pipe the pcm into "
+				"per-track ffmpeg encoders, cut at the cue track starts, "
+				"without a temporary transcoded image and without shnsplit; "
+				"pcm is 16, 24 or 32-bit as probed from the input, output "
+				"format is -R/--transcode or flac; tracks are tagged with "
+				"title, artist, album and track from the cue sheet "
+				"(default: no)")
+		ap.add_argument("--cue-encoding", type = str, default = "utf-8",
+			metavar = "encoding",
+			help = "encoding of cue files, with --stream (default: utf-8)")
 		return ap
 
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		if len(args.input) != len(args.cue):
+			raise self.ArgsError("-i/--input and -c/--cue must be given the "
+				"same times")
+		# transcoding is cpu-bound, -j/--jobs is not capped by hdd defaults
+		if (args.device_jobs is None) and (args.transcode or args.stream):
+			args.device_jobs = DeviceJobs()
+		return args
+
 	def _transcode(self, input, output_ext, *, ffmpeg = "ffmpeg", force = None,
 			dry_run = None, verbose = None) -> str:
 		bn, ext = os.path.splitext(input)
@@ -49,26 +169,212 @@ class SubprogSplitByCue(subprog.SubprogWithLogBase):
 		return ret
 
 	def _split_by_cue(self, input, cue, *, shnsplit = "shnsplit", force = None,
-			dry_run = None, verbose = None):
+			output_dir = None, dry_run = None, verbose = None):
 		cmd = [shnsplit]
 		if force:
 			cmd.extend(["-O", "always"])
-		cmd.extend(["-t", "%n. %t - %p", "-f",
+		if output_dir is not None:
+			cmd.extend(["-d", self.util.fname_prevent_monkey_patch(
+				output_dir or os.path.curdir)])
+		cmd.extend(["-t", self.SPLIT_FNAME_FORMAT, "-f",
 			self.util.fname_prevent_monkey_patch(cue), "-o",
 			(os.path.splitext(input)[1]).lstrip(os.path.extsep),
 			self.util.fname_prevent_monkey_patch(input)])
 		self.logged_external_call(cmd, dry_run = dry_run, verbose = verbose)
 		return
 
-	@subprog.SubprogWithLogBase.with_log()
-	def subprog_main(self, args):
-		split_input = self._transcode(args.input, args.transcode,
+	def _transcode_and_split(self, args, job):
+		input, cue, output_dir = job
+		split_input = self._transcode(input, args.transcode,
 			ffmpeg = args.ffmpeg, force = args.force, dry_run = args.dry_run,
 			verbose = args.verbose)
-		self._split_by_cue(split_input, args.cue, shnsplit = args.shnsplit,
-			force = args.force, dry_run = args.dry_run, verbose = args.verbose)
+		self._split_by_cue(split_input, cue, shnsplit = args.shnsplit,
+			force = args.force, output_dir = output_dir,
+			dry_run = args.dry_run, verbose = args.verbose)
 		# clean temp transcode file
 		if (not args.dry_run)\
-			and (not self.util.samefile(args.input, split_input)):
+			and (not self.util.samefile(input, split_input)):
 			os.remove(split_input)
 		return
+
+	# pcm passed from the decoder to the encoders
+	STREAM_CHUNK_SIZE = 1 << 20
+
+	@staticmethod
+	def _get_pcm_bits(stream: dict) -> int:
+		"""
+		bits per sample of the pcm to decode an audio stream into, from its
+		ffprobe entries; lossy and float streams have no raw sample size and
+		are decoded into 24-bit
+		"""
+		bits = int(stream.get("bits_per_raw_sample") or 0)\
+			or int(stream.get("bits_per_sample") or 0)
+		if not bits:
+			bits = dict(u8 = 8, s16 = 16, s32 = 32).get(
+				stream.get("sample_fmt", "").rstrip("p"), 24)
+		for ret in (16, 24):
+			if bits <= ret:
+				return ret
+		return 32
+
+	def _probe_pcm_bits(self, args, input) -> int:
+		"""
+		bits of the pcm to decode input into, None if probing failed
+		"""
+		cmd = [args.ffprobe, "-v", "error", "-select_streams", "a:0",
+			"-show_entries", "stream=sample_fmt,bits_per_sample,"
+			"bits_per_raw_sample", "-of", "json",
+			self.util.fname_prevent_monkey_patch(input)]
+		out = self.logged_external_output(cmd, verbose = args.verbose)
+		if out is None:
+			return None
+		streams = json.loads(out).get("streams")
+		if not streams:
+			raise ValueError("no audio stream in '%s'" % input)
+		return self._get_pcm_bits(streams[0])
+
+	@staticmethod
+	def _read_wav_header(fp) -> (int, int, int):
+		"""
+		read a streamed wav header up to the data chunk, returns (sample rate,
+		channels, bits per sample)
+		"""
+		riff = fp.read(12)
+		if (riff[:4] != b"RIFF") or (riff[8:12] != b"WAVE"):
+			raise ValueError("decoder output is not wav")
+		fmt = None
+		while True:
+			head = fp.read(8)
+			if len(head) < 8:
+				raise ValueError("decoder output has no wav data chunk")
+			cid, size = head[:4], struct.unpack("<I", head[4:])[0]
+			if cid == b"data":
+				break
+			body = fp.read(size + size % 2)
+			if cid == b"fmt ":
+				_, channels, rate, _, _, bits = struct.unpack("<HHIIHH",
+					body[:16])
+				fmt = (rate, channels, bits)
+		if fmt is None:
+			raise ValueError("decoder output has no wav fmt chunk")
+		return fmt
+
+	def _get_encode_cmd(self, args, track, cue, fmt, output) -> list:
+		"""
+		fmt is (rate, channels, bits) of the pcm, None if not known yet (in
+		dry run)
+		"""
+		rate, channels, bits = ("<probed>",) * 3 if fmt is None else fmt
+		cmd = [args.ffmpeg, "-y" if args.force else "-n", "-f", "s%sle" % bits,
+			"-ar", str(rate), "-ac", str(channels), "-i", "-"]
+		tags = [("title", track.title), ("artist", track.performer),
+			("album", cue.title), ("track", str(track.num))]
+		for k, v in tags:
+			if v:
+				cmd.extend(["-metadata", k + Metadata.TAG_SEP + v])
+		cmd.append(self.util.fname_prevent_monkey_patch(output))
+		return cmd
+
+	def _stream_split(self, args, job):
+		"""
+		decode input once and encode each track from the pcm stream; a bad
+		cue sheet or decoder output fails only this job
+		"""
+		try:
+			self._stream_split_job(args, job)
+		except ValueError as e:
+			self.log_err("[BadCue]: %s: %s\n" % (job[0], e))
+			self.progress.fail()
+		return
+
+	def _stream_split_job(self, args, job):
+		input, cue_file, output_dir = job
+		cue = CueSheet.from_file(cue_file, encoding = args.cue_encoding)
+		extension = args.transcode or "flac"
+		outputs = [os.path.join(output_dir or "",
+			self.format_split_fname(t.num, t.title or "", t.performer or "",
+			extension)) for t in cue.tracks]
+		# the pcm format is only known after probing, not in dry run
+		bits = None
+		if not args.dry_run:
+			bits = self._probe_pcm_bits(args, input)
+			if bits is None:
+				return
+		decode_cmd = [args.ffmpeg, "-nostdin", "-v", "error",
+			"-i", self.util.fname_prevent_monkey_patch(input), "-map", "0:a:0",
+			"-f", "wav", "-c:a", "pcm_s%sle" % (bits or "<probed>"), "-"]
+		if args.verbose:
+			self.log_err("calling: %s\n" % self.util.get_cmd_str(decode_cmd))
+		if args.dry_run:
+			for track, output in zip(cue.tracks, outputs):
+				self.log_err("calling: %s\n" % self.util.get_cmd_str(
+					self._get_encode_cmd(args, track, cue, None, output)))
+			return
+		with subprocess.Popen(decode_cmd, stdout = subprocess.PIPE,
+				stderr = self.log.err_file) as decoder:
+			fmt = self._read_wav_header(decoder.stdout)
+			rate, channels, bits = fmt
+			# byte offsets of track starts, and the end of stream
+			starts = cue.get_byte_offsets(rate, channels * bits // 8)\
+				+ [None]
+			pos = 0
+			for i, (track, output) in enumerate(zip(cue.tracks, outputs)):
+				end = starts[i + 1]
+				encoder, broken = None, False
+				if self.util.lexists(output) and (not args.force):
+					self.log_err("existing: %s\n" % output)
+				else:
+					cmd = self._get_encode_cmd(args, track, cue, fmt, output)
+					if args.verbose:
+						self.log_err("calling: %s\n"\
+							% self.util.get_cmd_str(cmd))
+					encoder = subprocess.Popen(cmd, stdin = subprocess.PIPE,
+						stdout = self.log.out_file, stderr = self.log.err_file)
+				# audio before the first track (pregap) is not written
+				skip = starts[0] if i == 0 else 0
+				while (end is None) or (pos < end):
+					n = self.STREAM_CHUNK_SIZE if end is None\
+						else min(self.STREAM_CHUNK_SIZE, end - pos)
+					pcm = decoder.stdout.read(n)
+					if not pcm:
+						break
+					pos += len(pcm)
+					if skip:
+						drop = min(skip, len(pcm))
+						pcm, skip = pcm[drop:], skip - drop
+					if (encoder is not None) and (not broken):
+						try:
+							encoder.stdin.write(pcm)
+						except OSError:
+							# encoder exited early, keep reading to the next
+							# track start
+							broken = True
+				if encoder is not None:
+					try:
+						encoder.stdin.close()
+					except OSError:
+						broken = True
+					if encoder.wait() or broken:
+						self.log_err("[NonZeroReturn]: %s\n"\
+							% self.util.get_cmd_str(cmd))
+						self.progress.fail()
+			# drain the stream after the last track, if any is left
+			decoder.stdout.read()
+		if decoder.returncode:
+			self.log_err("[NonZeroReturn]: %s\n"\
+				% self.util.get_cmd_str(decode_cmd))
+			self.progress.fail()
+		return
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		# a single input keeps splitting into the current directory
+		multi = len(args.input) > 1
+		jobs = [(i, c, os.path.dirname(i) if multi else None)\
+			for i, c in zip(args.input, args.cue)]
+		func = self._stream_split if args.stream else self._transcode_and_split
+		for _ in self.iter_parallel(lambda job: func(args, job), jobs,
+				jobs = args.jobs, path_of = lambda job: job[0],
+				device_jobs = args.device_jobs):
+			pass
+		return
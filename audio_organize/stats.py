@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import array
+import collections
+import csv
+import json
+import os
+import sys
+# custom lib
+from . import subprog
+from .cache import FileResultCache
+
+
+class LibraryStats(object):
+	"""
+	columnar table of list entries: file size, duration and codec columns in
+	arrays, and one column per tag (None where missing); group-bys map each
+	distinct value to a group id once, and sum into per-group arrays in a
+	single pass over a column; multi-valued tags (e.g. artist) count into
+	the group of each of their values
+	"""
+	Aggregate = collections.namedtuple("Aggregate",
+		["files", "duration", "bytes"])
+	UNKNOWN = "unknown"
+
+	def __init__(self, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.fnames = list()
+		self.sizes = array.array("q")
+		self.durations = array.array("d")
+		self.codecs = list()
+		# tag -> [value or None, ...]
+		self.columns = dict()
+		return
+
+	def __len__(self):
+		return len(self.fnames)
+
+	def add(self, fname, metadata, size = 0, duration = 0.0, codec = None):
+		row = len(self.fnames)
+		self.fnames.append(fname)
+		self.sizes.append(size)
+		self.durations.append(duration)
+		self.codecs.append(codec or self.UNKNOWN)
+		for tag, value in metadata.items():
+			if tag not in self.columns:
+				self.columns[tag] = [None] * row
+			self.columns[tag].append(value.value)
+		for column in self.columns.values():
+			if len(column) == row:
+				column.append(None)
+		return row
+
+	def get_column(self, tag) -> list:
+		return self.codecs if tag == "codec"\
+			else self.columns.get(tag, [None] * len(self))
+
+	def total(self) -> Aggregate:
+		return self.Aggregate(len(self), sum(self.durations), sum(self.sizes))
+
+	def group_by(self, tag) -> dict:
+		"""
+		{value: Aggregate} of files with the tag, by decreasing file count
+		"""
+		ids = dict()
+		files, durations, sizes = array.array("q"), array.array("d"),\
+			array.array("q")
+		for row, value in enumerate(self.get_column(tag)):
+			if value is None:
+				continue
+			for v in (value if isinstance(value, list) else [value]):
+				i = ids.setdefault(str(v), len(ids))
+				if i == len(files):
+					files.append(0)
+					durations.append(0.0)
+					sizes.append(0)
+				files[i] += 1
+				durations[i] += self.durations[row]
+				sizes[i] += self.sizes[row]
+		return {k: self.Aggregate(files[i], durations[i], sizes[i])\
+			for k, i in sorted(ids.items(), key = lambda i: (-files[i[1]],
+			i[0]))}
+
+	def missing(self, tag) -> list:
+		"""
+		files without the tag
+		"""
+		return [f for f, v in zip(self.fnames, self.get_column(tag))\
+			if v is None]
+
+
+@subprog.SubprogReg.new_subprog("stats",
+	help = "report library statistics of files on a list",
+	desc = "report statistics of audio files on a list: file counts, total "
+		"duration and bytes per tag value (e.g. album, artist, genre, year) "
+		"and per codec, and files missing required tags, as json or csv; "
+		"sidecar tags and 'ffprobe' results are cached per file, so that a "
+		"re-run only reads files changed since the last run")
+class SubprogStats(subprog.SubprogWithLogBase,
+		subprog.MetadataListBasedSubprogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("ffprobe")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("-o", "--output", type = str, default = "-",
+			metavar = "file",
+			help = "write the report into this file, '-' for stdout "
+				"(default: -)")
+		ap.add_argument("-g", "--format", type = str, default = "json",
+			choices = ["json", "csv"],
+			help = "report format; csv has one row per report, key columns "
+				"and files, duration, bytes (default: json)")
+		ap.add_argument("-t", "--group-by", type = str,
+			default = "album,artist,genre,year", metavar = "tag[,tag ...]",
+			help = "comma-separated tags to count files, duration and bytes "
+				"by (default: album,artist,genre,year)")
+		ap.add_argument("--require", type = str,
+			default = "title,artist,album,track", metavar = "tag[,tag ...]",
+			help = "comma-separated tags to report missing, '' for none "
+				"(default: title,artist,album,track)")
+		ap.add_argument("--no-probe", action = "store_true",
+			help = "do not call 'ffprobe'; duration is not reported and the "
+				"codec is the file extension (default: no)")
+		ap.add_argument("--cache", type = str, default = ".stats_cache.jsonl",
+			metavar = "file",
+			help = "cache file of sidecar tags and probed duration and codec, "
+				"'' to disable; sidecar tags are not cached with "
+				"-M/--manifest (default: .stats_cache.jsonl)")
+		return ap
+
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		if args.output == "-":
+			args.output = sys.stdout
+		args.group_by = [t for t in args.group_by.split(",") if t]
+		args.require = [t for t in args.require.split(",") if t]
+		return args
+
+	def _probe(self, args, cache, fname):
+		"""
+		returns (size, duration, codec) of an audio file, None if missing;
+		duration is 0.0 and codec None if unknown
+		"""
+		try:
+			size = os.path.getsize(fname)
+		except OSError:
+			return None
+		if args.no_probe:
+			return size, 0.0, os.path.splitext(fname)[1][1:].lower() or None
+		info = cache.get_result(fname)
+		if info is None:
+			cmd = [args.ffprobe, "-v", "error", "-select_streams", "a:0",
+				"-show_entries", "stream=codec_name:format=duration",
+				"-of", "json", self.util.fname_prevent_monkey_patch(fname)]
+			out = self.logged_external_output(cmd, verbose = args.verbose)
+			if out is None:
+				return size, 0.0, None
+			probed = json.loads(out)
+			streams = probed.get("streams") or [dict()]
+			info = dict(codec = streams[0].get("codec_name"), duration\
+				= float(probed.get("format", dict()).get("duration") or 0))
+			cache.set_result(fname, info)
+		return size, info["duration"], info["codec"]
+
+	@staticmethod
+	def _aggregate_dict(agg) -> dict:
+		return dict(files = agg.files, duration = round(agg.duration, 3),
+			bytes = agg.bytes)
+
+	def _write_json(self, fp, args, stats):
+		report = dict(total = self._aggregate_dict(stats.total()))
+		for tag in ["codec"] + args.group_by:
+			report[tag] = {k: self._aggregate_dict(v)\
+				for k, v in stats.group_by(tag).items()}
+		report["missing"] = {t: stats.missing(t) for t in args.require}
+		json.dump(report, fp, ensure_ascii = False, indent = "\t")
+		fp.write("\n")
+		return
+
+	def _write_csv(self, fp, args, stats):
+		writer = csv.writer(fp, lineterminator = "\n")
+		writer.writerow(["report", "key", "files", "duration", "bytes"])
+		rows = [("total", "", stats.total())]
+		for tag in ["codec"] + args.group_by:
+			rows.extend((tag, k, v) for k, v in stats.group_by(tag).items())
+		for tag, k, v in rows:
+			writer.writerow([tag, k, v.files, round(v.duration, 3), v.bytes])
+		for tag in args.require:
+			writer.writerow(["missing", tag, len(stats.missing(tag)), "", ""])
+		return
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		cache = FileResultCache.load(args.cache)
+		items = self.iter_list_metadata(args, required = False)\
+			if args.manifest else self.iter_cached_list_metadata(args, cache)
+		stats = LibraryStats()
+		for (fname, metadata), probed in self.iter_parallel(
+				lambda item: (item, self._probe(args, cache, item[0])),
+				items, jobs = args.jobs):
+			if probed is None:
+				self.log_err("[Missing]: %s\n" % fname)
+				self.progress.fail()
+				continue
+			if (probed[2] is None) and (not args.no_probe):
+				self.log_err("[NoProbe]: %s\n" % fname)
+			stats.add(fname, metadata, *probed)
+		cache.save()
+		fp = self.util.get_fp(args.output, "w", encoding = "utf-8")
+		if args.format == "json":
+			self._write_json(fp, args, stats)
+		else:
+			self._write_csv(fp, args, stats)
+		if fp is sys.stdout:
+			fp.flush()
+		else:
+			fp.close()
+		if args.verbose:
+			self.log_err("stats: %d files\n" % len(stats))
+		return
@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 
-import os
 import re
-import shutil
 # custom lib
 from . import subprog
 
@@ -14,6 +12,8 @@ class SubprogStripCv(subprog.SubprogWithLogBase):
 	@subprog.SubprogBase.append_opt_verbose
 	@subprog.SubprogBase.append_opt_dryrun
 	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_journal
 	def create_argparser(self, subparsers, *ka, **kw):
 		ap = super().create_argparser(subparsers, *ka, **kw)
 		ap.add_argument("files", type = str, nargs = "+",
@@ -26,25 +26,17 @@ class SubprogStripCv(subprog.SubprogWithLogBase):
 				% def_pattern)
 		return ap
 
-	def _strip_cv(self, fname, pattern, *, force = None, dry_run = None,
-			verbose = None):
-		new_fname = re.sub(pattern, "", fname)
-		if fname == new_fname:
-			if verbose:
-				self.log_err("skipping: %s\n" % new_fname)
-		else:
-			if verbose:
-				self.log_err("renaming: %s -> %s\n" % (fname, new_fname))
-			if not dry_run:
-				if (not os.path.exists(new_fname)) or force:
-					shutil.move(fname, new_fname)
-				else:
-					self.log_err("existing: %s\n" % new_fname)
-		return
-
-	@subprog.SubprogWithLogBase.with_log()
+	@subprog.SubprogWithLogBase.with_log(fs_cache = True)
 	def subprog_main(self, args):
+		pattern = re.compile(args.pattern)
+		pairs = list()
 		for fname in args.files:
-			self._strip_cv(fname, args.pattern, force = args.force,
-				dry_run = args.dry_run, verbose = args.verbose)
+			new_fname = pattern.sub("", fname)
+			if fname == new_fname:
+				if args.verbose:
+					self.log_err("skipping: %s\n" % new_fname)
+			else:
+				pairs.append((fname, new_fname))
+		self.logged_batch_rename(pairs, force = args.force,
+			dry_run = args.dry_run, verbose = args.verbose, jobs = args.jobs)
 		return
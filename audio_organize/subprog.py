@@ -2,6 +2,8 @@
 
 import abc
 import argparse
+import collections
+import concurrent.futures
 import functools
 import io
 import os
@@ -10,24 +12,61 @@ import subprocess
 import time
 # custom lib
 from . import util
+from .manifest import MetadataManifest, SidecarMetadataOutput,\
+	NullMetadataOutput
+from .journal import Journal, NullJournal
+from .metadata import Metadata
+from .progress import Progress
+from .rename_plan import RenamePlan
+from .scheduler import DeviceJobs, DeviceScheduler
+
+
+# per-file outcome of a run, see SubprogBase.add_result()
+FileResult = collections.namedtuple("FileResult",
+	["file", "ok", "output", "error"])
 
 
 @util.StaticUtilityMethods.decorate
 class SubprogBase(abc.ABC):
+	# set by SubprogWithLogBase.with_log() during a run
+	progress = None
+	journal = NullJournal()
+	fs_cache = None
+	# list to collect FileResult's into, set by api callers
+	results = None
+
+	class ArgsError(ValueError):
+		"""
+		invalid arguments found by refine_args(), reported as a usage error on
+		the command line
+		"""
+		pass
+
 	@abc.abstractmethod
 	def subprog_main(self, args, *ka, **kw) -> None:
 		pass
 
 	def create_argparser(self, subparsers, *ka, **kw)\
 			-> argparse.ArgumentParser:
-		return subparsers.add_parser(self.subprog_name, *ka,
+		# kept to report ArgsError of refine_args()
+		self.argparser = subparsers.add_parser(self.subprog_name, *ka,
 			help = self.subprog_help, description = self.subprog_desc, **kw)
+		return self.argparser
 
 	def refine_args(self, args) -> argparse.Namespace:
 		if getattr(args, "dry_run", None):
 			args.verbose = True
 		return args
 
+	def add_result(self, fname, ok: bool, *, output = None, error = None):
+		"""
+		record the outcome of a file if results are collected; may be called
+		from worker threads
+		"""
+		if self.results is not None:
+			self.results.append(FileResult(fname, ok, output, error))
+		return
+
 	def append_opt(*arg_ka, **arg_kw):
 		def decorator(func):
 			@functools.wraps(func)
@@ -70,9 +109,85 @@ class SubprogBase(abc.ABC):
 			help = "increase output verbosity (default: no)")
 		return deco(func)
 
+	def append_opt_jobs(func):
+		deco = SubprogBase.append_opt("-j", "--jobs", type = util.PosInt,
+			default = 1, metavar = "int",
+			help = "number of parallel jobs (default: 1)")
+		return deco(func)
+
+	def append_opt_journal(func):
+		deco = SubprogBase.append_opt("--journal", type = str,
+			default = None, metavar = "file",
+			help = "append moved, copied and created files to this journal, "
+				"so that they can be reverted by subprogram 'undo'; files "
+				"overwritten with -f/--force are moved aside to "
+				"'<name>.<random>.bak' backups, which are kept until the run "
+				"is reverted (default: no)")
+		return deco(func)
+
+	def append_opt_device_jobs(func):
+		deco = SubprogBase.append_opt("--device-jobs", type = DeviceJobs,
+			default = None, metavar = "kind=int[,...]",
+			help = "with -j/--jobs, limit parallel jobs per physical device "
+				"of the input files, by device kind (hdd, ssd, network, "
+				"other); unset kinds are limited by -j/--jobs only; '' for no "
+				"limits (default: %s, or no limits when transcoding)"\
+				% DeviceJobs.DEFAULT)
+		return deco(func)
+
 	def external_call(self, cmd, *ka, **kw):
 		return subprocess.call(cmd, *ka, **kw)
 
+	def iter_parallel(self, func, iterable, *, jobs = 1, path_of = None,
+			device_jobs = None):
+		"""
+		call func(item) for each item with up to <jobs> threads, yield results
+		in input order; at most 2 * <jobs> items are pending at a time, so that
+		long (lazy) iterables are not materialized
+
+		if path_of is set, path_of(item) is the file an item reads from, and
+		jobs are also limited per device of those files (see DeviceScheduler)
+
+		finished items (and bytes of their files) are counted into progress
+		"""
+		progress = self.progress
+		if (progress is None) or (not progress.enabled):
+			yield from self._iter_parallel(func, iterable, jobs = jobs,
+				path_of = path_of, device_jobs = device_jobs)
+			return
+		if hasattr(iterable, "__len__"):
+			progress.set_total(len(iterable))
+		# file size is taken before func(), which may move the file
+		sized = func if path_of is None else lambda item:\
+			(progress.get_file_size(path_of(item)), func(item))
+		for ret in self._iter_parallel(sized, iterable, jobs = jobs,
+				path_of = path_of, device_jobs = device_jobs):
+			if path_of is None:
+				progress.update()
+			else:
+				nbytes, ret = ret
+				progress.update(nbytes = nbytes)
+			yield ret
+		return
+
+	def _iter_parallel(self, func, iterable, *, jobs, path_of, device_jobs):
+		if jobs <= 1:
+			yield from map(func, iterable)
+			return
+		if path_of is not None:
+			yield from DeviceScheduler(jobs, device_jobs).iter_run(func,
+				iterable, path_of = path_of)
+			return
+		with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+			pending = collections.deque()
+			for item in iterable:
+				pending.append(executor.submit(func, item))
+				if len(pending) >= 2 * jobs:
+					yield pending.popleft().result()
+			while pending:
+				yield pending.popleft().result()
+		return
+
 
 class ListBasedSubprogBase(SubprogBase):
 	@functools.wraps(SubprogBase.create_argparser)
@@ -99,6 +214,96 @@ class ListBasedSubprogBase(SubprogBase):
 		return ret
 
 
+class MetadataListBasedSubprogBase(ListBasedSubprogBase):
+	"""
+	list-based subprogram whose metadata are stored either in per-file
+	ffmetadata sidecars (default) or in a single manifest (-M/--manifest)
+	"""
+	@functools.wraps(ListBasedSubprogBase.create_argparser)
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("-M", "--manifest", type = str, default = None,
+			metavar = "file",
+			help = "read/write metadata from/to this single manifest file "
+				"instead of per-file .metadata sidecars; if the manifest "
+				"exists, its rows are used instead of the list (default: no)")
+		ap.add_argument("--manifest-format", type = str, default = None,
+			choices = MetadataManifest.FORMATS,
+			help = "manifest file format (default: by manifest extension, "
+				"fallback to tsv)")
+		ap.add_argument("--fsync", type = str, default = "none",
+			choices = util.FsyncPolicy.MODES,
+			help = "flush written metadata to disk: 'each' file before it "
+				"replaces the old one, or in 'batch'es (default: none)")
+		return ap
+
+	def get_manifest(self, args) -> MetadataManifest:
+		return MetadataManifest(args.manifest, format = args.manifest_format,
+			encoding = args.list_encoding)
+
+	def iter_list_metadata(self, args, *, required = True):
+		"""
+		yield (audio file name, metadata) pairs of all list entries; if not
+		required, missing sidecars/manifest are treated as empty metadata
+		"""
+		if args.manifest:
+			manifest = self.get_manifest(args)
+			if required or manifest.exists():
+				yield from manifest.iter_items()
+				return
+		fnames = self.read_list(args)
+		if self.progress is not None:
+			self.progress.set_total(len(fnames))
+		sidecars = Metadata.iter_read_ffmetadata(
+			map(Metadata.standard_ffmetadata, fnames),
+			missing_ok = not required)
+		for fname, metadata in zip(fnames, sidecars):
+			yield fname, (Metadata() if metadata is None else metadata)
+		return
+
+	def iter_cached_list_metadata(self, args, cache):
+		"""
+		same as iter_list_metadata(required = False) from sidecars, but with
+		sidecar tags cached in <cache> (FileResultCache), only sidecars not in
+		or outdated in the cache are read; the cache is not saved
+		"""
+		fnames = self.read_list(args)
+		if self.progress is not None:
+			self.progress.set_total(len(fnames))
+		sidecars = [Metadata.standard_ffmetadata(f) for f in fnames]
+		cached = [cache.get_result(f) for f in sidecars]
+		# sidecars not in (or outdated in) the cache are loaded in bulk
+		loaded = Metadata.iter_read_ffmetadata((f for f, c in zip(sidecars,
+			cached) if c is None), missing_ok = True)
+		for fname, ffmetadata, tags in zip(fnames, sidecars, cached):
+			if tags is None:
+				metadata = next(loaded)
+				if metadata is None:
+					metadata = Metadata()
+				else:
+					cache.set_result(ffmetadata, {k: v.to_ffmetadata()\
+						for k, v in metadata.items()})
+			else:
+				metadata = Metadata({k: Metadata.get_valtype_by_tag(k,
+					allow_default = True).from_ffmetadata(v)\
+					for k, v in tags.items()})
+			yield fname, metadata
+		return
+
+	def open_metadata_output(self, args, *, force = None):
+		"""
+		open metadata output for saving (changed) and keeping (unchanged)
+		metadata, use as context manager
+		"""
+		if getattr(args, "dry_run", None):
+			return NullMetadataOutput()
+		fsync = util.FsyncPolicy(args.fsync)
+		if args.manifest:
+			return self.get_manifest(args).open_writer(force = force,
+				fsync = fsync)
+		return SidecarMetadataOutput(force = force, fsync = fsync)
+
+
 class SubprogWithLogBase(SubprogBase):
 	@util.StaticUtilityMethods.decorate
 	class LogFiles(object):
@@ -116,8 +321,12 @@ class SubprogWithLogBase(SubprogBase):
 			return self.err_file.write(s)
 
 		def close_all(self):
-			self.out_file.close()
-			self.err_file.close()
+			# the process' stdout/stderr stay open, e.g. for tracebacks
+			for fp in (self.out_file, self.err_file):
+				if fp in (sys.stdout, sys.stderr):
+					fp.flush()
+				else:
+					fp.close()
 			return
 
 	def create_argparser(self, subparsers, *ka, **kw):
@@ -131,6 +340,14 @@ class SubprogWithLogBase(SubprogBase):
 			metavar = "file",
 			help = "stream stderr into this file, '-' for stderr "
 				"(default: -)")
+		ap.add_argument("--progress", type = str, default = "auto",
+			choices = Progress.MODES,
+			help = "show done/failed files, bytes, rate and ETA on stderr; "
+				"'auto' shows it only if stderr is a terminal (default: auto)")
+		ap.add_argument("--status-file", type = str, default = None,
+			metavar = "file",
+			help = "periodically write progress as json into this file, for "
+				"monitoring (default: no)")
 		return ap
 
 	def refine_args(self, args):
@@ -141,7 +358,12 @@ class SubprogWithLogBase(SubprogBase):
 			args.err_file = sys.stderr
 		return args
 
-	def with_log(check_dry_run = True):
+	def with_log(check_dry_run = True, fs_cache = False):
+		"""
+		fs_cache: cache directory listings during the run, for subprograms
+		that move files; the cache is self.fs_cache, to be passed to util
+		filesystem methods; see util.FsStateCache
+		"""
 		def decorator(func):
 			@functools.wraps(func)
 			def wrapper(self, args, *ka, **kw):
@@ -150,14 +372,44 @@ class SubprogWithLogBase(SubprogBase):
 					out_file = args.log_file or ("%s.%s.log"\
 						% (args.subprog, time.strftime("%Y%m%d%H%M%S"))),
 					err_file = args.err_file)
-				# check dry run with text report
-				if check_dry_run and ("dry_run" in args) and args.dry_run:
-					self.log_err("[DryRunMode]: no outputs will be generated\n")
-				# run original func
-				ret = func(self, args, *kw, **kw)
-				# close log file handles
-				self.log.close_all()
-				return ret
+				self.progress, self.journal = None, NullJournal()
+				self.fs_cache = cache = util.FsStateCache() if fs_cache\
+					else None
+				try:
+					self.progress = Progress(name = args.subprog,
+						err_file = self.log.err_file, mode = args.progress,
+						status_file = args.status_file)
+					self.journal = Journal(args.journal, name = args.subprog,
+						cache = cache) if getattr(args, "journal", None)\
+						and (not getattr(args, "dry_run", None))\
+						else NullJournal(cache = cache)
+					if cache is not None:
+						self.progress.add_metric("fs_dirs_listed",
+							lambda: cache.n_listed)
+						self.progress.add_metric("fs_syscalls_saved",
+							lambda: cache.n_saved)
+					# check dry run with text report
+					if check_dry_run and ("dry_run" in args) and args.dry_run:
+						self.log_err("[DryRunMode]: no outputs will be "
+							"generated\n")
+					# run original func
+					return func(self, args, *ka, **kw)
+				finally:
+					# also on errors and interrupts: unclosed progress, journal
+					# and logs lose buffered output
+					try:
+						# also in the status file, as progress metrics
+						if (cache is not None)\
+								and getattr(args, "verbose", None):
+							self.log_err("[FsCache]: %d directories listed, "
+								"%d syscalls saved\n"\
+								% (cache.n_listed, cache.n_saved))
+						if self.progress is not None:
+							self.progress.close()
+						self.journal.close()
+					finally:
+						# close log file handles
+						self.log.close_all()
 			return wrapper
 		return decorator
 
@@ -165,6 +417,8 @@ class SubprogWithLogBase(SubprogBase):
 		return self.log.out(s)
 
 	def log_err(self, s):
+		if self.progress is not None:
+			self.progress.clear_line()
 		return self.log.err(s)
 
 	def logged_external_call(self, cmd, *ka, dry_run = None, verbose = None,
@@ -178,8 +432,63 @@ class SubprogWithLogBase(SubprogBase):
 			if not dry_run else 0
 		if ret:
 			self.log_err("[NonZeroReturn]: %s\n" % cmd_str)
+			if self.progress is not None:
+				self.progress.fail()
 		return ret
 
+	def logged_external_output(self, cmd, *ka, dry_run = None, verbose = None,
+			capture_stderr = False, **kw) -> str:
+		"""
+		same as logged_external_call, but captures and returns stdout (or
+		stderr if capture_stderr is set) as text; returns None if in dry run or
+		the call failed, captured stderr of a failed call is logged
+		"""
+		cmd_str = self.util.get_cmd_str(cmd)
+		if verbose:
+			self.log_err("calling: %s\n" % cmd_str)
+		if dry_run:
+			return None
+		if capture_stderr:
+			streams = dict(stdout = self.log.out_file, stderr = subprocess.PIPE)
+		else:
+			streams = dict(stdout = subprocess.PIPE, stderr = self.log.err_file)
+		proc = subprocess.run(cmd, *ka, encoding = "utf-8",
+			errors = "replace", **streams, **kw)
+		if proc.returncode:
+			if capture_stderr and proc.stderr:
+				self.log_err(proc.stderr if proc.stderr.endswith("\n")\
+					else proc.stderr + "\n")
+			self.log_err("[NonZeroReturn]: %s\n" % cmd_str)
+			if self.progress is not None:
+				self.progress.fail()
+			return None
+		return proc.stderr if capture_stderr else proc.stdout
+
+	def logged_batch_rename(self, pairs, *, force = None, dry_run = None,
+			verbose = None, jobs = 1) -> int:
+		"""
+		rename (src, dst) pairs as planned by RenamePlan, renames in each
+		stage are done in parallel; returns the number of renames
+		"""
+		plan = RenamePlan(pairs, force = force, cache = self.fs_cache)
+		for src, dst, reason in plan.skipped:
+			if reason == "existing":
+				self.log_err("existing: %s\n" % dst)
+			else:
+				self.log_err("skipping: %s -> %s (%s)\n" % (src, dst, reason))
+		def rename(pair):
+			if verbose:
+				self.log_err("renaming: %s -> %s\n" % pair)
+			if not dry_run:
+				self.journal.move(*pair)
+			return
+		if self.progress is not None:
+			self.progress.set_total(len(plan))
+		for stage in plan.stages:
+			for _ in self.iter_parallel(rename, stage, jobs = jobs):
+				pass
+		return len(plan)
+
 
 class SubprogReg(object):
 	"""
@@ -200,6 +509,12 @@ class SubprogReg(object):
 			return subprog_cls
 		return new_subprog_deco
 
+	@classmethod
+	def get_subprog_class(cls, name: str):
+		if name not in cls._SUBPROGS_:
+			raise ValueError("unknown subprogram '%s'" % name)
+		return cls._SUBPROGS_[name]
+
 	def __init__(self, *ka, **kw):
 		super().__init__(*ka, **kw)
 		self.subprog_dict = {k: v() for k, v in type(self)._SUBPROGS_.items()}
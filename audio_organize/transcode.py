@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import os
+import time
+# custom lib
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class TranscodePreset(object):
+	"""
+	named ffmpeg encoder settings; ffmpeg's audio encoders are single-threaded,
+	so that transcoding runs one job per core
+	"""
+	_PRESETS_ = dict()
+	# ogg containers have no attached picture streams, covers can not be
+	# stream-copied into them
+	NO_ATTACHED_PIC_EXTENSIONS = {"ogg", "oga", "opus", "spx"}
+
+	def __init__(self, name, extension, codec_opts: list, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.name = name
+		self.extension = extension
+		self.codec_opts = codec_opts
+		return
+
+	@classmethod
+	def add_preset(cls, name, extension, codec_opts):
+		cls._PRESETS_[name] = cls(name, extension, codec_opts)
+		return
+
+	@classmethod
+	def get_preset(cls, name):
+		"""
+		get preset by name; for names not registered (plain formats), return a
+		preset with ffmpeg default settings for that format
+		"""
+		if name in cls._PRESETS_:
+			return cls._PRESETS_[name]
+		return cls(name, name, list())
+
+	@classmethod
+	def iter_preset_names(cls):
+		return sorted(cls._PRESETS_.keys())
+
+	def get_ffmpeg_opts(self) -> list:
+		return list(self.codec_opts)
+
+	@staticmethod
+	def get_default_jobs() -> int:
+		"""
+		number of parallel jobs to fill all cores
+		"""
+		return os.cpu_count() or 1
+
+
+TranscodePreset.add_preset("flac", "flac",
+	["-c:a", "flac", "-compression_level", "5"])
+TranscodePreset.add_preset("flac-8", "flac",
+	["-c:a", "flac", "-compression_level", "8"])
+TranscodePreset.add_preset("alac", "m4a", ["-c:a", "alac"])
+TranscodePreset.add_preset("opus-96", "opus",
+	["-c:a", "libopus", "-b:a", "96k", "-vbr", "on"])
+TranscodePreset.add_preset("opus-128", "opus",
+	["-c:a", "libopus", "-b:a", "128k", "-vbr", "on"])
+TranscodePreset.add_preset("opus-192", "opus",
+	["-c:a", "libopus", "-b:a", "192k", "-vbr", "on"])
+TranscodePreset.add_preset("mp3-v0", "mp3",
+	["-c:a", "libmp3lame", "-q:a", "0"])
+TranscodePreset.add_preset("mp3-v2", "mp3",
+	["-c:a", "libmp3lame", "-q:a", "2"])
+TranscodePreset.add_preset("mp3-320", "mp3",
+	["-c:a", "libmp3lame", "-b:a", "320k"])
+TranscodePreset.add_preset("aac-256", "m4a",
+	["-c:a", "aac", "-b:a", "256k"])
+
+
+class ThroughputMeter(object):
+	"""
+	accumulate processed files and audio duration over a run
+	"""
+	def __init__(self, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.start_time = time.monotonic()
+		self.n_files = 0
+		self.n_failed = 0
+		self.audio_seconds = 0.0
+		return
+
+	def add(self, ok: bool, audio_seconds: float = 0.0):
+		if ok:
+			self.n_files += 1
+			self.audio_seconds += audio_seconds
+		else:
+			self.n_failed += 1
+		return
+
+	def summary(self) -> str:
+		elapsed = max(time.monotonic() - self.start_time, 1e-9)
+		return "%d files (%d failed), %.1f audio-s in %.1f s: %.2f files/s, "\
+			"%.1f audio-s/s" % (self.n_files, self.n_failed,
+			self.audio_seconds, elapsed, self.n_files / elapsed,
+			self.audio_seconds / elapsed)
+
+	@staticmethod
+	def parse_ffmpeg_progress(text: str) -> float:
+		"""
+		output audio duration in seconds from ffmpeg '-progress' output
+		"""
+		ret = 0.0
+		for line in (text or "").splitlines():
+			if line.startswith("out_time_us="):
+				try:
+					ret = int(line[len("out_time_us="):]) / 1e6
+				except ValueError:
+					pass
+		return ret
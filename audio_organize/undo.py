@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import os
+import time
+# custom lib
+from . import subprog
+from .journal import Journal
+
+
+@subprog.SubprogReg.new_subprog("undo",
+	help = "revert file moves, copies and creations recorded in a journal",
+	desc = "revert file moves, copies and creations recorded in the journal "
+		"by subprograms with --journal, latest run first; moved files are "
+		"moved back, copied and created files are removed, files they "
+		"overwrote are restored from their backups, and created directories "
+		"are removed if empty; files changed since the run (by inode) are "
+		"skipped; reverted runs are removed from the journal")
+class SubprogUndo(subprog.SubprogWithLogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_force
+	@subprog.SubprogBase.append_opt_jobs
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("journal", type = str,
+			help = "journal file, as given to --journal of the reverted runs")
+		ap.add_argument("-r", "--runs", type = int, default = 1,
+			metavar = "int",
+			help = "number of latest runs to revert, 0 for all "
+				"(default: 1)")
+		ap.add_argument("-l", "--list-runs", action = "store_true",
+			help = "only list runs in the journal (default: no)")
+		return ap
+
+	def _undo_record(self, args, run, record) -> bool:
+		op, src, dst, inode = record
+		src, dst = run.get_path(src), run.get_path(dst)
+		try:
+			st = os.stat(dst)
+		except FileNotFoundError:
+			self.log_err("missing: %s\n" % dst)
+			return False
+		if (inode is not None) and (st.st_ino != inode) and (not args.force):
+			self.log_err("skipping: %s (changed since the run)\n" % dst)
+			return False
+		if op in ("move", "backup"):
+			if self.util.lexists(src, cache = self.fs_cache)\
+					and (not args.force):
+				self.log_err("existing: %s\n" % src)
+				return False
+			if args.verbose:
+				self.log_err("%s: %s -> %s\n" % ("moving back" if op == "move"\
+					else "restoring", dst, src))
+			if not args.dry_run:
+				self.util.makedirs(os.path.dirname(src),
+					cache = self.fs_cache)
+				self.util.move(dst, src, cache = self.fs_cache)
+		else:
+			if args.verbose:
+				self.log_err("removing: %s\n" % dst)
+			if not args.dry_run:
+				self.util.remove(dst, cache = self.fs_cache)
+		return True
+
+	def _undo_mkdir(self, args, run, record) -> bool:
+		path = run.get_path(record[2])
+		if not os.path.isdir(path):
+			return True
+		if args.verbose:
+			self.log_err("removing directory: %s\n" % path)
+		if not args.dry_run:
+			try:
+				os.rmdir(path)
+			except OSError:
+				self.log_err("skipping: %s (directory not empty)\n" % path)
+				return False
+		return True
+
+	@staticmethod
+	def _iter_batches(run, records):
+		"""
+		split records (in revert order) into batches that touch disjoint
+		paths, so that records in a batch can be reverted in parallel
+		"""
+		batch, paths = list(), set()
+		for record in records:
+			touched = {run.get_path(p) for p in record[1:3] if p is not None}
+			if touched & paths:
+				yield batch
+				batch, paths = list(), set()
+			batch.append(record)
+			paths.update(touched)
+		if batch:
+			yield batch
+		return
+
+	def _undo_run(self, args, run) -> list:
+		"""
+		revert a run, returns records failed to revert in journal order
+		"""
+		records = run.records[::-1]
+		failed = list()
+		for batch in self._iter_batches(run,
+				[r for r in records if r[0] != "mkdir"]):
+			for record, ok in zip(batch, self.iter_parallel(
+					lambda r: self._undo_record(args, run, r), batch,
+					jobs = args.jobs)):
+				if not ok:
+					failed.append(record)
+		# directories are removed after files moved out, children first
+		for record in records:
+			if (record[0] == "mkdir")\
+					and (not self._undo_mkdir(args, run, record)):
+				failed.append(record)
+		return failed[::-1]
+
+	def _log_run(self, i, run):
+		self.log_err("run %d: %s at %s in %s, %d records\n" % (i,
+			run.header["subprog"], time.strftime("%Y-%m-%d %H:%M:%S",
+			time.localtime(run.header["time"])), run.header["cwd"],
+			len(run.records)))
+		return
+
+	@subprog.SubprogWithLogBase.with_log(fs_cache = True)
+	def subprog_main(self, args):
+		runs = Journal.read_runs(args.journal)
+		if args.list_runs:
+			for i, run in enumerate(runs):
+				self._log_run(i, run)
+			return
+		n_undo = len(runs) if args.runs <= 0 else min(args.runs, len(runs))
+		kept, undo = runs[:len(runs) - n_undo], runs[len(runs) - n_undo:]
+		self.progress.set_total(sum(r[0] != "mkdir" for run in undo\
+			for r in run.records))
+		remained = list()
+		for i, run in reversed(list(enumerate(undo, len(kept)))):
+			self._log_run(i, run)
+			failed = self._undo_run(args, run)
+			if failed:
+				self.log_err("failed: %d records of run %d are kept in the "
+					"journal\n" % (len(failed), i))
+				run.records = failed
+				remained.insert(0, run)
+		if not args.dry_run:
+			Journal.write_runs(args.journal, kept + remained)
+		return
@@ -2,6 +2,8 @@
 
 import io
 import os
+import shutil
+import threading
 
 
 SPEC_CHAR_TRANSTABLE = {int.from_bytes(k.encode("utf-8"), "little") : v\
@@ -33,6 +35,158 @@ class CommaSepNonNegInts(list):
 		return
 
 
+class FsyncPolicy(object):
+	"""
+	when to flush written files to disk:
+	none: leave it to the os;
+	each: fsync every file before it replaces its destination;
+	batch: fsync the files written, then their directories, once every
+		<batch_size> files and on close; other files on the same filesystems
+		are not flushed
+	"""
+	MODES = ["none", "each", "batch"]
+
+	def __init__(self, mode = "none", *ka, batch_size = 256, **kw):
+		super().__init__(*ka, **kw)
+		if mode not in self.MODES:
+			raise ValueError("invalid fsync mode '%s'" % mode)
+		self.mode = mode
+		self.batch_size = batch_size
+		# files replaced since the last flush
+		self._pending = list()
+		self._lock = threading.Lock()
+		return
+
+	@staticmethod
+	def _fsync_path(path):
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+		return
+
+	def before_replace(self, fp):
+		if self.mode == "each":
+			fp.flush()
+			os.fsync(fp.fileno())
+		return
+
+	def after_replace(self, fname):
+		if self.mode == "batch":
+			with self._lock:
+				self._pending.append(fname)
+				full = len(self._pending) >= self.batch_size
+			if full:
+				self.close()
+		return
+
+	def close(self):
+		with self._lock:
+			pending, self._pending = self._pending, list()
+		# file contents first, then the renames into their directories
+		for fname in pending:
+			self._fsync_path(fname)
+		for d in set(os.path.dirname(os.path.abspath(f)) for f in pending):
+			self._fsync_path(d)
+		return
+
+
+class FsStateCache(object):
+	"""
+	per-run cache of directory contents; each directory is listed once with
+	os.scandir(), then existence and samefile queries are answered from the
+	listing; file mutations done by StaticUtilityMethods with cache = <this>
+	keep it up to date
+
+	files created or removed by other programs (e.g. ffmpeg outputs) are not
+	seen, check those with os.path directly
+	"""
+	def __init__(self, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.cwd = os.getcwd()
+		# {directory: {name: (inode, is_dir)}}, None if not listable
+		self._dirs = dict()
+		self._lock = threading.Lock()
+		self.n_listed = 0
+		# stat-like syscalls answered from memory
+		self.n_avoided = 0
+		return
+
+	@property
+	def n_saved(self) -> int:
+		return self.n_avoided - self.n_listed
+
+	def _split(self, path) -> (str, str):
+		return os.path.split(os.path.normpath(os.path.join(self.cwd, path)))
+
+	def _get_dir(self, d):
+		# call with lock held
+		if d not in self._dirs:
+			self.n_listed += 1
+			try:
+				with os.scandir(d) as it:
+					self._dirs[d] = {e.name: (e.inode(), e.is_dir())\
+						for e in it}
+			except (FileNotFoundError, NotADirectoryError):
+				self._dirs[d] = dict()
+			except OSError:
+				self._dirs[d] = None
+		return self._dirs[d]
+
+	def lookup(self, path, *, cost = 1) -> (bool, tuple):
+		"""
+		returns (known, entry); entry is (inode, is_dir) or None if path does
+		not exist; known is False if its directory can not be listed
+		"""
+		d, name = self._split(path)
+		with self._lock:
+			entries = self._get_dir(d) if name else None
+			if entries is None:
+				return False, None
+			self.n_avoided += cost
+			return True, entries.get(name)
+
+	def listdir(self, path) -> set:
+		path = os.path.normpath(os.path.join(self.cwd, path))
+		with self._lock:
+			if path in self._dirs:
+				self.n_avoided += 1
+			entries = self._get_dir(path)
+		if entries is None:
+			return set(os.listdir(path))
+		return set(entries)
+
+	def add(self, path, *, inode = None, is_dir = False, empty = False):
+		"""
+		add a created or moved-in entry; empty = True for a new directory,
+		whose (empty) listing is then known without listing it
+		"""
+		d, name = self._split(path)
+		with self._lock:
+			entries = self._dirs.get(d)
+			if entries is not None:
+				entries[name] = (inode, is_dir)
+			if empty:
+				self._dirs[os.path.join(d, name)] = dict()
+		return
+
+	def discard(self, path):
+		"""
+		forget a removed or moved-away entry, and listings under it
+		"""
+		d, name = self._split(path)
+		with self._lock:
+			entries = self._dirs.get(d)
+			entry = entries.pop(name, None) if entries else None
+			if (entry is None) or entry[1]:
+				prefix = os.path.join(d, name)
+				for k in [k for k in self._dirs if (k == prefix)\
+						or k.startswith(prefix + os.sep)]:
+					del self._dirs[k]
+		return entry
+
+
 class StaticUtilityMethods(object):
 	def decorate(cls):
 		"""
@@ -55,11 +209,180 @@ class StaticUtilityMethods(object):
 		return ret
 
 	@staticmethod
-	def samefile(f1, f2):
+	def atomic_open(fname, mode = "w", **kw):
+		"""
+		open a temporary file next to <fname> for writing; it must be moved to
+		<fname> by atomic_commit() or removed by atomic_abort()
+		"""
+		try:
+			st = os.stat(fname)
+		except FileNotFoundError:
+			st = None
+		while True:
+			temp = os.path.extsep.join([fname, os.urandom(4).hex(), "tmp"])
+			try:
+				# unlike tempfile.mkstemp(), keep default permissions by umask
+				fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+			except FileExistsError:
+				continue
+			break
+		if st is not None:
+			# a replaced file keeps its mode and group
+			os.fchmod(fd, st.st_mode & 0o7777)
+			try:
+				os.fchown(fd, -1, st.st_gid)
+			except PermissionError:
+				pass
+		return os.fdopen(fd, mode, **kw), temp
+
+	@staticmethod
+	def atomic_commit(fp, temp, fname, *, fsync = None):
+		if fsync is not None:
+			fsync.before_replace(fp)
+		fp.close()
+		os.replace(temp, fname)
+		if fsync is not None:
+			fsync.after_replace(fname)
+		return
+
+	@staticmethod
+	def atomic_abort(fp, temp):
+		fp.close()
+		os.remove(temp)
+		return
+
+	@staticmethod
+	def atomic_write(fname, data, mode = "w", *, fsync = None, **kw):
+		"""
+		write <data> into <fname> via a temporary file and os.replace(), so that
+		<fname> is never left truncated
+		"""
+		fp, temp = StaticUtilityMethods.atomic_open(fname, mode, **kw)
+		try:
+			fp.write(data)
+		except BaseException:
+			StaticUtilityMethods.atomic_abort(fp, temp)
+			raise
+		StaticUtilityMethods.atomic_commit(fp, temp, fname, fsync = fsync)
+		return
+
+	@staticmethod
+	def get_temp_fname(fname):
+		"""
+		temporary file name next to <fname>, keeping its extension so that
+		programs can still guess the format from it
+		"""
+		bname, ext = os.path.splitext(fname)
+		return os.path.extsep.join([bname, os.urandom(4).hex(), "tmp"]) + ext
+
+	# filesystem queries and mutations, using and updating a per-run
+	# filesystem state cache (FsStateCache) if given
+	@staticmethod
+	def samefile(f1, f2, *, cache = None):
+		if cache is not None:
+			# two exists() and two stat() calls
+			(k1, e1), (k2, e2) = cache.lookup(f1, cost = 2),\
+				cache.lookup(f2, cost = 2)
+			if k1 and k2:
+				if (e1 is None) or (e2 is None):
+					return False
+				if (e1[0] is not None) and (e2[0] is not None)\
+						and (e1[0] != e2[0]):
+					return False
+				# same inode, may still be on different devices
+				return os.path.samefile(f1, f2)
 		ret = False if ((not os.path.exists(f1)) or (not os.path.exists(f2)))\
 			else os.path.samefile(f1, f2)
 		return ret
 
+	@staticmethod
+	def lexists(path, *, cache = None) -> bool:
+		if cache is not None:
+			known, entry = cache.lookup(path)
+			if known:
+				return entry is not None
+		return os.path.lexists(path)
+
+	@staticmethod
+	def isdir(path, *, cache = None) -> bool:
+		if cache is not None:
+			known, entry = cache.lookup(path)
+			if known:
+				return (entry is not None) and entry[1]
+		return os.path.isdir(path)
+
+	@staticmethod
+	def listdir(path, *, cache = None) -> set:
+		if cache is not None:
+			return cache.listdir(path)
+		return set(os.listdir(path))
+
+	@staticmethod
+	def makedirs(path, *, cache = None) -> list:
+		"""
+		same as os.makedirs(path, exist_ok = True), returns the created
+		directories, parents first
+		"""
+		missing = list()
+		parent = path
+		while parent\
+				and (not StaticUtilityMethods.isdir(parent, cache = cache)):
+			missing.append(parent)
+			parent = os.path.dirname(parent)
+		if missing:
+			os.makedirs(path, exist_ok = True)
+		for d in reversed(missing):
+			if cache is not None:
+				cache.add(d, is_dir = True, empty = True)
+		return missing[::-1]
+
+	@staticmethod
+	def get_move_dst(src, dst, *, cache = None):
+		"""
+		like shutil, a file moved/copied to a directory goes into it
+		"""
+		if StaticUtilityMethods.isdir(dst, cache = cache):
+			return os.path.join(dst, os.path.basename(src))
+		return dst
+
+	@staticmethod
+	def move(src, dst, *, cache = None) -> str:
+		dst = StaticUtilityMethods.get_move_dst(src, dst, cache = cache)
+		try:
+			# shutil.move() checks isdir(dst) again before trying rename()
+			os.rename(src, dst)
+		except OSError:
+			shutil.move(src, dst)
+		if cache is not None:
+			entry = cache.discard(src)
+			# inode is kept only by rename within a filesystem
+			cache.add(dst, is_dir = entry[1] if entry is not None\
+				else os.path.isdir(dst))
+		return dst
+
+	@staticmethod
+	def copy(src, dst, *, cache = None) -> str:
+		dst = StaticUtilityMethods.get_move_dst(src, dst, cache = cache)
+		shutil.copy(src, dst)
+		if cache is not None:
+			cache.add(dst)
+		return dst
+
+	@staticmethod
+	def replace(src, dst, *, cache = None):
+		os.replace(src, dst)
+		if cache is not None:
+			cache.discard(src)
+			cache.add(dst)
+		return
+
+	@staticmethod
+	def remove(path, *, cache = None):
+		os.remove(path)
+		if cache is not None:
+			cache.discard(path)
+		return
+
 	#@staticmethod
 	#def safe_fname(fname, *, check_suffix = "-"):
 	#	# replace special characters (mostly, to protect windows users)
@@ -89,18 +412,19 @@ class StaticUtilityMethods(object):
 	@staticmethod
 	def append_filename_extension(fname: str, extension: str) -> str:
 		"""
-		append extension to a file name
+		append extension to a file name, unchanged if extension is empty
 		"""
-		return fname + os.path.extsep + extension
+		return (fname + os.path.extsep + extension) if extension else fname
 
 	@staticmethod
 	def change_filename_extension(fname: str, extension: str) -> str:
 		"""
 		change the extension of a file name
-		if the file name has no extension, append the extension instead
+		if the file name has no extension, append the extension instead;
+		an empty extension removes it
 		"""
 		bname, ext = os.path.splitext(fname)
-		return bname + os.path.extsep + extension
+		return (bname + os.path.extsep + extension) if extension else bname
 
 	@staticmethod
 	def get_default_conflict_prefix():
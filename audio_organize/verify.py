@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+# custom lib
+from . import subprog
+from .cache import FileResultCache
+
+
+@subprog.SubprogReg.new_subprog("verify",
+	help = "verify integrity of audio files on a list",
+	desc = "verify integrity of audio files on a list by decoding them to "
+		"null with 'ffmpeg' (or 'flac -t' for flac files with --flac), and "
+		"report decoding errors per file; passed files are cached by size "
+		"and modification time so that they are not decoded again")
+class SubprogVerify(subprog.SubprogWithLogBase,
+		subprog.ListBasedSubprogBase):
+	# cached passes of a check, a 'flac -t' pass also implies decoding
+	ACCEPTED_PASSES = {"flac": {"ok:flac"}, "ffmpeg": {"ok:flac", "ok:ffmpeg"}}
+	# seconds between cache saves, so that an interrupted run keeps results
+	CACHE_SAVE_INTERVAL = 60
+	@subprog.SubprogBase.append_opt_verbose
+	@subprog.SubprogBase.append_opt_dryrun
+	@subprog.SubprogBase.append_opt_jobs
+	@subprog.SubprogBase.append_opt_program("ffmpeg")
+	@subprog.SubprogBase.append_opt_program("flac", dest = "flac_path")
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("--flac", action = "store_true",
+			help = "check flac files with 'flac -t', which also verifies the "
+				"STREAMINFO MD5 signature (default: no)")
+		ap.add_argument("--cache", type = str, default = ".verify_cache.jsonl",
+			metavar = "file",
+			help = "cache file of passed files, '' to disable "
+				"(default: .verify_cache.jsonl)")
+		ap.add_argument("-o", "--report", type = str, default = None,
+			metavar = "file",
+			help = "write json-lines report with the status and errors of "
+				"each file (default: no)")
+		ap.add_argument("--pass-list", type = str, default = None,
+			metavar = "file",
+			help = "write passed files as a new list (default: no)")
+		ap.add_argument("--fail-list", type = str, default = None,
+			metavar = "file",
+			help = "write failed files as a new list (default: no)")
+		return ap
+
+	@staticmethod
+	def get_check_mode(args, fname) -> str:
+		return "flac" if args.flac and fname.lower().endswith(".flac")\
+			else "ffmpeg"
+
+	def _verify(self, args, fname) -> (str, str, bool):
+		"""
+		returns (status, error messages, counted); status is one of ok, error,
+		missing; counted is True if the failure is already counted into
+		progress (by logged_external_output on a non-zero return)
+		"""
+		if not os.path.exists(fname):
+			return "missing", "", False
+		if self.get_check_mode(args, fname) == "flac":
+			cmd = [args.flac_path, "-t", "-s", "-w",
+				self.util.fname_prevent_monkey_patch(fname)]
+		else:
+			cmd = [args.ffmpeg, "-nostdin", "-hide_banner", "-v", "error",
+				"-i", self.util.fname_prevent_monkey_patch(fname),
+				"-map", "0:a", "-f", "null", "-"]
+		errors = self.logged_external_output(cmd, dry_run = args.dry_run,
+			verbose = args.verbose, capture_stderr = True)
+		if args.dry_run:
+			return "ok", "", False
+		# non-zero return is reported as None
+		if errors is None:
+			return "error", "non-zero return", True
+		return ("error" if errors.strip() else "ok"), errors.strip(), False
+
+	def _verify_cached(self, args, cache, fname):
+		if cache.get_result(fname)\
+				in self.ACCEPTED_PASSES[self.get_check_mode(args, fname)]:
+			return "ok", "", False, True
+		return self._verify(args, fname) + (False,)
+
+	def _verify_all(self, args, cache, fnames, outputs):
+		n_checked, n_failed = 0, 0
+		last_save = time.monotonic()
+		results = self.iter_parallel(
+			lambda f: self._verify_cached(args, cache, f), fnames,
+			jobs = args.jobs)
+		for fname, (status, errors, counted, cached) in zip(fnames, results):
+			n_checked += 1
+			if status == "ok":
+				if (not cached) and (not args.dry_run):
+					cache.set_result(fname, "ok:"\
+						+ self.get_check_mode(args, fname))
+				if args.verbose:
+					self.log_err("ok: %s%s\n" % (fname,
+						" (cached)" if cached else ""))
+			else:
+				n_failed += 1
+				if not counted:
+					self.progress.fail()
+				cache.discard_result(fname)
+				self.log_err("%s: %s\n%s" % (status, fname,
+					(errors + "\n") if errors else ""))
+			if "report" in outputs:
+				outputs["report"].write(json.dumps(dict(file = fname,
+					status = status, cached = cached, errors = errors),
+					ensure_ascii = False) + "\n")
+			self.add_result(fname, status == "ok",
+				error = None if status == "ok" else (errors or status))
+			key = "pass" if status == "ok" else "fail"
+			if key in outputs:
+				outputs[key].write(fname + "\n")
+			if (not args.dry_run) and (time.monotonic() - last_save\
+					>= self.CACHE_SAVE_INTERVAL):
+				cache.save()
+				last_save = time.monotonic()
+		self.log_err("verified: %d files, %d failed\n" % (n_checked, n_failed))
+		return
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		cache = FileResultCache.load(args.cache)
+		outputs = {k: self.util.get_fp(v, "w", encoding = "utf-8")\
+			for k, v in [("report", args.report), ("pass", args.pass_list),
+			("fail", args.fail_list)] if v and (not args.dry_run)}
+		fnames = self.read_list(args)
+		try:
+			self._verify_all(args, cache, fnames, outputs)
+		finally:
+			for fp in outputs.values():
+				fp.close()
+			if not args.dry_run:
+				cache.save()
+		return
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import collections
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+# custom lib
+from . import subprog
+from . import util
+
+
+@util.StaticUtilityMethods.decorate
+class WorkQueue(object):
+	"""
+	work queue in a (shared) directory; each work item is a chunk of a list
+	in its own file, moved between state directories by rename(), which is
+	atomic also on nfs:
+
+	todo/<item>: waiting to be claimed
+	leased/<item>@<worker>: claimed by a worker, the lease is renewed by
+		touching the file; leases not renewed in time are moved back to todo
+	done/<item>, failed/<item>: finished by exit status of the subprogram
+	logs/<item>.log, logs/<item>.err: stdout/stderr logs of the subprogram
+
+	job.json holds the subprogram command, working directory and lease time
+	"""
+	STATES = ["todo", "leased", "done", "failed"]
+	JOB_FILE = "job.json"
+	LEASE_SEP = "@"
+
+	Lease = collections.namedtuple("Lease", ["item", "path"])
+
+	def __init__(self, path, *ka, **kw):
+		super().__init__(*ka, **kw)
+		self.path = path
+		self._job = None
+		return
+
+	def get_dir(self, state):
+		return os.path.join(self.path, state)
+
+	@property
+	def job(self) -> dict:
+		if self._job is None:
+			with open(os.path.join(self.path, self.JOB_FILE), "r",
+					encoding = "utf-8") as fp:
+				self._job = json.load(fp)
+		return self._job
+
+	def create(self, argv: list, fnames: list, *, chunk_size = 64,
+			lease = 600, cwd = None):
+		"""
+		create a new queue with the list split into chunks of <chunk_size>
+		"""
+		if os.path.exists(os.path.join(self.path, self.JOB_FILE)):
+			raise FileExistsError("work queue already exists: '%s'"\
+				% self.path)
+		for d in self.STATES + ["logs"]:
+			os.makedirs(self.get_dir(d), exist_ok = True)
+		n_items = 0
+		for i in range(0, len(fnames), chunk_size):
+			self.util.atomic_write(os.path.join(self.get_dir("todo"),
+				"%06d.list" % n_items), ("").join(f + "\n"\
+				for f in fnames[i:i + chunk_size]), encoding = "utf-8")
+			n_items += 1
+		# the job file is written last, workers start only after it exists
+		self._job = dict(argv = argv, cwd = cwd or os.getcwd(),
+			lease = lease, n_items = n_items)
+		self.util.atomic_write(os.path.join(self.path, self.JOB_FILE),
+			json.dumps(self._job, ensure_ascii = False) + "\n",
+			encoding = "utf-8")
+		return n_items
+
+	def get_counts(self) -> dict:
+		return {s: len(os.listdir(self.get_dir(s))) for s in self.STATES}
+
+	def requeue_expired(self) -> list:
+		"""
+		move leases not renewed within the lease time back to todo, returns
+		the requeued items
+		"""
+		ret = list()
+		deadline = time.time() - self.job["lease"]
+		leased = self.get_dir("leased")
+		for name in os.listdir(leased):
+			path = os.path.join(leased, name)
+			try:
+				if os.stat(path).st_mtime >= deadline:
+					continue
+				item = name.rpartition(self.LEASE_SEP)[0]
+				os.rename(path, os.path.join(self.get_dir("todo"), item))
+			except FileNotFoundError:
+				# finished or requeued by others meanwhile
+				continue
+			ret.append(item)
+		return ret
+
+	def claim(self, worker: str):
+		"""
+		claim an item for <worker>, returns a Lease or None if none left
+		"""
+		todo = self.get_dir("todo")
+		for item in sorted(os.listdir(todo)):
+			path = os.path.join(self.get_dir("leased"),
+				item + self.LEASE_SEP + worker)
+			try:
+				os.rename(os.path.join(todo, item), path)
+			except FileNotFoundError:
+				# claimed by another worker
+				continue
+			# rename keeps the old mtime, start the lease now
+			os.utime(path)
+			return self.Lease(item, path)
+		return None
+
+	def renew(self, lease) -> bool:
+		try:
+			os.utime(lease.path)
+		except FileNotFoundError:
+			# expired and requeued
+			return False
+		return True
+
+	def finish(self, lease, ok: bool) -> bool:
+		"""
+		move a leased item to done or failed; returns False if the lease was
+		lost (the item is requeued and will be run again)
+		"""
+		try:
+			os.rename(lease.path, os.path.join(
+				self.get_dir("done" if ok else "failed"), lease.item))
+		except FileNotFoundError:
+			return False
+		return True
+
+
+@subprog.SubprogReg.new_subprog("queue",
+	help = "run a list-based subprogram on multiple nodes via a work queue",
+	desc = "run a list-based subprogram on multiple nodes via a work queue "
+		"directory on shared storage; 'submit' splits the list into work "
+		"items, and 'work' (run on each node, possibly multiple times) "
+		"claims and runs them until the queue is empty; items of crashed "
+		"workers are requeued when their leases expire; metadata must be in "
+		"sidecars, not a -M/--manifest")
+class SubprogQueue(subprog.SubprogWithLogBase):
+	@subprog.SubprogBase.append_opt_verbose
+	def create_argparser(self, subparsers, *ka, **kw):
+		ap = super().create_argparser(subparsers, *ka, **kw)
+		ap.add_argument("action", type = str,
+			choices = ["submit", "work", "status"],
+			help = "submit: create the queue; work: claim and run items; "
+				"status: show item counts")
+		ap.add_argument("queue", type = str,
+			help = "work queue directory, on storage shared by all nodes")
+		ap.add_argument("-e", "--command", type = str, default = None,
+			metavar = "str",
+			help = "with submit: subprogram and its arguments without the "
+				"list, as one shell-quoted string, e.g. "
+				"\"remap_metadata -R flac\"")
+		ap.add_argument("-l", "--list", type = str, default = "list",
+			metavar = "file",
+			help = "with submit: list of audio files (default: list)")
+		ap.add_argument("--list-encoding", type = str, default = "utf-8",
+			metavar = "encoding",
+			help = "encoding in the input list file (default: utf-8)")
+		ap.add_argument("--chunk-size", type = util.PosInt, default = 64,
+			metavar = "int",
+			help = "with submit: files per work item (default: 64)")
+		ap.add_argument("--lease", type = util.PosInt, default = 600,
+			metavar = "seconds",
+			help = "with submit: items not renewed by their worker within "
+				"this time are run again; workers renew every 1/3 of it "
+				"(default: 600)")
+		ap.add_argument("--worker-id", type = str,
+			default = "%s.%d" % (socket.gethostname(), os.getpid()),
+			metavar = "str",
+			help = "with work: name of this worker (default: <host>.<pid>)")
+		ap.add_argument("--max-items", type = int, default = 0,
+			metavar = "int",
+			help = "with work: exit after this many items, 0 for no limit "
+				"(default: 0)")
+		ap.add_argument("--poll", type = float, default = 10.0,
+			metavar = "seconds",
+			help = "with work: wait between checks for expired leases when "
+				"no item is left to claim (default: 10)")
+		return ap
+
+	def refine_args(self, args):
+		args = super().refine_args(args)
+		args.command = shlex.split(args.command or "")
+		if args.action == "submit":
+			if not args.command:
+				raise self.ArgsError("submit requires -e/--command")
+			cls = subprog.SubprogReg.get_subprog_class(args.command[0])
+			if not issubclass(cls, subprog.ListBasedSubprogBase):
+				raise self.ArgsError("'%s' is not a list-based subprogram"\
+					% args.command[0])
+		if "@" in args.worker_id:
+			raise self.ArgsError("worker id must not contain '@'")
+		return args
+
+	def _submit(self, args, queue):
+		with self.util.get_fp(args.list, "r", encoding = args.list_encoding)\
+				as fp:
+			fnames = fp.read().splitlines()
+		n_items = queue.create(args.command, fnames,
+			chunk_size = args.chunk_size, lease = args.lease)
+		self.log_err("submitted: %d files in %d items\n"\
+			% (len(fnames), n_items))
+		return
+
+	@staticmethod
+	def _signal_group(proc, sig):
+		try:
+			os.killpg(proc.pid, sig)
+		except ProcessLookupError:
+			pass
+		return
+
+	def _run_item(self, args, queue, lease):
+		"""
+		run the subprogram on a leased item, returns True/False by its exit
+		status, or None if the lease was lost; the subprogram is then stopped,
+		as the item is run again by another worker
+		"""
+		job = queue.job
+		item_path = os.path.join(os.path.abspath(queue.get_dir("leased")),
+			os.path.basename(lease.path))
+		log = os.path.join(os.path.abspath(queue.get_dir("logs")),
+			os.path.splitext(lease.item)[0])
+		# list is the first positional argument of list-based subprograms
+		cmd = [sys.executable, "-m", __package__, job["argv"][0], item_path]\
+			+ job["argv"][1:] + ["--log-file", log + ".log",
+			"--err-file", log + ".err"]
+		if args.verbose:
+			self.log_err("running: %s\n" % lease.item)
+		# in its own process group, to stop also its external programs
+		proc = subprocess.Popen(cmd, cwd = job["cwd"],
+			stdin = subprocess.DEVNULL, start_new_session = True)
+		# renew the lease while the subprogram runs, stop it if lost
+		stop, lost = threading.Event(), threading.Event()
+		def renew():
+			while not stop.wait(job["lease"] / 3):
+				if not queue.renew(lease):
+					lost.set()
+					self._signal_group(proc, signal.SIGTERM)
+					return
+			return
+		renewer = threading.Thread(target = renew, daemon = True)
+		renewer.start()
+		try:
+			ret = proc.wait()
+		finally:
+			stop.set()
+			renewer.join()
+			if proc.poll() is None:
+				self._signal_group(proc, signal.SIGKILL)
+				proc.wait()
+		if lost.is_set():
+			self.log_err("[LeaseLost]: %s is abandoned, see %s.err\n"\
+				% (lease.item, log))
+			return None
+		if ret:
+			self.log_err("[NonZeroReturn]: %s, see %s.err\n"\
+				% (lease.item, log))
+		return ret == 0
+
+	def _work(self, args, queue):
+		n_done = 0
+		while (args.max_items <= 0) or (n_done < args.max_items):
+			for item in queue.requeue_expired():
+				self.log_err("requeued: %s (lease expired)\n" % item)
+			lease = queue.claim(args.worker_id)
+			if lease is None:
+				# wait for others' leases to finish or expire
+				if not queue.get_counts()["leased"]:
+					break
+				time.sleep(args.poll)
+				continue
+			ok = self._run_item(args, queue, lease)
+			if ok is None:
+				# requeued, run again by another worker
+				self.progress.fail()
+			elif not queue.finish(lease, ok):
+				self.log_err("[LeaseLost]: %s is requeued\n" % lease.item)
+			elif not ok:
+				self.progress.fail()
+			n_done += 1
+			self.progress.update()
+		self.log_err("worker %s: %d items run\n" % (args.worker_id, n_done))
+		return
+
+	@subprog.SubprogWithLogBase.with_log()
+	def subprog_main(self, args):
+		queue = WorkQueue(args.queue)
+		if args.action == "submit":
+			return self._submit(args, queue)
+		if args.action == "work":
+			return self._work(args, queue)
+		counts = queue.get_counts()
+		self.log_err("%s: %s\n" % (args.queue, (", ").join("%s %d" % (k, v)\
+			for k, v in counts.items())))
+		return
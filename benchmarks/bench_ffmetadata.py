@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+ffmetadata parsing throughput: run from the repository root as
+
+	python3 benchmarks/bench_ffmetadata.py [-n repeats]
+
+for each case, prints the best of <repeats> parse times and MB/s
+"""
+
+import argparse
+import os
+import sys
+import time
+# run from a checkout without installing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# custom lib
+from audio_organize.metadata import Metadata
+
+
+def make_sidecar() -> str:
+	# typical per-track sidecar
+	return (";FFMETADATA1\nalbum=Album Title\nartist=Artist A\\; Artist B\n"
+		"date=2001\ndisc=1\ngenre=Soundtrack\ntitle=Track Title\ntrack=7\n")
+
+
+def make_many_tags(n = 20000) -> str:
+	lines = [Metadata.HEAD_LINE]
+	lines.extend("tag%05d=value %d" % (i, i) for i in range(n))
+	return ("\n").join(lines) + "\n"
+
+
+def make_escaped_tags(n = 20000) -> str:
+	lines = [Metadata.HEAD_LINE]
+	lines.extend("tag%05d=a\\=b\\;c\\#d\\\\e line\\\nnext %d" % (i, i)\
+		for i in range(n))
+	return ("\n").join(lines) + "\n"
+
+
+def make_chapters(n = 5000) -> str:
+	lines = [Metadata.HEAD_LINE, "title=Book"]
+	for i in range(n):
+		lines.extend(["[CHAPTER]", "TIMEBASE=1/1000", "START=%d" % (i * 1000),
+			"END=%d" % ((i + 1) * 1000), "title=Chapter %d" % (i + 1)])
+	return ("\n").join(lines) + "\n"
+
+
+CASES = [
+	("sidecar x 10000", make_sidecar(), 10000),
+	("20k plain tags", make_many_tags(), 1),
+	("20k escaped tags", make_escaped_tags(), 1),
+	("5000 chapters", make_chapters(), 1),
+]
+
+
+def bench(text, loops, repeats) -> float:
+	best = None
+	for _ in range(repeats):
+		t = time.perf_counter()
+		for _ in range(loops):
+			Metadata.parse_ffmetadata_str(text)
+		t = time.perf_counter() - t
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main():
+	ap = argparse.ArgumentParser(description = "ffmetadata parsing benchmark")
+	ap.add_argument("-n", "--repeats", type = int, default = 5,
+		metavar = "int",
+		help = "repeats per case, the best is reported (default: 5)")
+	args = ap.parse_args()
+	for name, text, loops in CASES:
+		t = bench(text, loops, args.repeats)
+		mb = len(text.encode("utf-8")) * loops / 1e6
+		print("%-20s %9.2f ms %9.1f MB/s" % (name, t * 1e3, mb / t))
+	return
+
+
+if __name__ == "__main__":
+	main()
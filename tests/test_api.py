@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import json
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+
+
+# waits until the other run has started its ffmpeg, then logs a constant
+# -20 LUFS, so that both runs only succeed when they overlap
+FAKE_FFMPEG = """#!/bin/sh
+touch "%(dir)s/%(name)s.started"
+i=0
+while [ ! -e "%(dir)s/%(other)s.started" ]; do
+	i=$((i + 1))
+	[ $i -gt 100 ] && exit 1
+	sleep 0.05
+done
+echo "t: 0.4 M: -20.0" >&2
+echo "  Peak: -1.0 dBFS" >&2
+"""
+
+
+class TestConcurrentRuns(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def _prepare(self, name, other) -> dict:
+		ffmpeg = os.path.join(self.tmp.name, "ffmpeg-" + name)
+		with open(ffmpeg, "w") as fp:
+			fp.write(FAKE_FFMPEG % dict(dir = self.tmp.name, name = name,
+				other = other))
+		os.chmod(ffmpeg, 0o755)
+		manifest = os.path.join(self.tmp.name, name + ".jsonl")
+		with open(manifest, "w") as fp:
+			fp.write(json.dumps(dict(file = name + ".flac",
+				album = name)) + "\n")
+		return dict(manifest = manifest, ffmpeg = ffmpeg, verbose = True)
+
+	def test_replaygain(self):
+		options = [self._prepare("a", "b"), self._prepare("b", "a")]
+		with concurrent.futures.ThreadPoolExecutor(2) as executor:
+			results = list(executor.map(lambda kw: api.run("replaygain",
+				**kw), options))
+		for name, other, res, kw in zip("ab", "ba", results, options):
+			self.assertEqual(res.failed, 0, res.log)
+			# each run only logs its own files
+			self.assertIn("track: %s.flac: " % name, res.log)
+			self.assertNotIn("%s.flac" % other, res.log)
+			with open(kw["manifest"]) as fp:
+				row = json.loads(fp.readline())
+			self.assertEqual(row["replaygain_track_gain"], "2.00 dB")
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+# custom lib
+from audio_organize import util
+from audio_organize.metadata import Metadata
+
+
+class TestAtomicWrite(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.fname = os.path.join(self.tmp.name, "a.flac.metadata")
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def test_mode_kept(self):
+		util.StaticUtilityMethods.atomic_write(self.fname, "old")
+		os.chmod(self.fname, 0o640)
+		util.StaticUtilityMethods.atomic_write(self.fname, "new")
+		self.assertEqual(stat.S_IMODE(os.stat(self.fname).st_mode), 0o640)
+		with open(self.fname) as fp:
+			self.assertEqual(fp.read(), "new")
+		self.assertEqual(os.listdir(self.tmp.name), ["a.flac.metadata"])
+		return
+
+	def test_fsync_batch(self):
+		fsync = util.FsyncPolicy("batch", batch_size = 2)
+		synced = list()
+		with mock.patch.object(util.FsyncPolicy, "_fsync_path",
+				side_effect = synced.append):
+			for name in ["a", "b", "c"]:
+				util.StaticUtilityMethods.atomic_write(
+					os.path.join(self.tmp.name, name), name, fsync = fsync)
+			# the first batch: its files, then their directory
+			self.assertEqual(synced, [os.path.join(self.tmp.name, "a"),
+				os.path.join(self.tmp.name, "b"), self.tmp.name])
+			fsync.close()
+		self.assertEqual(synced[3:], [os.path.join(self.tmp.name, "c"),
+			self.tmp.name])
+		return
+
+
+class TestSaveFfmetadata(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.fname = os.path.join(self.tmp.name, "a.flac.metadata")
+		with open(self.fname, "w", encoding = "utf-8") as fp:
+			fp.write(";FFMETADATA1\ntitle=A\n")
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def test_unchanged_skipped(self):
+		metadata = Metadata.read_ffmetadata(self.fname)
+		with mock.patch("builtins.open", side_effect = AssertionError):
+			# decided by digest, the file is not read again
+			self.assertFalse(metadata.save_ffmetadata(self.fname,
+				force = True))
+		return
+
+	def test_changed_written(self):
+		metadata = Metadata.read_ffmetadata(self.fname)
+		metadata["title"] = Metadata.get_valtype_by_tag("title")\
+			.from_formatted("B")
+		self.assertTrue(metadata.save_ffmetadata(self.fname, force = True))
+		self.assertEqual(Metadata.read_ffmetadata(self.fname)["title"].value,
+			"B")
+		return
+
+	def test_other_file_compared(self):
+		metadata = Metadata.parse_ffmetadata_str(";FFMETADATA1\ntitle=A\n")
+		self.assertFalse(metadata.save_ffmetadata(self.fname, force = True))
+		with self.assertRaises(IOError):
+			metadata.save_ffmetadata(self.fname)
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
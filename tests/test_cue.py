@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.split_by_cue import CueSheet, SubprogSplitByCue
+
+
+CUE = """﻿REM GENRE Rock
+PERFORMER "Artist"
+TITLE "Album"
+FILE "cd.flac" WAVE
+  TRACK 01 AUDIO
+    TITLE "One"
+    INDEX 01 00:00:10
+  TRACK 02 AUDIO
+    TITLE "Two"
+    PERFORMER "Guest"
+    INDEX 00 00:00:70
+    INDEX 01 00:01:00
+  TRACK 03 AUDIO
+    TITLE Three
+    INDEX 01 00:02:37
+"""
+
+RATE, CHANNELS = 44100, 2
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_wav_header(rate, channels, bits) -> bytes:
+	"""
+	wav header as streamed by ffmpeg: unknown sizes, and a LIST chunk before
+	the data
+	"""
+	fmt = struct.pack("<HHIIHH", 1, channels, rate,
+		rate * channels * bits // 8, channels * bits // 8, bits)
+	return b"RIFF\xff\xff\xff\xffWAVE" + b"fmt " + struct.pack("<I", 16)\
+		+ fmt + b"LIST" + struct.pack("<I", 3) + b"abc\0"\
+		+ b"data\xff\xff\xff\xff"
+
+
+# decodes 3 seconds into the requested pcm codec; encodes by writing the
+# received pcm into the output
+FAKE_FFMPEG = """#!%(python)s
+import re, sys
+sys.path[:0] = [%(tests)r, %(root)r]
+from test_cue import make_wav_header, RATE, CHANNELS
+args = sys.argv[1:]
+if "wav" in args:
+	codec = args[args.index("-c:a") + 1]
+	bits = int(re.fullmatch(r"pcm_s(\\d+)le", codec).group(1))
+	sys.stdout.buffer.write(make_wav_header(RATE, CHANNELS, bits))
+	sys.stdout.buffer.write(bytes(3 * RATE * CHANNELS * bits // 8))
+else:
+	with open(args[-1], "wb") as fp:
+		fp.write(sys.stdin.buffer.read())
+"""
+
+
+class TestCueSheet(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cue = os.path.join(self.tmp.name, "cd.cue")
+		with open(self.cue, "w", encoding = "utf-8") as fp:
+			fp.write(CUE)
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def _write_cue(self, text):
+		with open(self.cue, "w", encoding = "utf-8") as fp:
+			fp.write(text)
+		return
+
+	def test_parse(self):
+		cue = CueSheet.from_file(self.cue)
+		self.assertEqual((cue.title, cue.performer), ("Album", "Artist"))
+		self.assertEqual(cue.tracks, [
+			CueSheet.Track(1, "One", "Artist", 10),
+			# INDEX 00 (pregap) is not a split point
+			CueSheet.Track(2, "Two", "Guest", 75),
+			CueSheet.Track(3, "Three", "Artist", 2 * 75 + 37),
+		])
+		return
+
+	def test_invalid(self):
+		for text in [CUE + "FILE \"cd2.flac\" WAVE\n",
+				CUE.replace("INDEX 01 00:01:00", "INDEX 02 00:01:00")]:
+			with self.subTest(text = text[-40:]):
+				self._write_cue(text)
+				with self.assertRaises(ValueError):
+					CueSheet.from_file(self.cue)
+		return
+
+	def test_byte_offsets(self):
+		cue = CueSheet.from_file(self.cue)
+		# cd frames are 588 samples at 44.1 kHz
+		self.assertEqual(cue.get_byte_offsets(44100, 4),
+			[10 * 588 * 4, 75 * 588 * 4, 187 * 588 * 4])
+		# not a multiple of 75, rounded down to whole samples
+		self.assertEqual(cue.get_byte_offsets(48000, 6),
+			[6400 * 6, 48000 * 6, 119680 * 6])
+		return
+
+
+class TestStreamSplit(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmp.name)
+		with open("cd.cue", "w", encoding = "utf-8") as fp:
+			fp.write(CUE)
+		open("cd.flac", "w").close()
+		return
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmp.cleanup()
+		return
+
+	def _write_tool(self, name, text):
+		with open(name, "w") as fp:
+			fp.write(text)
+		os.chmod(name, 0o755)
+		return os.path.abspath(name)
+
+	def test_get_pcm_bits(self):
+		cases = [(dict(sample_fmt = "s16", bits_per_raw_sample = "16"), 16),
+			(dict(sample_fmt = "s32", bits_per_raw_sample = "24"), 24),
+			(dict(sample_fmt = "s32p", bits_per_raw_sample = "0"), 32),
+			(dict(sample_fmt = "s16", bits_per_sample = "16"), 16),
+			(dict(sample_fmt = "fltp"), 24),
+			(dict(sample_fmt = "u8"), 16)]
+		for stream, bits in cases:
+			with self.subTest(stream = stream):
+				self.assertEqual(SubprogSplitByCue._get_pcm_bits(stream), bits)
+		return
+
+	def test_read_wav_header(self):
+		fp = io.BytesIO(make_wav_header(48000, 2, 24) + b"pcm")
+		self.assertEqual(SubprogSplitByCue._read_wav_header(fp),
+			(48000, 2, 24))
+		self.assertEqual(fp.read(), b"pcm")
+		with self.assertRaises(ValueError):
+			SubprogSplitByCue._read_wav_header(io.BytesIO(b"RIFF"))
+		return
+
+	def test_stream_24bit(self):
+		ffprobe = self._write_tool("ffprobe", "#!/bin/sh\necho '%s'\n"\
+			% json.dumps(dict(streams = [dict(sample_fmt = "s32",
+				bits_per_raw_sample = "24")])))
+		ffmpeg = self._write_tool("ffmpeg", FAKE_FFMPEG % dict(
+			python = sys.executable, tests = TESTS_DIR,
+			root = os.path.dirname(TESTS_DIR)))
+		res = api.run("split_by_cue", input = ["cd.flac"], cue = ["cd.cue"],
+			stream = True, ffmpeg = ffmpeg, ffprobe = ffprobe)
+		self.assertEqual(res.failed, 0, res.log)
+		sizes = [os.path.getsize(f) for f in ["01. One - Artist.flac",
+			"02. Two - Guest.flac", "03. Three - Artist.flac"]]
+		# track starts at samples 5880, 44100 and 109956 of 132300, 24-bit
+		# stereo; the pregap before track 1 is dropped
+		self.assertEqual(sizes, [38220 * 6, 65856 * 6, 22344 * 6])
+		return
+
+	def test_bad_cue(self):
+		with open("bad.cue", "w", encoding = "utf-8") as fp:
+			fp.write(CUE + "FILE \"cd2.flac\" WAVE\n")
+		# the bad cue fails its job only, the next is still split
+		res = api.run("split_by_cue", input = ["cd.flac", "cd.flac"],
+			cue = ["bad.cue", "cd.cue"], stream = True, dry_run = True)
+		self.assertEqual(res.failed, 1)
+		self.assertIn("[BadCue]: cd.flac: cue sheet 'bad.cue' refers to "
+			"multiple files", res.log)
+		self.assertIn("01. One - Artist.flac", res.log)
+		return
+
+	def test_dry_run_format(self):
+		res = api.run("split_by_cue", input = ["cd.flac"], cue = ["cd.cue"],
+			stream = True, dry_run = True)
+		self.assertEqual(res.failed, 0)
+		# no pcm format is made up before probing
+		self.assertIn("pcm_s<probed>le", res.log)
+		self.assertIn("'-f', 's<probed>le', '-ar', '<probed>', '-ac', "
+			"'<probed>'", res.log)
+		self.assertEqual(sorted(os.listdir()), ["cd.cue", "cd.flac"])
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
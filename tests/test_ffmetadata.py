@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import shutil
+import subprocess
+import unittest
+# custom lib
+from audio_organize.metadata import Metadata
+
+
+# as written by ffmpeg's ffmetadata muxer: global tags, [STREAM] sections,
+# then [CHAPTER] sections; '=', ';', '#', '\' and newlines are escaped
+FFMPEG_WRITTEN = [
+	# plain tags
+	";FFMETADATA1\n"
+	"album=Album\n"
+	"artist=Artist\n"
+	"title=Title\n"
+	"track=3\n",
+	# escaped special characters in values and keys
+	";FFMETADATA1\n"
+	"artist=A\\; B\n"
+	"comment=x \\= y \\# z\n"
+	"key\\=with\\=equals=v\n"
+	"title=ends with \\\\\n",
+	# multi-line value, escaped newline continued on the next line
+	";FFMETADATA1\n"
+	"lyrics=first line\\\n"
+	"second line\\\n"
+	"\n"
+	"title=T\n",
+	# stream and chapter sections
+	";FFMETADATA1\n"
+	"title=Book\n"
+	"[STREAM]\n"
+	"language=eng\n"
+	"[CHAPTER]\n"
+	"TIMEBASE=1/1000\n"
+	"START=0\n"
+	"END=61500\n"
+	"title=One\n"
+	"[CHAPTER]\n"
+	"TIMEBASE=1/44100\n"
+	"START=2712150\n"
+	"END=5424300\n"
+	"title=Two \\= 2\n"
+	"comment=c\n",
+]
+
+
+class TestFfmetadataRoundTrip(unittest.TestCase):
+	def test_round_trip(self):
+		for text in FFMPEG_WRITTEN:
+			with self.subTest(text = text):
+				metadata = Metadata.parse_ffmetadata_str(text)
+				self.assertEqual(metadata.to_ffmetadata_str(), text)
+
+	def test_escapes(self):
+		metadata = Metadata.parse_ffmetadata_str(FFMPEG_WRITTEN[1])
+		self.assertEqual(metadata["artist"].value, ["A", "B"])
+		self.assertEqual(metadata["comment"].value, "x = y # z")
+		self.assertEqual(metadata["key=with=equals"].value, "v")
+		self.assertEqual(metadata["title"].value, "ends with \\")
+
+	def test_multi_line(self):
+		metadata = Metadata.parse_ffmetadata_str(FFMPEG_WRITTEN[2])
+		self.assertEqual(metadata["lyrics"].value, "first line\nsecond line\n")
+		self.assertEqual(metadata["title"].value, "T")
+
+	def test_sections(self):
+		metadata = Metadata.parse_ffmetadata_str(FFMPEG_WRITTEN[3])
+		self.assertEqual(metadata.sections, [("STREAM", [("language", "eng")])])
+		self.assertEqual(len(metadata.chapters), 2)
+		self.assertEqual(metadata.chapters[0].title, "One")
+		self.assertEqual(metadata.chapters.get_seconds(0), (0.0, 61.5))
+		self.assertEqual(metadata.chapters[1].title, "Two = 2")
+		self.assertEqual(metadata.chapters[1].timebase, (1, 44100))
+		self.assertEqual(metadata.chapters[1].tags, [("comment", "c")])
+
+	def test_crlf_bytes(self):
+		text = FFMPEG_WRITTEN[3]
+		metadata = Metadata.parse_ffmetadata_bytes(
+			text.replace("\n", "\r\n").encode("utf-8"))
+		self.assertEqual(metadata.to_ffmetadata_str(), text)
+		self.assertEqual(metadata.ffmetadata_digest,
+			Metadata.get_text_digest(text))
+
+	def test_missing_header(self):
+		with self.assertRaises(Metadata.MetadataError):
+			Metadata.parse_ffmetadata_str("title=T\n")
+
+	@unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg not found")
+	def test_ffmpeg_output(self):
+		tags = {"title": "a=b;c#d\\e", "comment": "line 1\nline 2",
+			"artist": "A; B"}
+		cmd = ["ffmpeg", "-nostdin", "-v", "error", "-f", "lavfi",
+			"-i", "anullsrc", "-t", "0.1"]
+		for k, v in tags.items():
+			cmd.extend(["-metadata", k + "=" + v])
+		cmd.extend(["-f", "ffmetadata", "-"])
+		text = subprocess.run(cmd, stdout = subprocess.PIPE, check = True)\
+			.stdout.decode("utf-8")
+		metadata = Metadata.parse_ffmetadata_str(text)
+		self.assertEqual(metadata["title"].value, tags["title"])
+		self.assertEqual(metadata["comment"].value, tags["comment"])
+		self.assertEqual(metadata["artist"].value, ["A", "B"])
+		text = metadata.to_ffmetadata_str()
+		self.assertEqual(Metadata.parse_ffmetadata_str(text)\
+			.to_ffmetadata_str(), text)
+
+
+if __name__ == "__main__":
+	unittest.main()
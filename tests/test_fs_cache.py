@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import util
+from audio_organize.journal import Journal
+
+
+class TestFsStateCache(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmp.name)
+		os.makedirs("d/sub")
+		for name in ["a", "d/b", "d/sub/c"]:
+			open(name, "w").close()
+		self.cache = util.FsStateCache()
+		self.util = util.StaticUtilityMethods
+		return
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmp.cleanup()
+		return
+
+	def test_listed_once(self):
+		self.assertTrue(self.util.lexists("d/b", cache = self.cache))
+		self.assertFalse(self.util.lexists("d/x", cache = self.cache))
+		self.assertTrue(self.util.isdir("d/sub", cache = self.cache))
+		self.assertEqual(self.util.listdir("d", cache = self.cache),
+			{"b", "sub"})
+		self.assertEqual(self.cache.n_listed, 1)
+		self.assertEqual(self.cache.n_saved, 3)
+		# changes by other programs are not seen
+		open("d/x", "w").close()
+		self.assertFalse(self.util.lexists("d/x", cache = self.cache))
+		return
+
+	def test_move(self):
+		self.assertFalse(self.util.lexists("d/a", cache = self.cache))
+		self.util.move("a", "d", cache = self.cache)
+		self.assertTrue(self.util.lexists("d/a", cache = self.cache))
+		self.assertFalse(self.util.lexists("a", cache = self.cache))
+		# a moved directory takes its listings along
+		self.assertTrue(self.util.lexists("d/sub/c", cache = self.cache))
+		self.util.move("d/sub", "e", cache = self.cache)
+		self.assertFalse(self.util.lexists("d/sub/c", cache = self.cache))
+		self.assertTrue(self.util.isdir("e", cache = self.cache))
+		self.assertTrue(self.util.lexists("e/c", cache = self.cache))
+		return
+
+	def test_copy_replace_remove(self):
+		self.util.copy("a", "d/a2", cache = self.cache)
+		self.assertEqual(self.util.listdir("d", cache = self.cache),
+			{"a2", "b", "sub"})
+		open("t", "w").close()
+		self.util.replace("t", "d/b", cache = self.cache)
+		self.assertFalse(self.util.lexists("t", cache = self.cache))
+		self.util.remove("d/b", cache = self.cache)
+		self.assertEqual(self.util.listdir("d", cache = self.cache),
+			{"a2", "sub"})
+		self.assertEqual(sorted(os.listdir("d")), ["a2", "sub"])
+		return
+
+	def test_makedirs(self):
+		self.assertEqual(self.util.makedirs("d/x/y", cache = self.cache),
+			["d/x", "d/x/y"])
+		n_listed = self.cache.n_listed
+		# new directories are known to be empty without listing them
+		self.assertEqual(self.util.listdir("d/x/y", cache = self.cache),
+			set())
+		self.assertEqual(self.cache.n_listed, n_listed)
+		self.assertEqual(self.util.makedirs("d/x/y", cache = self.cache),
+			list())
+		return
+
+	def test_samefile(self):
+		os.link("a", "d/hard")
+		self.assertTrue(self.util.samefile("a", "d/hard", cache = self.cache))
+		self.assertFalse(self.util.samefile("a", "d/b", cache = self.cache))
+		self.assertFalse(self.util.samefile("a", "x", cache = self.cache))
+		return
+
+	def test_journal_updates_cache(self):
+		journal = Journal("j.jsonl", cache = self.cache)
+		self.assertFalse(self.util.lexists("d/new/a", cache = self.cache))
+		journal.makedirs("d/new")
+		journal.move("a", "d/new")
+		journal.close()
+		self.assertTrue(self.util.lexists("d/new/a", cache = self.cache))
+		self.assertFalse(self.util.lexists("a", cache = self.cache))
+		return
+
+	def test_no_cache(self):
+		# without a cache, the filesystem is asked every time
+		self.assertFalse(self.util.lexists("x"))
+		open("x", "w").close()
+		self.assertTrue(self.util.lexists("x"))
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
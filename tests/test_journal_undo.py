@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.journal import Journal
+
+
+class TestJournalUndo(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmp.name)
+		return
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmp.cleanup()
+		return
+
+	@staticmethod
+	def _write(fname, data):
+		with open(fname, "w") as fp:
+			fp.write(data)
+		return
+
+	@staticmethod
+	def _read(fname):
+		with open(fname) as fp:
+			return fp.read()
+
+	def _listing(self):
+		return sorted(os.path.relpath(os.path.join(d, f))\
+			for d, _, files in os.walk(os.curdir) for f in files)
+
+	def test_sort_undo(self):
+		rows = [dict(file = "a.flac", album = "X"),
+			dict(file = "b.flac", album = "Y")]
+		for row in rows:
+			self._write(row["file"], row["file"])
+		self._write("m.jsonl", ("").join(json.dumps(r) + "\n" for r in rows))
+		res = api.run("sort_by_metadata", pattern = "%A",
+			manifest = "m.jsonl", journal = "j.jsonl")
+		self.assertEqual(res.failed, 0)
+		self.assertEqual(self._listing(),
+			["X/a.flac", "Y/b.flac", "j.jsonl", "m.jsonl"])
+		runs = Journal.read_runs("j.jsonl")
+		self.assertEqual(len(runs), 1)
+		self.assertEqual(sorted(r[0] for r in runs[0].records),
+			["mkdir", "mkdir", "move", "move"])
+		res = api.run("undo", journal = "j.jsonl")
+		self.assertEqual(res.failed, 0)
+		# files moved back, created directories removed, run dropped
+		self.assertEqual(self._listing(), ["a.flac", "b.flac", "j.jsonl",
+			"m.jsonl"])
+		self.assertEqual(Journal.read_runs("j.jsonl"), list())
+		return
+
+	def test_not_journaled_by_default(self):
+		self._write("a.flac", "a")
+		self._write("m.jsonl", json.dumps(dict(file = "a.flac",
+			album = "X")) + "\n")
+		api.run("sort_by_metadata", pattern = "%A", manifest = "m.jsonl")
+		self.assertEqual(self._listing(), ["X/a.flac", "m.jsonl"])
+		return
+
+	def test_overwritten_restored(self):
+		for name in ["a", "b", "c"]:
+			self._write(name, name)
+		journal = Journal("j.jsonl", name = "test")
+		journal.move("a", "b")
+		journal.copy("c", "b")
+		journal.close()
+		# both overwritten versions of b are kept aside
+		self.assertEqual(self._read("b"), "c")
+		self.assertEqual(len(self._listing()), 5)
+		self.assertEqual([r[0] for r in Journal.read_runs("j.jsonl")[0]\
+			.records], ["backup", "move", "backup", "copy"])
+		api.run("undo", journal = "j.jsonl")
+		self.assertEqual({f: self._read(f) for f in self._listing()\
+			if f != "j.jsonl"}, dict(a = "a", b = "b", c = "c"))
+		return
+
+	def test_changed_skipped(self):
+		self._write("a", "a")
+		journal = Journal("j.jsonl", name = "test")
+		journal.move("a", "b")
+		journal.close()
+		# b is replaced by another file (of another inode) after the run
+		self._write("b.new", "new")
+		os.replace("b.new", "b")
+		res = api.run("undo", journal = "j.jsonl")
+		self.assertIn("skipping: ", res.log)
+		self.assertEqual(self._read("b"), "new")
+		self.assertFalse(os.path.exists("a"))
+		# the failed record is kept for a forced retry
+		self.assertEqual(len(Journal.read_runs("j.jsonl")[0].records), 1)
+		api.run("undo", journal = "j.jsonl", force = True)
+		self.assertEqual(self._read("a"), "new")
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize.manifest import MetadataManifest
+from audio_organize.metadata import Metadata
+
+
+def as_dict(metadata) -> dict:
+	return {k: v.to_ffmetadata() for k, v in metadata.items()}
+
+
+class TestManifest(unittest.TestCase):
+	ITEMS = [
+		("01. a.flac", Metadata.parse_ffmetadata_str(";FFMETADATA1\n"
+			"album=Album, Vol. 1\nartist=A; B\ntitle=Tab\\\tand \"quote\"\n"
+			"track=1\n")),
+		("sub/02. b.flac", Metadata.parse_ffmetadata_str(";FFMETADATA1\n"
+			"album=Album, Vol. 1\ntitle=B\ntrack=2\nyear=2001\n"
+			"custom_tag=x\n")),
+	]
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def _round_trip(self, ext) -> list:
+		manifest = MetadataManifest(os.path.join(self.tmp.name,
+			"album." + ext))
+		with manifest.open_writer() as writer:
+			for fname, metadata in self.ITEMS:
+				writer.save(fname, metadata)
+		return [(f, as_dict(m)) for f, m in manifest.iter_items()]
+
+	def test_round_trip(self):
+		for ext in ["csv", "tsv"]:
+			with self.subTest(format = ext):
+				items = self._round_trip(ext)
+				# tags not in the header columns are not stored
+				expected = [(f, {k: v for k, v in as_dict(m).items()\
+					if k != "custom_tag"}) for f, m in self.ITEMS]
+				self.assertEqual(items, expected)
+		self.assertEqual(self._round_trip("jsonl"),
+			[(f, as_dict(m)) for f, m in self.ITEMS])
+		return
+
+	def test_existing_columns_kept(self):
+		fname = os.path.join(self.tmp.name, "album.tsv")
+		with open(fname, "w", encoding = "utf-8") as fp:
+			fp.write("file\ttitle\tcustom_tag\na.flac\tA\tx\n")
+		manifest = MetadataManifest(fname)
+		items = list(manifest.iter_items())
+		with manifest.open_writer(force = True) as writer:
+			for item in items:
+				writer.save(*item)
+		self.assertEqual([(f, as_dict(m)) for f, m in manifest.iter_items()],
+			[("a.flac", {"title": "A", "custom_tag": "x"})])
+		return
+
+	def test_writer_not_forced(self):
+		fname = os.path.join(self.tmp.name, "album.tsv")
+		open(fname, "w").close()
+		with self.assertRaises(IOError):
+			MetadataManifest(fname).open_writer()
+		return
+
+	def test_failed_write_keeps_manifest(self):
+		self._round_trip("tsv")
+		manifest = MetadataManifest(os.path.join(self.tmp.name, "album.tsv"))
+		with self.assertRaises(RuntimeError):
+			with manifest.open_writer(force = True) as writer:
+				writer.save(*self.ITEMS[0])
+				raise RuntimeError("interrupted")
+		self.assertEqual(len(list(manifest.iter_items())), 2)
+		self.assertEqual(os.listdir(self.tmp.name), ["album.tsv"])
+		return
+
+	def test_empty_cells_missing(self):
+		fname = os.path.join(self.tmp.name, "album.csv")
+		with open(fname, "w", encoding = "utf-8") as fp:
+			fp.write("file,title,track\na.flac,,3\n")
+		items = list(MetadataManifest(fname).iter_items())
+		self.assertEqual([(f, as_dict(m)) for f, m in items],
+			[("a.flac", {"track": "3"})])
+		return
+
+	def test_bad_rows(self):
+		rows = {"extra.csv": "file,title\na.flac,A,B\n",
+			"nofile.csv": "name,title\na.flac,A\n"}
+		for name, text in rows.items():
+			with self.subTest(name = name):
+				fname = os.path.join(self.tmp.name, name)
+				with open(fname, "w", encoding = "utf-8") as fp:
+					fp.write(text)
+				with self.assertRaises(MetadataManifest.ManifestError):
+					list(MetadataManifest(fname).iter_items())
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize.metadata import Metadata
+from audio_organize.normalize_metadata import NormalizeRules
+
+
+def parse(text) -> Metadata:
+	return Metadata.parse_ffmetadata_str(";FFMETADATA1\n" + text)
+
+
+class TestNormalizeRules(unittest.TestCase):
+	def _normalize(self, rules, text) -> dict:
+		metadata = parse(text)
+		NormalizeRules(rules).normalize(metadata)
+		return {k: v.value for k, v in metadata.items()}
+
+	def test_chain_order(self):
+		# each rule sees the result of the previous ones
+		rules = [{"transform": ["fullwidth", "collapse", "strip"]},
+			{"sub": [r"\s*\(Remaster(ed)?\)$", ""], "tags": ["title"]},
+			{"map": {"ost": "Soundtrack"}, "ignore_case": True,
+				"tags": "genre"},
+			{"transform": "title", "tags": ["album"]}]
+		self.assertEqual(self._normalize(rules,
+			"title=Ｓｏｎｇ  (Remastered)\n"
+			"genre= OST\nalbum=j-pop  hits\n"),
+			dict(title = "Song", genre = "Soundtrack", album = "J-Pop Hits"))
+		# in the other order, the map sees the untransformed value
+		self.assertEqual(self._normalize(rules[2:3] + rules[:1],
+			"genre= OST\n"), dict(genre = "OST"))
+		return
+
+	def test_tags_scope(self):
+		rules = [{"transform": "upper", "tags": ["album"]},
+			{"sub": ["a", "b"], "tags": "*"}]
+		self.assertEqual(self._normalize(rules, "album=abc\ntitle=abc\n"),
+			dict(album = "ABC", title = "bbc"))
+		return
+
+	def test_ignore_case(self):
+		rules = [{"sub": ["feat\\.", "ft."], "ignore_case": True}]
+		self.assertEqual(self._normalize(rules, "title=A (FEAT. B)\n"),
+			dict(title = "A (ft. B)"))
+		rules = [{"map": {"ost": "Soundtrack"}}]
+		self.assertEqual(self._normalize(rules, "genre=OST\n"),
+			dict(genre = "OST"))
+		return
+
+	def test_split_multi_valued(self):
+		rules = [{"split": "\\s*(?:&|feat\\.)\\s*", "tags": ["artist"]},
+			{"map": {"B.": "B"}}]
+		# items are split, mapped, and deduplicated in order
+		self.assertEqual(self._normalize(rules,
+			"artist=A & B.; B feat. C\n"), dict(artist = ["A", "B", "C"]))
+		# single-valued tags are not split
+		self.assertEqual(self._normalize([{"split": "&"}], "title=A & B\n"),
+			dict(title = "A & B"))
+		return
+
+	def test_changes(self):
+		metadata = parse("title=  \nalbum=X\ntrack=3\nartist=A; ; A\n")
+		changes = NormalizeRules([{"transform": "strip"}]).normalize(metadata)
+		# empty values are removed, numeric values are not normalized
+		self.assertEqual([(t, o.to_ffmetadata(), n and n.to_ffmetadata())\
+			for t, o, n in changes], [("artist", "A; ; A", "A"),
+			("title", "  ", None)])
+		self.assertEqual(sorted(metadata.keys()), ["album", "artist", "track"])
+		self.assertEqual(NormalizeRules([{"transform": "strip"}])\
+			.normalize(metadata), list())
+		return
+
+	def test_invalid(self):
+		for rules in [[{"sub": ["a", "b"], "map": {}}], [{"tags": "*"}],
+				["strip"], [{"transform": ["strip", "reverse"]}]]:
+			with self.subTest(rules = rules):
+				with self.assertRaises(ValueError):
+					NormalizeRules(rules)
+		with tempfile.TemporaryDirectory() as tmp:
+			fname = os.path.join(tmp, "rules.json")
+			with open(fname, "w") as fp:
+				json.dump({"transform": "strip"}, fp)
+			with self.assertRaises(ValueError):
+				NormalizeRules.from_file(fname)
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import unittest
+# custom lib
+from audio_organize.pattern_infer import PatternInference
+
+
+class TestPatternInference(unittest.TestCase):
+	def _infer(self, names) -> list:
+		inference = PatternInference(names)
+		return [(c.fmtstr, sorted(c.names)) for c in inference.clusters]
+
+	def test_track_title(self):
+		names = ["01 - Intro.flac", "02 - Song.flac", "03 - Outro.flac"]
+		self.assertEqual(self._infer(names), [("%t - %T.flac", names)])
+		return
+
+	def test_year_and_text_tags(self):
+		# repeated text is the artist, distinct text the title
+		names = ["X - 1999 - 01 Intro.flac", "X - 1999 - 02 Song.flac"]
+		self.assertEqual(self._infer(names), [("%a - %y - %t %T.flac", names)])
+		# not a year if out of range
+		self.assertEqual(self._infer(["X - 3000 - 01 A.flac",
+			"X - 3000 - 02 B.flac"])[0][0], "%a - %d - %t %T.flac")
+		return
+
+	def test_disc_track(self):
+		names = ["1-01 A.flac", "1-02 B.flac", "2-01 C.flac"]
+		self.assertEqual(self._infer(names), [("%d-%t %T.flac", names)])
+		return
+
+	def test_literals(self):
+		# constant fields beyond the tags are kept, '%' escaped
+		names = ["P - Q - R - 50% - 01 A.mp3", "P - Q - R - 50% - 02 B.mp3"]
+		self.assertEqual(self._infer(names),
+			[("%a - %A - R - %d%% - %t %T.mp3", names)])
+		return
+
+	def test_merge_and_unresolved(self):
+		# a title with a separator in it is merged into the larger cluster
+		names = ["01 - Intro.flac", "02 - Song - Live.flac",
+			"03 - Outro.flac"]
+		self.assertEqual(self._infer(names), [("%t - %T.flac", sorted(names))])
+		# varying text fields more than text tags
+		inference = PatternInference(["a - b - c - d.flac",
+			"e - f - g - h.flac"])
+		self.assertEqual(inference.clusters, list())
+		self.assertEqual(len(inference.unresolved), 1)
+		self.assertIsNone(inference.unresolved[0].parse("a - b - c - d.flac"))
+		return
+
+	def test_parse(self):
+		inference = PatternInference(["01 - Intro.flac", "02 - Song.flac"])
+		cluster = inference.get_cluster_by_name()["01 - Intro.flac"]
+		metadata = cluster.parse("07 - Song - Live.flac")
+		self.assertEqual(metadata["track"].value, 7)
+		self.assertEqual(metadata["title"].value, "Song - Live")
+		# not matching, or invalid track number
+		self.assertIsNone(cluster.parse("Intro.flac"))
+		self.assertIsNone(cluster.parse("00 - Intro.flac"))
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
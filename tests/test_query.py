@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.cache import FileResultCache
+from audio_organize.metadata import Metadata
+from audio_organize.query import MetadataIndex, MetadataQuery
+
+
+ENTRIES = [
+	("a.flac", "album=Alpha\nartist=X; Y\ngenre=Soundtrack\nyear=1999\n"
+		"track=1\nnum=03\n"),
+	("b.flac", "album=Beta\nartist=Y\ngenre=soundtrack\nyear=2005\n"
+		"track=2\ndisc=1\n"),
+	("c.flac", "album=Gamma \"G\"\nartist=Z\ngenre=Rock\ntrack=3\n"),
+	("d.mp3", "album=alpha\nartist=X\nyear=1980\nnum=3\n"),
+]
+
+
+class TestMetadataQuery(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.index = MetadataIndex()
+		for fname, text in ENTRIES:
+			cls.index.add(fname, Metadata.parse_ffmetadata_str(
+				";FFMETADATA1\n" + text))
+		return
+
+	def select(self, expr) -> list:
+		return [self.index.fnames[r]\
+			for r in MetadataQuery(expr).select(self.index)]
+
+	def test_comparisons(self):
+		cases = {
+			# case-insensitive
+			"genre=soundtrack": ["a.flac", "b.flac"],
+			"album=ALPHA": ["a.flac", "d.mp3"],
+			# numeric when the value is a number
+			"num=3": ["a.flac", "d.mp3"],
+			"year<2000": ["a.flac", "d.mp3"],
+			"year>=1999": ["a.flac", "b.flac"],
+			"year>2005": [],
+			# a missing tag never matches, also for !=
+			"year!=1999": ["b.flac", "d.mp3"],
+			"genre!=rock": ["a.flac", "b.flac"],
+			# multi-valued tags match by any value
+			"artist=y": ["a.flac", "b.flac"],
+			"artist~'^[xz]$'": ["a.flac", "c.flac", "d.mp3"],
+			"artist!~x": ["b.flac", "c.flac"],
+			"album=\"Gamma \\\"G\\\"\"": ["c.flac"],
+			"file~'\\.mp3$'": ["d.mp3"],
+			"disc": ["b.flac"],
+		}
+		for expr, expected in cases.items():
+			with self.subTest(expr = expr):
+				self.assertEqual(self.select(expr), expected)
+		return
+
+	def test_precedence(self):
+		cases = {
+			# and binds tighter than or
+			"genre=rock or artist=x and year<1990": ["c.flac", "d.mp3"],
+			"artist=x and year<1990 or genre=rock": ["c.flac", "d.mp3"],
+			"(genre=rock or artist=x) and year<1990": ["d.mp3"],
+			# not binds tighter than and
+			"not disc and genre=soundtrack": ["a.flac"],
+			"not (disc or genre=soundtrack)": ["c.flac", "d.mp3"],
+			"not not disc": ["b.flac"],
+			# keywords are case-insensitive
+			"artist=x AND NOT year": [],
+		}
+		for expr, expected in cases.items():
+			with self.subTest(expr = expr):
+				self.assertEqual(self.select(expr), expected)
+		return
+
+	def test_syntax_errors(self):
+		for expr in ["genre=", "(genre", "genre rock", "=rock", "genre=)",
+				"artist~'['", "genre & rock", "and", ""]:
+			with self.subTest(expr = expr):
+				with self.assertRaises(MetadataQuery.QuerySyntaxError):
+					MetadataQuery(expr)
+		return
+
+	def test_index_updated(self):
+		index = MetadataIndex()
+		index.add("a.flac", Metadata.parse_ffmetadata_str(
+			";FFMETADATA1\ngenre=Rock\n"))
+		query = MetadataQuery("genre=rock")
+		self.assertEqual(query.select(index), [0])
+		# indexes built by the first query are rebuilt after adding
+		index.add("b.flac", Metadata.parse_ffmetadata_str(
+			";FFMETADATA1\ngenre=rock\n"))
+		self.assertEqual(query.select(index), [0, 1])
+		return
+
+
+class TestQueryIndex(unittest.TestCase):
+	def test_empty_sidecar_cached(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			files = [os.path.join(tmp, n) for n in ["a.flac", "b.flac"]]
+			for fname, text in zip(files, ["genre=Rock\n", ""]):
+				with open(fname + ".metadata", "w") as fp:
+					fp.write(";FFMETADATA1\n" + text)
+			index = os.path.join(tmp, "index.jsonl")
+			output = os.path.join(tmp, "out.list")
+			for i in range(2):
+				api.run("query", files, query = "genre", index = index,
+					output = output)
+				with open(output) as fp:
+					self.assertEqual(fp.read(), files[0] + "\n")
+			# a sidecar without tags is cached as well
+			cache = FileResultCache.load(index)
+			self.assertEqual(cache.get_result(files[1] + ".metadata"), dict())
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
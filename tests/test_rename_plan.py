@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import tempfile
+import unittest
+# custom lib
+from audio_organize.rename_plan import RenamePlan
+
+
+class TestRenamePlan(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmp.name)
+		return
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmp.cleanup()
+		return
+
+	@staticmethod
+	def _create(*names):
+		for name in names:
+			with open(name, "w") as fp:
+				fp.write(name)
+		return
+
+	@staticmethod
+	def _apply(plan) -> dict:
+		"""
+		do the renames stage by stage, returns {file: content}; targets are
+		free unless the plan is forced
+		"""
+		for stage in plan.stages:
+			# renames in a stage are independent of each other
+			srcs = [s for s, d in stage]
+			dsts = [d for s, d in stage]
+			assert not (set(srcs) & set(dsts))
+			assert plan.force or not any(os.path.exists(d) for d in dsts)
+			for src, dst in stage:
+				os.rename(src, dst)
+		ret = dict()
+		for name in os.listdir():
+			with open(name) as fp:
+				ret[name] = fp.read()
+		return ret
+
+	def test_chain(self):
+		self._create("a", "b")
+		plan = RenamePlan([("a", "b"), ("b", "c")])
+		# the tail first
+		self.assertEqual(plan.stages, [[("b", "c")], [("a", "b")]])
+		self.assertEqual(plan.skipped, list())
+		self.assertEqual(self._apply(plan), dict(b = "a", c = "b"))
+		return
+
+	def test_cycle(self):
+		self._create("a", "b", "c")
+		plan = RenamePlan([("a", "b"), ("b", "c"), ("c", "a")])
+		self.assertEqual(len(plan), 4)
+		# one file of the cycle is staged at a temporary name
+		(src, temp), = plan.stages[0]
+		self.assertEqual(src, "a")
+		self.assertRegex(temp, r"^a\.[0-9a-f]{8}\.tmp$")
+		self.assertEqual(plan.stages[-1], [(temp, "b")])
+		self.assertEqual(self._apply(plan), dict(a = "c", b = "a", c = "b"))
+		return
+
+	def test_cycles_and_chains_parallel(self):
+		self._create("a", "b", "c", "d", "e")
+		plan = RenamePlan([("a", "b"), ("b", "a"), ("c", "d"), ("d", "x"),
+			("e", "y")])
+		self.assertEqual(len(plan.stages), 4)
+		self.assertEqual(sorted(plan.stages[1]),
+			[("b", "a"), ("d", "x"), ("e", "y")])
+		self.assertEqual(self._apply(plan),
+			dict(a = "b", b = "a", d = "c", x = "d", y = "e"))
+		return
+
+	def test_existing(self):
+		self._create("a", "b", "c")
+		# b is not renamed away, so a is blocked, and so is c into a
+		plan = RenamePlan([("a", "b"), ("c", "a")])
+		self.assertEqual(sorted(plan.skipped),
+			[("a", "b", "existing"), ("c", "a", "existing")])
+		self.assertEqual(len(plan), 0)
+		# overwritten with force
+		plan = RenamePlan([("a", "b"), ("c", "a")], force = True)
+		self.assertEqual(plan.skipped, list())
+		self.assertEqual(self._apply(plan), dict(a = "c", b = "a"))
+		return
+
+	def test_same_target(self):
+		self._create("a", "b", "c")
+		plan = RenamePlan([("a", "x"), ("./b", "x"), ("c", "c"),
+			("a", "y")])
+		self.assertEqual(plan.stages, [[("a", "x")]])
+		self.assertEqual(len(plan.skipped), 1)
+		src, dst, reason = plan.skipped[0]
+		self.assertEqual((src, dst), ("./b", "x"))
+		self.assertTrue(re.match("same target as a$", reason))
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.replaygain import LoudnessBlocks
+
+
+def make_blocks(*runs) -> LoudnessBlocks:
+	"""
+	blocks from (loudness in LUFS, number of blocks) runs
+	"""
+	new = LoudnessBlocks()
+	for lufs, n in runs:
+		new.energies.extend([LoudnessBlocks.loudness_to_energy(lufs)] * n)
+	return new
+
+
+# as logged by ffmpeg -af ebur128=peak=true:framelog=info
+EBUR128_LOG = """\
+[Parsed_ebur128_0 @ 0x5581] t: 0.4        TARGET:-23 LUFS    M: -20.0 \
+S:-120.7     I: -20.0 LUFS       LRA:   0.0 LU  FTPK: -1.2 dBFS  TPK: -1.2 dBFS
+[Parsed_ebur128_0 @ 0x5581] t: 0.5        TARGET:-23 LUFS    M: -20.0 \
+S:-120.7     I: -20.0 LUFS       LRA:   0.0 LU  FTPK: -1.0 dBFS  TPK: -1.0 dBFS
+[Parsed_ebur128_0 @ 0x5581] t: 0.6        TARGET:-23 LUFS    M:-120.7 \
+S:-120.7     I: -20.0 LUFS       LRA:   0.0 LU  FTPK: -inf dBFS  TPK: -1.0 dBFS
+[Parsed_ebur128_0 @ 0x5581] Summary:
+
+  Integrated loudness:
+    I:         -20.0 LUFS
+    Threshold: -30.0 LUFS
+
+  True peak:
+    Peak:       -1.0 dBFS
+"""
+
+
+class TestLoudnessBlocks(unittest.TestCase):
+	def test_energy_conversion(self):
+		# BS.1770: a block at -0.691 LUFS has unit mean square energy
+		self.assertAlmostEqual(LoudnessBlocks.loudness_to_energy(-0.691), 1.0)
+		self.assertAlmostEqual(LoudnessBlocks.energy_to_loudness(
+			LoudnessBlocks.loudness_to_energy(-23.0)), -23.0)
+		return
+
+	def test_constant(self):
+		self.assertAlmostEqual(make_blocks((-23.0, 50))\
+			.integrated_loudness(), -23.0)
+		return
+
+	def test_absolute_gate(self):
+		# blocks at or below -70 LUFS are not counted
+		self.assertAlmostEqual(make_blocks((-23.0, 10), (-80.0, 90),
+			(-70.0, 5)).integrated_loudness(), -23.0)
+		self.assertIsNone(make_blocks((-80.0, 10)).integrated_loudness())
+		return
+
+	def test_relative_gate(self):
+		# the relative gate is 10 LU below the absolute-gated loudness,
+		# -23.0 here (half of the blocks at -20), so -40 blocks are gated
+		self.assertAlmostEqual(make_blocks((-20.0, 10), (-40.0, 10))\
+			.integrated_loudness(), -20.0)
+		# -30 blocks are above the gate at -32.6 and counted
+		self.assertAlmostEqual(make_blocks((-20.0, 10), (-30.0, 10))\
+			.integrated_loudness(), -22.596, places = 3)
+		return
+
+	def test_album_aggregation(self):
+		# album loudness is over all blocks, not the mean of track loudness
+		album = make_blocks((-20.0, 10)).extend(make_blocks((-30.0, 30)))
+		album.peak = 0.5
+		self.assertEqual(len(album.energies), 40)
+		# energy mean (10 * 1 + 30 * 0.1) / 40 relative to -20 LUFS
+		self.assertAlmostEqual(album.integrated_loudness(),
+			-20.0 + 10 * math.log10(0.325))
+		self.assertEqual(album.extend(LoudnessBlocks()).peak, 0.5)
+		return
+
+	def test_from_ffmpeg_log(self):
+		blocks = LoudnessBlocks.from_ffmpeg_ebur128_log(EBUR128_LOG)
+		self.assertEqual(len(blocks.energies), 3)
+		self.assertAlmostEqual(blocks.integrated_loudness(), -20.0)
+		self.assertAlmostEqual(blocks.peak, 10 ** (-1.0 / 20))
+		return
+
+
+class TestReplayGainFailure(unittest.TestCase):
+	def test_stderr_logged(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			ffmpeg = os.path.join(tmp, "ffmpeg")
+			with open(ffmpeg, "w") as fp:
+				fp.write("#!/bin/sh\necho 'a.flac: Invalid data found' >&2\n"
+					"exit 1\n")
+			os.chmod(ffmpeg, 0o755)
+			manifest = os.path.join(tmp, "album.jsonl")
+			with open(manifest, "w") as fp:
+				fp.write(json.dumps(dict(file = "a.flac", title = "A")) + "\n")
+			res = api.run("replaygain", manifest = manifest, ffmpeg = ffmpeg)
+		self.assertEqual(res.failed, 1)
+		self.assertIn("a.flac: Invalid data found\n[NonZeroReturn]", res.log)
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import collections
+import threading
+import time
+import unittest
+# custom lib
+from audio_organize.scheduler import DeviceJobs, DeviceScheduler
+
+
+class FakeDeviceScheduler(DeviceScheduler):
+	"""
+	device of a path is its first component, e.g. 'hdd1/a.flac'
+	"""
+	def get_device(self, path):
+		dev = path.split("/")[0]
+		return dev, dev.rstrip("0123456789")
+
+
+class TestDeviceJobs(unittest.TestCase):
+	def test_parse(self):
+		self.assertEqual(DeviceJobs("hdd=2,network=8"),
+			dict(hdd = 2, network = 8))
+		self.assertEqual(DeviceJobs(""), dict())
+		for s in ["tape=1", "hdd", "hdd=0"]:
+			with self.subTest(s = s):
+				with self.assertRaises(ValueError):
+					DeviceJobs(s)
+		return
+
+	def test_limits(self):
+		scheduler = DeviceScheduler(8)
+		# io-bound default
+		self.assertEqual(scheduler.get_limit("hdd"), 1)
+		self.assertEqual(scheduler.get_limit("network"), 4)
+		self.assertEqual(scheduler.get_limit("ssd"), 8)
+		# an explicit setting replaces the default, capped by jobs
+		scheduler = DeviceScheduler(8, DeviceJobs("ssd=16"))
+		self.assertEqual(scheduler.get_limit("hdd"), 8)
+		self.assertEqual(scheduler.get_limit("ssd"), 8)
+		self.assertEqual(DeviceScheduler(8, DeviceJobs()).get_limit("hdd"), 8)
+		return
+
+
+class TestDeviceScheduler(unittest.TestCase):
+	def _run(self, scheduler, paths):
+		lock = threading.Lock()
+		active, peak = collections.Counter(), collections.Counter()
+		def func(path):
+			dev = path.split("/")[0]
+			with lock:
+				active[dev] += 1
+				active[None] += 1
+				peak[dev] = max(peak[dev], active[dev])
+				peak[None] = max(peak[None], active[None])
+			time.sleep(0.01)
+			with lock:
+				active[dev] -= 1
+				active[None] -= 1
+			return path
+		results = list(scheduler.iter_run(func, paths))
+		return results, peak
+
+	def test_per_device_limits(self):
+		paths = ["hdd%d/%02d.flac" % (i % 2, i) for i in range(12)]\
+			+ ["ssd1/%02d.flac" % i for i in range(12)]
+		results, peak = self._run(FakeDeviceScheduler(4,
+			DeviceJobs("hdd=1,ssd=3")), paths)
+		# results in input order
+		self.assertEqual(results, paths)
+		self.assertEqual(peak["hdd0"], 1)
+		self.assertEqual(peak["hdd1"], 1)
+		self.assertLessEqual(peak["ssd1"], 3)
+		self.assertLessEqual(peak[None], 4)
+		# two disks and the ssd still run side by side
+		self.assertGreater(peak[None], 2)
+		return
+
+	def test_no_limits(self):
+		paths = ["hdd0/%02d.flac" % i for i in range(16)]
+		results, peak = self._run(FakeDeviceScheduler(4, DeviceJobs()),
+			paths)
+		self.assertEqual(results, paths)
+		self.assertGreater(peak["hdd0"], 1)
+		self.assertLessEqual(peak["hdd0"], 4)
+		return
+
+	def test_missing_path_device(self):
+		# outputs not existing yet are on the device of their parent
+		scheduler = DeviceScheduler(2)
+		self.assertEqual(scheduler.get_device("/nonexistent/dir/a.flac")[0],
+			scheduler.get_device("/")[0])
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.sort_by_metadata import SortDirs
+
+
+class TestSortDirs(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmp.name)
+		return
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmp.cleanup()
+		return
+
+	def test_shard_dirs(self):
+		self.assertEqual(SortDirs(shard = "letter", shard_levels = 2)\
+			.get_shard_dirs("ab c"), ["A", "AB"])
+		self.assertEqual(SortDirs(shard = "letter").get_shard_dirs("(x)"),
+			["_"])
+		self.assertEqual(len(SortDirs(shard = "hash", shard_levels = 2)\
+			.get_shard_dirs("x")[1]), 2)
+		return
+
+	def test_place_reserves(self):
+		os.makedirs("A")
+		open(os.path.join("A", "old.flac"), "w").close()
+		dirs = SortDirs(dry_run = True)
+		self.assertEqual(dirs.place("A", ["old.flac", "new.flac"]),
+			("A", ["old.flac"], list()))
+		# placed by an earlier entry, not an existing file
+		self.assertEqual(dirs.place("A", ["new.flac"]),
+			("A", list(), ["new.flac"]))
+		return
+
+	def test_overflow(self):
+		dirs = SortDirs(max_entries = 2, dry_run = True)
+		places = [dirs.place("A", ["%d.flac" % i])[0] for i in range(5)]
+		self.assertEqual(places, ["A", "A", "A (2)", "A (2)", "A (3)"])
+		return
+
+
+class TestSortByMetadata(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.cwd = os.getcwd()
+		os.chdir(self.tmp.name)
+		return
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.tmp.cleanup()
+		return
+
+	def test_same_target_not_overwritten(self):
+		# two sources of the same name sorted into one directory in parallel
+		rows = [dict(file = "%s/a.flac" % d, album = "X") for d in "pq"]
+		for row in rows:
+			os.makedirs(os.path.dirname(row["file"]))
+			with open(row["file"], "w") as fp:
+				fp.write(row["file"])
+		with open("m.jsonl", "w") as fp:
+			fp.write(("").join(json.dumps(r) + "\n" for r in rows))
+		res = api.run("sort_by_metadata", pattern = "%A", manifest = "m.jsonl",
+			force = True, jobs = 2)
+		self.assertEqual(res.failed, 1)
+		self.assertIn("[DuplicateOutput]", res.log)
+		# one is sorted, the other stays where it was
+		with open("X/a.flac") as fp:
+			sorted_from = fp.read()
+		self.assertEqual([os.path.exists(r["file"]) for r in rows],
+			[r["file"] != sorted_from for r in rows])
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
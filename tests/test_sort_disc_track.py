@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.sort_disc_track import SubprogSortDiscTrack
+
+
+class TestSortDiscTrack(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.manifest = os.path.join(self.tmp.name, "album.jsonl")
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def _run(self, rows, **options) -> dict:
+		"""
+		returns {file: (disc, track)} after sorting
+		"""
+		with open(self.manifest, "w", encoding = "utf-8") as fp:
+			for row in rows:
+				fp.write(json.dumps(row) + "\n")
+		self.res = api.run("sort_disc_track", manifest = self.manifest,
+			**options)
+		with open(self.manifest, "r", encoding = "utf-8") as fp:
+			rows = [json.loads(l) for l in fp]
+		return {r["file"]: (r.get("disc"), r.get("track")) for r in rows}
+
+	def test_split_by_bounds(self):
+		bounds = SubprogSortDiscTrack._get_disc_bounds([3, 2])
+		self.assertEqual(bounds, [3, 5])
+		self.assertEqual([SubprogSortDiscTrack._split_by_bounds(t, bounds)\
+			for t in range(1, 6)], [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2)])
+		return
+
+	def test_by_list(self):
+		rows = [dict(file = "%d.flac" % i, track = str(i)) for i in (1, 4, 6)]
+		sorted_ = self._run(rows, num_track_list = "3,2")
+		self.assertEqual(sorted_, {"1.flac": ("1", "1"),
+			"4.flac": ("2", "1"), "6.flac": (None, "6")})
+		# out of bounds entries are skipped and kept as they are
+		self.assertIn("skipping: 6.flac", self.res.log)
+		return
+
+	def test_track_offset_bounds(self):
+		rows = [dict(file = "%d.flac" % i, track = str(i)) for i in (1, 2, 6)]
+		sorted_ = self._run(rows, num_track_list = "3,2", track_offset = -1)
+		self.assertEqual(sorted_, {"1.flac": (None, "1"),
+			"2.flac": ("1", "1"), "6.flac": ("2", "2")})
+		self.assertIn("skipping: 1.flac", self.res.log)
+		return
+
+	def test_by_album_inferred(self):
+		rows = [dict(file = "cd%d/%d.flac" % (d, t), album = "A",
+			track = str(t)) for d, t in [(1, 1), (1, 2), (2, 3)]]
+		rows.append(dict(file = "x/9.flac", album = "B", track = "9"))
+		sorted_ = self._run(rows, by_album = True)
+		self.assertEqual(sorted_, {"cd1/1.flac": ("1", "1"),
+			"cd1/2.flac": ("1", "2"), "cd2/3.flac": ("2", "1"),
+			"x/9.flac": (None, "9")})
+		self.assertIn("skipping album: B", self.res.log)
+		return
+
+	def test_num_track_list_required(self):
+		with self.assertRaises(ValueError):
+			api.get_args("sort_disc_track", dict())
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import unittest
+# custom lib
+from audio_organize import api
+from audio_organize.metadata import Metadata
+from audio_organize.stats import LibraryStats
+
+
+ENTRIES = [
+	("a.flac", "album=X\nartist=P; Q\nyear=1999\n", 100, 60.0, "flac"),
+	("b.flac", "album=X\nartist=Q\n", 200, 30.0, "flac"),
+	("c.mp3", "album=Y\ntitle=C\n", 50, 10.0, "mp3"),
+	("d.ogg", "year=1999\n", 10, 5.0, None),
+]
+
+
+class TestLibraryStats(unittest.TestCase):
+	def setUp(self):
+		self.stats = LibraryStats()
+		for fname, text, size, duration, codec in ENTRIES:
+			self.stats.add(fname, Metadata.parse_ffmetadata_str(
+				";FFMETADATA1\n" + text), size, duration, codec)
+		return
+
+	def test_group_by(self):
+		Aggregate = LibraryStats.Aggregate
+		# by decreasing file count, ties by value
+		self.assertEqual(list(self.stats.group_by("album").items()),
+			[("X", Aggregate(2, 90.0, 300)), ("Y", Aggregate(1, 10.0, 50))])
+		# multi-valued tags count into each of their values
+		self.assertEqual(self.stats.group_by("artist"),
+			dict(Q = Aggregate(2, 90.0, 300), P = Aggregate(1, 60.0, 100)))
+		# numeric values are keyed by their string
+		self.assertEqual(self.stats.group_by("year"),
+			{"1999": Aggregate(2, 65.0, 110)})
+		self.assertEqual(list(self.stats.group_by("codec")),
+			["flac", "mp3", LibraryStats.UNKNOWN])
+		self.assertEqual(self.stats.group_by("genre"), dict())
+		self.assertEqual(self.stats.total(), Aggregate(4, 105.0, 360))
+		return
+
+	def test_missing(self):
+		# columns of tags first seen in later entries are filled for earlier
+		self.assertEqual(self.stats.missing("title"),
+			["a.flac", "b.flac", "d.ogg"])
+		self.assertEqual(self.stats.missing("album"), ["d.ogg"])
+		self.assertEqual(self.stats.missing("genre"),
+			[e[0] for e in ENTRIES])
+		self.assertEqual(self.stats.missing("codec"), list())
+		self.assertTrue(all(len(c) == len(self.stats)\
+			for c in self.stats.columns.values()))
+		return
+
+
+class TestStatsReport(unittest.TestCase):
+	def test_json(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			files = list()
+			for fname, text, size, _, _ in ENTRIES:
+				fname = os.path.join(tmp, fname)
+				with open(fname, "wb") as fp:
+					fp.write(bytes(size))
+				with open(fname + ".metadata", "w") as fp:
+					fp.write(";FFMETADATA1\n" + text)
+				files.append(fname)
+			output = os.path.join(tmp, "stats.json")
+			res = api.run("stats", files, no_probe = True, output = output,
+				group_by = "album", require = "title,album", cache = "")
+			self.assertEqual(res.failed, 0)
+			with open(output) as fp:
+				report = json.load(fp)
+		self.assertEqual(report["total"], dict(files = 4, duration = 0.0,
+			bytes = 360))
+		self.assertEqual(report["album"]["X"], dict(files = 2,
+			duration = 0.0, bytes = 300))
+		# without probing, the codec is the extension
+		self.assertEqual(list(report["codec"]), ["flac", "mp3", "ogg"])
+		self.assertEqual(report["missing"], dict(title = files[:2] + files[3:],
+			album = files[3:]))
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+# custom lib
+from audio_organize.metadata import Metadata
+from audio_organize.work_queue import WorkQueue
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestWorkQueue(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.queue = WorkQueue(os.path.join(self.tmp.name, "queue"))
+		return
+
+	def tearDown(self):
+		self.tmp.cleanup()
+		return
+
+	def test_claim_finish(self):
+		n_items = self.queue.create(["dump_metadata"],
+			["%d.flac" % i for i in range(10)], chunk_size = 4)
+		self.assertEqual(n_items, 3)
+		leases = [self.queue.claim("w%d" % i) for i in range(4)]
+		self.assertIsNone(leases[3])
+		self.assertEqual(len(set(l.item for l in leases[:3])), 3)
+		for lease in leases[:3]:
+			self.assertTrue(self.queue.renew(lease))
+			self.assertTrue(self.queue.finish(lease, True))
+		self.assertEqual(self.queue.get_counts(),
+			dict(todo = 0, leased = 0, done = 3, failed = 0))
+		return
+
+	def test_lease_lost(self):
+		self.queue.create(["dump_metadata"], ["a.flac"], lease = 60)
+		lease = self.queue.claim("w1")
+		# not renewed within the lease time
+		old = time.time() - 120
+		os.utime(lease.path, (old, old))
+		self.assertEqual(self.queue.requeue_expired(), [lease.item])
+		self.assertFalse(self.queue.renew(lease))
+		other = self.queue.claim("w2")
+		self.assertEqual(other.item, lease.item)
+		self.assertFalse(self.queue.finish(lease, True))
+		self.assertTrue(self.queue.finish(other, True))
+		self.assertEqual(self.queue.get_counts()["done"], 1)
+		return
+
+
+class TestWorkQueueWorkers(unittest.TestCase):
+	"""
+	several 'queue work' processes on one queue running normalize_metadata,
+	which needs no external programs
+	"""
+	N_FILES = 40
+	N_WORKERS = 4
+
+	def _run(self, *argv, **kw):
+		env = dict(os.environ, PYTHONPATH = ROOT)
+		return subprocess.Popen([sys.executable, "-m", "audio_organize"]\
+			+ list(argv), env = env, stdin = subprocess.DEVNULL,
+			stderr = subprocess.PIPE, **kw)
+
+	def test_workers(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			fnames = [os.path.join(tmp, "%02d.flac" % i)\
+				for i in range(self.N_FILES)]
+			for fname in fnames:
+				with open(Metadata.standard_ffmetadata(fname), "w",
+						encoding = "utf-8") as fp:
+					fp.write(";FFMETADATA1\ntitle=t %s\n" % fname)
+			with open(os.path.join(tmp, "list"), "w") as fp:
+				fp.write(("").join(f + "\n" for f in fnames))
+			with open(os.path.join(tmp, "rules.json"), "w") as fp:
+				json.dump([{"tags": ["title"], "transform": "upper"}], fp)
+			queue = os.path.join(tmp, "queue")
+			proc = self._run("queue", "submit", queue, "-l",
+				os.path.join(tmp, "list"), "--chunk-size", "3", "-e",
+				"normalize_metadata -r %s" % os.path.join(tmp, "rules.json"),
+				"--log-file", os.path.join(tmp, "submit.log"))
+			self.assertEqual(proc.wait(), 0, proc.stderr.read())
+			proc.stderr.close()
+			workers = [self._run("queue", "work", queue, "--poll", "0.1",
+				"--log-file", os.path.join(tmp, "work%d.log" % i))\
+				for i in range(self.N_WORKERS)]
+			n_run = 0
+			for proc in workers:
+				err = proc.communicate()[1].decode("utf-8")
+				self.assertEqual(proc.returncode, 0, err)
+				n_run += int(re.search(r"worker \S+: (\d+) items run",
+					err).group(1))
+			n_items = (self.N_FILES + 2) // 3
+			# each item is run by exactly one worker
+			self.assertEqual(n_run, n_items)
+			self.assertEqual(WorkQueue(queue).get_counts(),
+				dict(todo = 0, leased = 0, done = n_items, failed = 0))
+			for fname in fnames:
+				metadata = Metadata.read_ffmetadata(
+					Metadata.standard_ffmetadata(fname))
+				self.assertEqual(metadata["title"].value,
+					("t %s" % fname).upper())
+		return
+
+
+if __name__ == "__main__":
+	unittest.main()